@@ -8,6 +8,63 @@ class Settings(BaseSettings):
     MAX_UPLOAD_SIZE_MB: int = 10
     FACE_RECOGNITION_TOLERANCE: float = 0.5
     CORS_ORIGINS: str = "*"
+    # Nearest-neighbour backend for unscoped matching: "brute" or "ivf"
+    FACE_MATCHER_BACKEND: str = "brute"
+    FACE_MATCHER_MIN_ROWS: int = 5000
+    FACE_IVF_LISTS: int = 0
+    FACE_IVF_PROBE: int = 8
+    # Search every class when a class-bound camera finds no match in its own class
+    FACE_MATCH_GLOBAL_FALLBACK: bool = False
+    # Face detection runs on a frame resized by this factor; encodings use full resolution
+    FACE_DETECTION_SCALE: float = 0.5
+    FACE_DETECTION_MODEL: str = "hog"
+    FACE_DETECTION_UPSAMPLE: int = 1
+    # "thread" or "process"; process mode escapes the GIL for decode/encode work
+    FACE_ENCODE_EXECUTOR: str = "thread"
+    FACE_ENCODE_WORKERS: int = 0
+    # Rows per server-side cursor fetch when loading encodings at startup
+    FACE_LOAD_CHUNK_SIZE: int = 5000
+    # Encoding snapshot directory for warm starts (empty = disabled); use a persistent volume.
+    # Writing a snapshot prunes deletion tombstones older than the one it replaces, so every
+    # server using the database must share this directory
+    FACE_SNAPSHOT_DIR: str = ""
+    # Share one mapped encoding matrix between uvicorn workers (e.g. /dev/shm/attendance; empty = off).
+    # Requires CACHE_SYNC_ENABLED and a directory other than FACE_SNAPSHOT_DIR
+    FACE_SHARED_INDEX_DIR: str = ""
+    FACE_SHARED_POLL_MS: int = 500
+    # Scoring of students with several face templates: "min", "mean_topk" or "centroid"
+    FACE_TEMPLATE_SCORING: str = "min"
+    FACE_TEMPLATE_TOP_K: int = 3
+    # Reject matches whose runner-up student is within this distance of the best (0 = off)
+    FACE_MATCH_MARGIN: float = 0.0
+    # Apply students/classes/api_keys changes from LISTEN/NOTIFY (triggers from scripts/init_db.py)
+    CACHE_SYNC_ENABLED: bool = True
+    # Global recognition admission control across all cameras
+    RECOGNITION_MAX_IN_FLIGHT: int = 4
+    RECOGNITION_LATENCY_BUDGET_MS: int = 2000
+    # Skip recognition when a camera's thumbnail barely changed (mean grey level difference; 0 = off)
+    MOTION_GATE_THRESHOLD: float = 4.0
+    MOTION_GATE_SIZE: int = 32
+    MOTION_GATE_MAX_IDLE_S: float = 30.0
+    # Reuse an identified face's identity while its box stays put (IoU), for up to N frames (0 = off)
+    FACE_TRACK_MAX_REUSE: int = 5
+    FACE_TRACK_MIN_IOU: float = 0.5
+    # Faces recognized per frame, largest first
+    FACE_MAX_FACES: int = 4
+    # Batch face descriptors across cameras for up to N ms (0 = off; tune with scripts/benchmark_embedding_batcher.py)
+    FACE_EMBED_BATCH_WINDOW_MS: float = 0.0
+    FACE_EMBED_BATCH_SIZE: int = 16
+    # Repeat recognitions of a student within this window are not recorded again
+    ATTENDANCE_COOLDOWN_SECONDS: int = 300
+    # Write-behind batching of attendance inserts
+    ATTENDANCE_FLUSH_INTERVAL_MS: int = 200
+    ATTENDANCE_BATCH_SIZE: int = 200
+    ATTENDANCE_QUEUE_SIZE: int = 10000
+    ATTENDANCE_WRITE_RETRIES: int = 3
+    # Serve per-stage latency histograms and counters at /metrics (Prometheus text format)
+    METRICS_ENABLED: bool = True
+    # Devices given their own label on the per-device camera counters; later ones share device="other"
+    METRICS_MAX_DEVICES: int = 100
     
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -13,18 +13,33 @@ from app.services.socketio_service import sio
 from app.database import init_db_pool, close_db_pool
 from app.services.face_service import face_service
 from app.services.auth_service import load_api_keys
+from app.services.attendance_service import attendance_writer
+from app.services.cache_sync import cache_sync
+from app.services.shared_index import check_shared_config
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting up...")
+    check_shared_config(settings.FACE_SHARED_INDEX_DIR, settings.FACE_SNAPSHOT_DIR, settings.CACHE_SYNC_ENABLED)
     await init_db_pool()
-    await face_service.load_all_encodings()
-    await load_api_keys()
+    if settings.CACHE_SYNC_ENABLED:
+        # Listens for change notifications, then loads both caches
+        await cache_sync.start()
+    else:
+        await face_service.load_all_encodings()
+        await load_api_keys()
+    face_service.start_shared_sync()
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    attendance_writer.start()
     yield
     # Shutdown
     print("Shutting down...")
+    # Drain queued attendance while the pool is still open
+    await attendance_writer.stop()
+    await cache_sync.stop()
+    if face_service.embedding_batcher is not None:
+        await face_service.embedding_batcher.stop()
     face_service.shutdown()
     await close_db_pool()
 
@@ -72,6 +87,10 @@ app.include_router(students.router)
 app.include_router(api_keys.router)
 app.include_router(attendance.router)
 
+if settings.METRICS_ENABLED:
+    from app.routers import metrics
+    app.include_router(metrics.router)
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
@@ -19,9 +19,39 @@ class StudentModel(Base):
     image_path = Column(Text)
     face_encoding = Column(BYTEA)
     created_at = Column(TIMESTAMP, server_default=func.now())
+    # Bumped by the students_touch_updated_at trigger (see scripts/init_db.py)
+    updated_at = Column(TIMESTAMP, server_default=func.now())
     
     __table_args__ = (
         Index('idx_students_class', 'class_id'),
+        Index('idx_students_updated_at', 'updated_at'),
+    )
+
+class StudentFaceTemplateModel(Base):
+    """Additional face encodings of a student, matched alongside students.face_encoding"""
+    __tablename__ = 'student_face_templates'
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.gen_random_uuid())
+    student_id = Column(UUID(as_uuid=True), ForeignKey('students.id', ondelete='CASCADE'), nullable=False)
+    face_encoding = Column(BYTEA, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    
+    __table_args__ = (
+        Index('idx_face_templates_student', 'student_id'),
+    )
+
+class StudentDeletionModel(Base):
+    """
+    Tombstone per deleted student, written by the students_record_deletion
+    trigger (see scripts/init_db.py), so encoding snapshot warm starts find
+    deletions without scanning students. FaceService prunes the rows older
+    than the snapshot it replaces.
+    """
+    __tablename__ = 'student_deletions'
+    student_id = Column(UUID(as_uuid=True), primary_key=True)
+    deleted_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index('idx_student_deletions_deleted_at', 'deleted_at'),
     )
 
 class AttendanceRecordModel(Base):
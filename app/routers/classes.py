@@ -1,11 +1,66 @@
-from fastapi import APIRouter
-from app.database import pool
+from fastapi import APIRouter, HTTPException
+from uuid import UUID
+import asyncpg
+from app import database
+from app.schemas import ClassCreate
+from app.services.face_service import face_service
+from app.services.auth_service import auth_service
 
 router = APIRouter(prefix="/api/classes", tags=["classes"])
 
 @router.get("/")
 async def get_classes():
+    pool = database.pool
     if pool is None: return []
     async with pool.acquire() as conn:
         records = await conn.fetch("SELECT id, name, created_at FROM classes ORDER BY name")
         return [dict(r) for r in records]
+
+@router.post("/")
+async def create_class(payload: ClassCreate):
+    pool = database.pool
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database not initialized")
+    async with pool.acquire() as conn:
+        record = await conn.fetchrow(
+            "INSERT INTO classes (name) VALUES ($1) ON CONFLICT (name) DO NOTHING RETURNING id, name, created_at",
+            payload.name
+        )
+    if record is None:
+        raise HTTPException(status_code=409, detail="Class already exists")
+    # Keep the in-memory class registry in sync
+    face_service.register_class(record['id'], record['name'])
+    return dict(record)
+
+@router.put("/{class_id}")
+async def rename_class(class_id: UUID, payload: ClassCreate):
+    pool = database.pool
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database not initialized")
+    async with pool.acquire() as conn:
+        old_name = await conn.fetchval("SELECT name FROM classes WHERE id = $1", class_id)
+        if old_name is None:
+            raise HTTPException(status_code=404, detail="Class not found")
+        try:
+            record = await conn.fetchrow(
+                "UPDATE classes SET name = $2 WHERE id = $1 RETURNING id, name, created_at",
+                class_id, payload.name
+            )
+        except asyncpg.UniqueViolationError:
+            raise HTTPException(status_code=409, detail="Class already exists")
+    face_service.rename_class(old_name, record['name'])
+    auth_service.rename_class(old_name, record['name'])
+    return dict(record)
+
+@router.delete("/{class_id}")
+async def delete_class(class_id: UUID):
+    pool = database.pool
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database not initialized")
+    async with pool.acquire() as conn:
+        name = await conn.fetchval("DELETE FROM classes WHERE id = $1 RETURNING name", class_id)
+    if name is None:
+        raise HTTPException(status_code=404, detail="Class not found")
+    face_service.remove_class(name)
+    auth_service.remove_class(name)
+    return {"status": "success", "id": class_id}
@@ -0,0 +1,71 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app import database
+from app.services.metrics import metrics
+from app.services.face_service import face_service
+from app.services.recognition_scheduler import recognition_scheduler
+from app.services.attendance_service import attendance_cooldown, attendance_writer
+from app.services.cache_sync import cache_sync
+
+router = APIRouter(tags=["metrics"])
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _pool_connections() -> dict:
+    pool = database.pool
+    if pool is None:
+        return {}
+    idle = pool.get_idle_size()
+    return {("idle",): idle, ("busy",): pool.get_size() - idle}
+
+
+def _embedding_batcher(attribute: str) -> float:
+    batcher = face_service.embedding_batcher
+    return getattr(batcher, attribute) if batcher is not None else 0
+
+
+# Counters and queue lengths the services already keep, read at scrape time
+metrics.callback(
+    "executor_queue_depth", "Jobs waiting for an executor worker",
+    lambda: {(name,): depth for name, depth in face_service.executor_queue_depth().items()}, ["executor"]
+)
+metrics.callback("recognition_in_flight", "Recognitions running", lambda: recognition_scheduler.in_flight)
+metrics.callback("recognition_queued", "Recognitions waiting for a slot", lambda: recognition_scheduler.queued)
+metrics.callback(
+    "recognition_shed_total", "Recognitions refused as busy", lambda: recognition_scheduler.shed, kind="counter"
+)
+metrics.callback(
+    "face_match_ambiguous_total", "Matches rejected because the runner-up was within the margin",
+    lambda: face_service.ambiguous_rejections, kind="counter"
+)
+metrics.callback(
+    "embedding_batches_total", "Cross-camera descriptor batches computed",
+    lambda: _embedding_batcher("batches"), kind="counter"
+)
+metrics.callback(
+    "embedding_batch_chips_total", "Face chips computed in cross-camera batches",
+    lambda: _embedding_batcher("chips"), kind="counter"
+)
+metrics.callback("attendance_queue_depth", "Attendance events waiting to be written", lambda: attendance_writer.pending)
+metrics.callback(
+    "attendance_records_total", "Attendance events by outcome",
+    lambda: {
+        ("written",): attendance_writer.written,
+        ("failed",): attendance_writer.failed,
+        ("dropped",): attendance_writer.dropped,
+        ("suppressed",): attendance_cooldown.suppressed
+    },
+    ["result"], kind="counter"
+)
+metrics.callback(
+    "cache_sync_events_total", "Change notifications by outcome",
+    lambda: {("applied",): cache_sync.applied, ("failed",): cache_sync.failed}, ["result"], kind="counter"
+)
+metrics.callback("db_pool_connections", "Database pool connections by state", _pool_connections, ["state"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
@@ -1,16 +1,19 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Query
 import os
 import aiofiles
-import pickle
+from dataclasses import asdict
+from typing import Optional
 from uuid import UUID
-from app.database import pool
+from app import database
 from app.config import settings
+from app.services.encoding_codec import encode_encoding
 from app.services.face_service import face_service
 
 router = APIRouter(prefix="/api/students", tags=["students"])
 
 @router.get("/")
 async def get_students():
+    pool = database.pool
     if pool is None: return []
     async with pool.acquire() as conn:
         records = await conn.fetch("""
@@ -27,6 +30,7 @@ async def create_student(
     class_id: UUID = Form(...),
     file: UploadFile = File(...)
 ):
+    pool = database.pool
     if pool is None:
         raise HTTPException(status_code=500, detail="Database not initialized")
         
@@ -41,7 +45,7 @@ async def create_student(
     if encoding is None:
         raise HTTPException(status_code=400, detail="No face found in the image")
         
-    encoding_bytes = pickle.dumps(encoding)
+    encoding_bytes = encode_encoding(encoding)
     
     async with pool.acquire() as conn:
         try:
@@ -60,9 +64,64 @@ async def create_student(
                     class_name=class_name,
                     full_name=full_name,
                     student_code=student_code,
-                    encoding=encoding
+                    encoding=encoding,
+                    class_id=class_id
                 )
                 
             return {"status": "success", "id": student_id}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/{student_id}/templates")
+async def add_face_template(student_id: UUID, file: UploadFile = File(...)):
+    """
+    Enrol an additional face image for an existing student.
+    
+    Each template is matched alongside the student's primary encoding; how
+    several templates are combined is set by FACE_TEMPLATE_SCORING.
+    """
+    pool = database.pool
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database not initialized")
+    
+    content = await file.read()
+    encoding = await face_service.encode_face(content)
+    if encoding is None:
+        raise HTTPException(status_code=400, detail="No face found in the image")
+    
+    async with pool.acquire() as conn:
+        template_id = await conn.fetchval('''
+            INSERT INTO student_face_templates (student_id, face_encoding)
+            SELECT id, $2 FROM students WHERE id = $1
+            RETURNING id
+        ''', student_id, encode_encoding(encoding))
+    if template_id is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    # Update in-memory cache
+    await face_service.reload_student(student_id)
+    return {"status": "success", "id": template_id}
+
+@router.post("/match")
+async def debug_match(
+    file: UploadFile = File(...),
+    k: int = Query(5, ge=1, le=50),
+    class_name: Optional[str] = Query(None)
+):
+    """
+    Debug matching: the k closest students with their distances, next to the
+    decision the recognition path would take (tolerance and margin applied).
+    """
+    encoding = await face_service.encode_face(await file.read())
+    if encoding is None:
+        raise HTTPException(status_code=400, detail="No face found in the image")
+    
+    candidates = await face_service.match_face_topk(encoding, k=k, class_name=class_name)
+    # Debug uploads must not show up in the production ambiguity counter
+    result = await face_service.match_face(encoding, class_name, count=False)
+    return {
+        "match": asdict(result),
+        "candidates": candidates,
+        "tolerance": face_service.tolerance,
+        "margin": face_service.match_margin
+    }
@@ -1,15 +1,67 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 import asyncio
+import time
 from datetime import datetime, timezone
+from typing import List, Optional
 import json
 
-from app.services.auth_service import is_valid_api_key
-from app.services.face_service import face_service
-from app.services.socketio_service import broadcast_attendance
-from app.database import pool
+from app.config import settings
+from app.services.auth_service import is_valid_api_key, get_api_key_class
+from app.services.face_service import face_service, MatchResult
+from app.services.recognition_scheduler import recognition_scheduler, RecognitionBusy
+from app.services.attendance_service import attendance_cooldown, attendance_writer, AttendanceEvent
+from app.services.motion_gate import MotionGate
+from app.services.face_tracker import FaceTracker
+from app.services.metrics import FACES, FRAME_SECONDS, FRAMES, FRAMES_DROPPED, STAGE_SECONDS, LabelLimiter
 
 router = APIRouter()
 
+# device_id comes from the client; bound the per-device series it can create
+device_labels = LabelLimiter(settings.METRICS_MAX_DEVICES)
+
+
+class FrameMailbox:
+    """
+    One-slot mailbox between a connection's receive task and its processing loop.
+    
+    put() replaces a frame that has not been picked up yet, so the processing
+    loop always works on the newest frame and recognition latency stays bounded
+    when the camera sends faster than frames can be recognized.
+    """
+    
+    def __init__(self):
+        self._frame: Optional[bytes] = None
+        self._event = asyncio.Event()
+        self.closed = False
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+    
+    def put(self, frame: bytes) -> bool:
+        """Offer a frame; returns True if it replaced one that was never processed"""
+        replaced = self._frame is not None
+        if replaced:
+            self.dropped += 1
+        self._frame = frame
+        self.received += 1
+        self._event.set()
+        return replaced
+    
+    def close(self) -> None:
+        self.closed = True
+        self._event.set()
+    
+    async def get(self) -> Optional[bytes]:
+        """Wait for the newest frame; returns None once closed and drained"""
+        while self._frame is None:
+            if self.closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        self.processed += 1
+        return frame
+
 
 @router.websocket("/ws/camera")
 async def websocket_endpoint(
@@ -28,11 +80,20 @@ async def websocket_endpoint(
     
     Protocol:
         - Receives: Binary JPEG frames
-        - Sends: JSON responses with recognition results
+        - Sends: JSON responses with recognition results, one entry per face
+          (up to FACE_MAX_FACES) under "faces"
+        - Frames arriving while one is being recognized replace each other;
+          only the newest is processed next (see FrameMailbox)
+        - Frames that barely differ from the last recognized one are not
+          recognized (see MotionGate)
+        - A face that stays in place keeps its identity for a few frames
+          without being encoded again (see FaceTracker)
     
     Error Handling:
         - Invalid API key → Close with code 1008
         - No face detected → Send "no_face" response
+        - Scene unchanged → Send "no_change" response
+        - Server overloaded → Send "busy" response (see RecognitionScheduler)
         - Face recognition error → Log error and send "no_face" response
     """
     # Validate API Key (Requirement 1.5)
@@ -40,86 +101,40 @@ async def websocket_endpoint(
         print(f"Invalid API key attempt from device: {device_id}")
         await websocket.close(code=1008, reason="Invalid API Key")
         return
+    
+    # Frames from a class-bound key are only matched against that class
+    key_class = get_api_key_class(api_key)
         
     await websocket.accept()
-    print(f"Device connected: {device_id}")
+    print(f"Device connected: {device_id} (class: {key_class or 'all'})")
+    
+    mailbox = FrameMailbox()
+    gate = MotionGate(
+        settings.MOTION_GATE_THRESHOLD,
+        size=settings.MOTION_GATE_SIZE,
+        max_idle=settings.MOTION_GATE_MAX_IDLE_S
+    )
+    tracker = FaceTracker(max_reuse=settings.FACE_TRACK_MAX_REUSE, min_iou=settings.FACE_TRACK_MIN_IOU)
+    
+    async def receive_frames():
+        try:
+            while True:
+                # Receive binary frame from ESP32 (Requirement 1.2)
+                if mailbox.put(await websocket.receive_bytes()):
+                    FRAMES_DROPPED.inc(device=device_labels(device_id))
+        finally:
+            mailbox.close()
+    
+    receiver = asyncio.create_task(receive_frames())
 
     try:
         while True:
-            # Receive binary frame from ESP32 (Requirement 1.2)
-            data = await websocket.receive_bytes()
-            
-            timestamp = datetime.now(timezone.utc).isoformat()
-            
-            try:
-                # Encode face from JPEG (Requirement 1.2)
-                unknown_encoding = await face_service.encode_face(data)
-                
-                if unknown_encoding is None:
-                    # No face detected (Requirement 18.1)
-                    print(f"No face detected from device: {device_id}")
-                    await websocket.send_json({
-                        "status": "no_face",
-                        "name": None,
-                        "student_id": None,
-                        "class_name": None,
-                        "confidence": None,
-                        "timestamp": timestamp,
-                        "device_id": device_id
-                    })
-                    continue
-                    
-                # Match face (Requirement 1.2)
-                match_result = await face_service.match_face(unknown_encoding)
-                
-                if match_result.matched:
-                    # Send recognized response immediately (Requirement 1.3)
-                    await websocket.send_json({
-                        "status": "recognized",
-                        "name": match_result.student_name,
-                        "student_id": match_result.student_id,  # UUID string
-                        "class_name": match_result.class_name,
-                        "confidence": match_result.confidence,
-                        "timestamp": timestamp,
-                        "device_id": device_id
-                    })
-                    
-                    # Asynchronously save to DB and broadcast (Requirement 1.4)
-                    asyncio.create_task(
-                        save_and_broadcast(
-                            student_id=match_result.student_id,
-                            class_name=match_result.class_name,
-                            student_code=match_result.student_code,
-                            student_name=match_result.student_name,
-                            device_id=device_id,
-                            confidence=match_result.confidence,
-                            status="present"
-                        )
-                    )
-                else:
-                    # Send unknown response (Requirement 1.3)
-                    await websocket.send_json({
-                        "status": "unknown",
-                        "name": None,
-                        "student_id": None,
-                        "class_name": None,
-                        "confidence": None,
-                        "timestamp": timestamp,
-                        "device_id": device_id
-                    })
-                    
-            except Exception as e:
-                # Face recognition error → send no_face response (Requirement 18.1)
-                print(f"Face recognition error from device {device_id}: {e}")
-                await websocket.send_json({
-                    "status": "no_face",
-                    "name": None,
-                    "student_id": None,
-                    "class_name": None,
-                    "confidence": None,
-                    "timestamp": timestamp,
-                    "device_id": device_id
-                })
+            data = await mailbox.get()
+            if data is None:
+                break
+            await process_frame(websocket, data, device_id, key_class, gate, tracker)
+        # Surface the receiver's exit reason (normally WebSocketDisconnect)
+        await receiver
 
     except WebSocketDisconnect:
         # Log disconnection (Requirement 18.3)
@@ -129,40 +144,153 @@ async def websocket_endpoint(
         print(f"WebSocket error from device {device_id}: {e}")
         if not websocket.client_state.name == "DISCONNECTED":
             await websocket.close()
+    finally:
+        receiver.cancel()
+        print(
+            f"Device {device_id} frames: received={mailbox.received} "
+            f"processed={mailbox.processed} dropped={mailbox.dropped} unchanged={gate.skipped} "
+            f"tracked={tracker.reused_total}"
+        )
 
-async def save_and_broadcast(student_id, class_name, student_code, student_name, device_id, confidence, status):
-    if pool is None:
-        return
+
+def status_response(status: str, timestamp: str, device_id: str) -> dict:
+    """Response for frames without a recognized student"""
+    return {
+        "status": status,
+        "name": None,
+        "student_id": None,
+        "class_name": None,
+        "confidence": None,
+        "timestamp": timestamp,
+        "device_id": device_id,
+        "faces": []
+    }
+
+
+def face_response(match_result: MatchResult) -> dict:
+    """Result for one face of a frame"""
+    if not match_result.matched:
+        return {"status": "unknown", "name": None, "student_id": None, "class_name": None, "confidence": None}
+    return {
+        "status": "recognized",
+        "name": match_result.student_name,
+        "student_id": match_result.student_id,  # UUID string
+        "class_name": match_result.class_name,
+        "confidence": match_result.confidence
+    }
+
+
+async def recognize_frame(data: bytes, key_class: Optional[str],
+                          tracker: Optional[FaceTracker] = None) -> List[MatchResult]:
+    """
+    Encode and match the faces of one frame, largest first.
+    
+    All faces that need an embedding are encoded in one batched pass and
+    matched in one call; faces continuing an identified track reuse its
+    identity (see FaceTracker).
+    
+    Returns:
+        One MatchResult per face; empty when no face is detected
+    """
+    track_boxes = tracker.reusable_boxes() if tracker is not None else []
+    min_iou = tracker.min_iou if tracker is not None else 0.5
+    # Encode faces from JPEG (Requirement 1.2)
+    faces = await face_service.encode_faces(data, settings.FACE_MAX_FACES, track_boxes, min_iou)
+    encoded = [face for face in faces if face.track is None]
+    
+    # Match faces (Requirement 1.2)
+    matches = []
+    if encoded:
+        with STAGE_SECONDS.time(stage="match"):
+            matches = await face_service.match_faces([face.encoding for face in encoded], class_name=key_class)
+            if key_class and settings.FACE_MATCH_GLOBAL_FALLBACK:
+                retry = [i for i, match_result in enumerate(matches) if not match_result.matched]
+                if retry:
+                    fallback = await face_service.match_faces([encoded[i].encoding for i in retry])
+                    for i, match_result in zip(retry, fallback):
+                        matches[i] = match_result
+    
+    by_face = iter(matches)
+    results = [None if face.track is not None else next(by_face) for face in faces]
+    if tracker is not None:
+        return tracker.update(faces, results)
+    return results
+
+
+async def process_frame(websocket: WebSocket, data: bytes, device_id: str, key_class: Optional[str],
+                        gate: Optional[MotionGate] = None, tracker: Optional[FaceTracker] = None) -> None:
+    """
+    Recognize one frame and send the result to the device.
+    
+    The reply lists every face under "faces" (largest first); the top-level
+    fields describe the first recognized face, or the largest face if none
+    was recognized, so single-face clients keep working. The reply status is
+    counted per device and the frame's latency recorded (see app.services.metrics).
+    """
+    timestamp = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    status = "no_face"
+    
+    try:
+        thumbnail = None
+        if gate is not None and gate.enabled:
+            # Cheap change check before taking a recognition slot, off the event loop
+            thumbnail = await asyncio.get_running_loop().run_in_executor(None, gate.thumbnail, data)
+            if not gate.changed(thumbnail):
+                status = "no_change"
+                await websocket.send_json(status_response(status, timestamp, device_id))
+                return
         
-    async with pool.acquire() as conn:
+        # Recognition is admitted and scheduled fairly across all cameras
         try:
-            # Get class_id
-            class_record = await conn.fetchrow('SELECT id FROM classes WHERE name = $1', class_name)
-            if not class_record:
-                return
-            class_id = class_record['id']
-            
-            record_id = await conn.fetchval('''
-                INSERT INTO attendance_records (student_id, class_id, device_id, confidence, status)
-                VALUES ($1, $2, $3, $4, $5)
-                RETURNING id
-            ''', student_id, class_id, device_id, confidence, status)
-            
-            # Broadcast
-            payload = {
-                "event": "attendance_update",
-                "data": {
-                    "id": str(record_id),
-                    "student_name": student_name,
-                    "student_code": student_code,
-                    "class_name": class_name,
-                    "device_id": device_id,
-                    "confidence": confidence,
-                    "status": status,
-                    "recorded_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
-            await broadcast_attendance(payload)
+            match_results = await recognition_scheduler.run(device_id, recognize_frame, data, key_class, tracker)
+        except RecognitionBusy:
+            status = "busy"
+            await websocket.send_json(status_response(status, timestamp, device_id))
+            return
+        if gate is not None:
+            # Only frames that were actually recognized become the reference
+            gate.accept(thumbnail)
+        
+        if not match_results:
+            # No face detected (Requirement 18.1)
+            print(f"No face detected from device: {device_id}")
+            await websocket.send_json(status_response("no_face", timestamp, device_id))
+            return
+        
+        # Send recognized/unknown response immediately (Requirement 1.3)
+        faces = [face_response(match_result) for match_result in match_results]
+        primary = next((face for face in faces if face["status"] == "recognized"), faces[0])
+        status = primary["status"]
+        for face in faces:
+            FACES.inc(device=device_labels(device_id), status=face["status"])
+        await websocket.send_json({**primary, "timestamp": timestamp, "device_id": device_id, "faces": faces})
+        
+        # Queue the DB write and broadcast (Requirement 1.4),
+        # once per student and class within the cooldown window
+        for match_result in match_results:
+            if match_result.matched and not attendance_cooldown.is_suppressed(
+                    match_result.student_id, match_result.class_name):
+                event = AttendanceEvent(
+                    student_id=match_result.student_id,
+                    student_name=match_result.student_name,
+                    student_code=match_result.student_code,
+                    class_name=match_result.class_name,
+                    class_id=match_result.class_id,
+                    device_id=device_id,
+                    confidence=match_result.confidence,
+                    status="present"
+                )
+                # The cooldown starts only once the event is queued; the writer
+                # releases it again if the event cannot be written
+                if attendance_writer.submit(event):
+                    attendance_cooldown.record(event.student_id, event.class_name)
             
-        except Exception as e:
-            print(f"DB Error while saving attendance: {e}")
+    except Exception as e:
+        # Face recognition error → send no_face response (Requirement 18.1)
+        print(f"Face recognition error from device {device_id}: {e}")
+        status = "no_face"
+        await websocket.send_json(status_response("no_face", timestamp, device_id))
+    finally:
+        FRAMES.inc(device=device_labels(device_id), status=status)
+        FRAME_SECONDS.observe(time.perf_counter() - start)
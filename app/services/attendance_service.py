@@ -0,0 +1,323 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Deque, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+import asyncpg
+
+from app.config import settings
+from app.services.face_service import face_service
+from app.services.metrics import POOL_WAIT_SECONDS, STAGE_SECONDS
+from app.services.socketio_service import broadcast_attendance
+
+
+# Errors worth retrying: lost connections, pool exhaustion, server restarts, lock conflicts
+TRANSIENT_DB_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InsufficientResourcesError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.TransactionRollbackError,
+)
+
+
+class AttendanceCooldown:
+    """
+    In-memory per-(student, class) cooldown for attendance events.
+    
+    A student standing in front of a camera is recognized on every frame;
+    only the first recognition within ttl seconds is recorded and broadcast.
+    Entries are kept in recording order so expired ones are evicted from the
+    front in O(1) per entry.
+    """
+    
+    def __init__(self, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            ttl: Cooldown in seconds after a recorded event (0 disables deduplication)
+            clock: Monotonic time source
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.suppressed = 0
+        # (student_id, class_name) -> time of the last recorded event
+        self._recorded_at: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._recorded_at)
+    
+    def _evict(self, now: float) -> None:
+        while self._recorded_at:
+            key, recorded_at = next(iter(self._recorded_at.items()))
+            if now - recorded_at < self.ttl:
+                break
+            del self._recorded_at[key]
+    
+    def is_suppressed(self, student_id: str, class_name: str) -> bool:
+        """
+        Whether the student was recorded for the class less than ttl seconds
+        ago; such recognitions are counted as suppressed and not written.
+        """
+        if self.ttl <= 0:
+            return False
+        self._evict(self.clock())
+        if (student_id, class_name) in self._recorded_at:
+            self.suppressed += 1
+            return True
+        return False
+    
+    def record(self, student_id: str, class_name: str) -> None:
+        """Start the cooldown of an event that was accepted for writing"""
+        if self.ttl > 0:
+            key = (student_id, class_name)
+            self._recorded_at.pop(key, None)
+            self._recorded_at[key] = self.clock()
+    
+    def release(self, student_id: str, class_name: str) -> None:
+        """End a cooldown early, e.g. because its event was never written"""
+        self._recorded_at.pop((student_id, class_name), None)
+    
+    def clear(self) -> None:
+        self._recorded_at.clear()
+
+
+@dataclass
+class AttendanceEvent:
+    """One recognized attendance waiting to be written"""
+    student_id: str
+    student_name: str
+    student_code: str
+    class_name: str
+    class_id: str
+    device_id: str
+    confidence: float
+    status: str = "present"
+    id: UUID = field(default_factory=uuid4)
+    recorded_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class AttendanceWriter:
+    """
+    Write-behind queue for attendance records.
+    
+    Recognitions are queued in memory and a single background task writes them
+    with one COPY per batch (class ids come from the FaceService class registry,
+    so flushing never queries classes), flushing every flush_interval seconds or as soon
+    as batch_size events are waiting. Record ids are generated client-side so
+    the Socket.IO broadcast, sent after the batch commits, carries the same id
+    as the row. The queue is bounded; when full, new events are dropped and
+    counted instead of growing memory without limit.
+    """
+    
+    COLUMNS = ["id", "student_id", "class_id", "device_id", "confidence", "status"]
+    
+    def __init__(self, flush_interval: float = 0.2, batch_size: int = 200,
+                 max_queue: int = 10000, max_retries: int = 3, retry_backoff: float = 0.5,
+                 on_failed: Optional[Callable[[AttendanceEvent], None]] = None,
+                 resolve_class_id: Optional[Callable[[str], Optional[str]]] = None):
+        """
+        Args:
+            flush_interval: Maximum seconds an event waits before being flushed
+            batch_size: Flush immediately once this many events are queued
+            max_queue: Queue bound; events submitted beyond it are dropped
+            max_retries: Retries of a batch on transient database errors
+            retry_backoff: Initial retry delay in seconds, doubled per attempt
+            on_failed: Called for every queued event that could not be written
+            resolve_class_id: In-memory class name -> id lookup for events queued
+                without a class id (e.g. the FaceService class registry)
+        """
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.on_failed = on_failed
+        self.resolve_class_id = resolve_class_id
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self._queue: Deque[AttendanceEvent] = deque()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+    
+    def start(self) -> None:
+        """Start the background flush task on the running event loop"""
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    def submit(self, event: AttendanceEvent) -> bool:
+        """
+        Queue an event for writing.
+        
+        Returns:
+            False if the writer is not running or the queue is full
+        """
+        if self._task is None or self._stopping:
+            self.dropped += 1
+            return False
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            print(f"Attendance queue full, dropping record for {event.student_code}")
+            return False
+        self._queue.append(event)
+        self._wakeup.set()
+        return True
+    
+    async def stop(self) -> None:
+        """Stop accepting events, flush everything queued and wait for the task"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        print(f"Attendance writer stopped: written={self.written} failed={self.failed} dropped={self.dropped}")
+    
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._queue:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            # Coalesce until the batch fills or flush_interval has passed
+            deadline = loop.time() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._stopping:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            await self._flush(batch)
+    
+    async def _flush(self, batch: List[AttendanceEvent]) -> None:
+        batch = self._with_class_ids(batch)
+        written = await self._write_isolating(batch) if batch else []
+        if written:
+            self.flushes += 1
+        self.written += len(written)
+        for event in written:
+            await self._broadcast(event)
+    
+    async def _write_isolating(self, batch: List[AttendanceEvent]) -> List[AttendanceEvent]:
+        """
+        Write a batch, retrying transient errors; returns the events written.
+        
+        Any other COPY failure (e.g. a student deleted between matching and
+        flushing violates the foreign key) fails the whole COPY, so the batch
+        is split in halves and retried until only the offending rows are left;
+        those are dropped and counted as failed.
+        """
+        try:
+            return await self._write_retrying(batch)
+        except TRANSIENT_DB_ERRORS as e:
+            self._fail(batch, f"DB Error while saving attendance, dropping {len(batch)} records: {e}")
+            return []
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch, f"DB Error while saving attendance for {batch[0].student_code}: {e}")
+                return []
+            middle = len(batch) // 2
+            return await self._write_isolating(batch[:middle]) + await self._write_isolating(batch[middle:])
+    
+    async def _write_retrying(self, batch: List[AttendanceEvent]) -> List[AttendanceEvent]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with STAGE_SECONDS.time(stage="db_write"):
+                    return await self._write(batch)
+            except TRANSIENT_DB_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+    
+    def _with_class_ids(self, batch: List[AttendanceEvent]) -> List[AttendanceEvent]:
+        """Fill in missing class ids from the registry; events still without one fail"""
+        unresolved = []
+        for event in batch:
+            if event.class_id is None and self.resolve_class_id is not None:
+                event.class_id = self.resolve_class_id(event.class_name)
+            if event.class_id is None:
+                unresolved.append(event)
+        if unresolved:
+            self._fail(unresolved, f"Unknown class for {len(unresolved)} attendance records, dropping them: "
+                                   f"{sorted({event.class_name for event in unresolved})}")
+            batch = [event for event in batch if event.class_id is not None]
+        return batch
+    
+    def _fail(self, events: List[AttendanceEvent], message: str) -> None:
+        self.failed += len(events)
+        print(message)
+        if self.on_failed is not None:
+            for event in events:
+                self.on_failed(event)
+    
+    async def _write(self, batch: List[AttendanceEvent]) -> List[AttendanceEvent]:
+        """Insert a batch with one COPY; returns the events that were written"""
+        from app.database import pool
+        if pool is None:
+            raise RuntimeError("Database pool is not initialized")
+        
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+            await conn.copy_records_to_table(
+                'attendance_records',
+                records=[
+                    (event.id, event.student_id, event.class_id,
+                     event.device_id, event.confidence, event.status)
+                    for event in batch
+                ],
+                columns=self.COLUMNS
+            )
+        return batch
+    
+    async def _broadcast(self, event: AttendanceEvent) -> None:
+        payload = {
+            "event": "attendance_update",
+            "data": {
+                "id": str(event.id),
+                "student_name": event.student_name,
+                "student_code": event.student_code,
+                "class_name": event.class_name,
+                "device_id": event.device_id,
+                "confidence": event.confidence,
+                "status": event.status,
+                "recorded_at": event.recorded_at.isoformat()
+            }
+        }
+        try:
+            with STAGE_SECONDS.time(stage="broadcast"):
+                await broadcast_attendance(payload)
+        except Exception as e:
+            print(f"Broadcast error for attendance {event.id}: {e}")
+
+
+# Global singleton instances
+attendance_cooldown = AttendanceCooldown(ttl=settings.ATTENDANCE_COOLDOWN_SECONDS)
+attendance_writer = AttendanceWriter(
+    flush_interval=settings.ATTENDANCE_FLUSH_INTERVAL_MS / 1000.0,
+    batch_size=settings.ATTENDANCE_BATCH_SIZE,
+    max_queue=settings.ATTENDANCE_QUEUE_SIZE,
+    max_retries=settings.ATTENDANCE_WRITE_RETRIES,
+    # A student whose record was lost can be recorded again on the next frame
+    on_failed=lambda event: attendance_cooldown.release(event.student_id, event.class_name),
+    resolve_class_id=lambda class_name: face_service.class_ids.get(class_name)
+)
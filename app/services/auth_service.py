@@ -1,26 +1,32 @@
 import hashlib
-from typing import Set
+from typing import Dict, Optional, Set
 
 
 class AuthService:
     """Authentication service with in-memory API key cache.
     
     Manages API key validation using SHA256 hashing and an in-memory cache
-    to avoid database queries during authentication.
+    to avoid database queries during authentication. The class each key is
+    bound to is cached alongside the hash so camera frames can be matched
+    against that class only.
     """
     
     def __init__(self):
         self.active_keys: Set[str] = set()
+        # key_hash -> bound class name (keys without a class are absent)
+        self.key_classes: Dict[str, str] = {}
     
     async def load_api_keys(self) -> None:
         """Load active API keys from database into in-memory set.
         
         Loads all active API keys from the api_keys table, hashes them with SHA256,
-        and stores the hashes in the active_keys set for fast lookup.
+        and stores the hashes in the active_keys set for fast lookup, together
+        with the name of the class each key is bound to.
         
         Validates: Requirements 4.1
         """
         self.active_keys.clear()
+        self.key_classes.clear()
         
         print("Loading API keys into cache...")
         from app.database import pool
@@ -30,10 +36,15 @@ class AuthService:
         
         async with pool.acquire() as conn:
             records = await conn.fetch('''
-                SELECT key_hash FROM api_keys WHERE is_active = TRUE
+                SELECT k.key_hash, c.name AS class_name
+                FROM api_keys k
+                LEFT JOIN classes c ON k.class_id = c.id
+                WHERE k.is_active = TRUE
             ''')
             for record in records:
                 self.active_keys.add(record['key_hash'])
+                if record.get('class_name'):
+                    self.key_classes[record['key_hash']] = record['class_name']
         
         print(f"Loaded {len(self.active_keys)} active API keys into cache.")
     
@@ -54,6 +65,20 @@ class AuthService:
         key_hash = hashlib.sha256(api_key.encode()).hexdigest()
         return key_hash in self.active_keys
     
+    def get_key_class(self, api_key: str) -> Optional[str]:
+        """Return the class name an active API key is bound to.
+        
+        Args:
+            api_key: The raw API key string
+        
+        Returns:
+            Bound class name, or None if the key is inactive or not bound to a class
+        """
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        if key_hash not in self.active_keys:
+            return None
+        return self.key_classes.get(key_hash)
+    
     async def add_key(self, api_key: str, label: str = None, class_id: str = None, device_id: str = None) -> None:
         """Add new API key to both database and cache.
         
@@ -79,9 +104,14 @@ class AuthService:
                 INSERT INTO api_keys (key_hash, label, class_id, device_id, is_active)
                 VALUES ($1, $2, $3, $4, TRUE)
             ''', key_hash, label, class_id, device_id)
+            class_name = None
+            if class_id is not None:
+                class_name = await conn.fetchval('SELECT name FROM classes WHERE id = $1', class_id)
         
         # Update cache immediately
         self.active_keys.add(key_hash)
+        if class_name:
+            self.key_classes[key_hash] = class_name
         print(f"Added API key to database and cache: {label or 'Unlabeled'}")
     
     async def deactivate_key(self, api_key: str) -> None:
@@ -108,7 +138,32 @@ class AuthService:
         
         # Update cache immediately
         self.active_keys.discard(key_hash)
+        self.key_classes.pop(key_hash, None)
         print(f"Deactivated API key in database and cache")
+    
+    def cache_key(self, key_hash: str, class_name: Optional[str] = None) -> None:
+        """Mark a key hash active in the cache, with its class binding."""
+        self.active_keys.add(key_hash)
+        if class_name:
+            self.key_classes[key_hash] = class_name
+        else:
+            self.key_classes.pop(key_hash, None)
+    
+    def evict_key(self, key_hash: str) -> None:
+        """Remove a key hash (deleted or deactivated elsewhere) from the cache."""
+        self.active_keys.discard(key_hash)
+        self.key_classes.pop(key_hash, None)
+    
+    def rename_class(self, old_name: str, new_name: str) -> None:
+        """Update cached key bindings after a class rename."""
+        for key_hash, class_name in self.key_classes.items():
+            if class_name == old_name:
+                self.key_classes[key_hash] = new_name
+    
+    def remove_class(self, class_name: str) -> None:
+        """Drop cached key bindings to a deleted class (api_keys.class_id is SET NULL)."""
+        for key_hash in [k for k, c in self.key_classes.items() if c == class_name]:
+            del self.key_classes[key_hash]
 
 
 # Global singleton instance
@@ -125,3 +180,8 @@ def is_valid_api_key(key: str) -> bool:
     """Check if API key is valid (backward compatibility wrapper)."""
     key_hash = hashlib.sha256(key.encode()).hexdigest()
     return key_hash in auth_service.active_keys
+
+
+def get_api_key_class(key: str) -> Optional[str]:
+    """Return the class name bound to an API key, if any."""
+    return auth_service.get_key_class(key)
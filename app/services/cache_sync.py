@@ -0,0 +1,152 @@
+import asyncio
+import json
+from typing import Optional
+
+import asyncpg
+
+from app.config import settings
+from app.services.auth_service import auth_service
+from app.services.face_service import face_service
+
+
+# Must match the channel used by notify_cache_change() in scripts/init_db.py
+CHANNEL = "cache_changes"
+
+
+class CacheSyncListener:
+    """
+    Keeps the FaceService and AuthService caches in sync with the database.
+
+    Triggers on students, classes and api_keys send a JSON payload
+    {"table", "op", "row", "old"} on CHANNEL for every change (students rows
+    without the encoding, which is fetched on demand together with the face
+    templates; template changes arrive as updates of their student). The listener holds one
+    dedicated connection, applies events one at a time on the event loop, and
+    after every (re)connect starts listening *before* doing a full reload, so
+    no change can fall in between. Applying an event is idempotent; changes
+    this process already applied (e.g. via the routers) are harmless repeats.
+    """
+
+    def __init__(self, dsn: str, reconnect_delay: float = 5.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.applied = 0
+        self.failed = 0
+        self._conn: Optional[asyncpg.Connection] = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Connect, listen and load both caches; then apply changes in the background"""
+        await self._connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close()
+
+    async def _connect(self) -> None:
+        self._queue = asyncio.Queue()
+        self._conn = await asyncpg.connect(self.dsn)
+        self._conn.add_termination_listener(self._on_terminate)
+        await self._conn.add_listener(CHANNEL, self._on_notify)
+        await face_service.load_all_encodings()
+        await auth_service.load_api_keys()
+
+    async def _close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            await conn.close()
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        self._queue.put_nowait(payload)
+
+    def _on_terminate(self, conn) -> None:
+        # None wakes the run loop so it reconnects
+        self._queue.put_nowait(None)
+
+    async def _run(self) -> None:
+        while True:
+            payload = await self._queue.get()
+            if payload is None:
+                await self._reconnect()
+                continue
+            try:
+                await self.apply(json.loads(payload))
+                self.applied += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Failed to apply cache change {payload[:200]}: {e}")
+
+    async def _reconnect(self) -> None:
+        print("Cache sync connection lost; reconnecting...")
+        await self._close_quietly()
+        while True:
+            try:
+                await self._connect()
+                return
+            except Exception as e:
+                # Anything escaping here would end _run and silently stop syncing:
+                # connect timeouts, interface errors and failed reloads all retry
+                print(f"Cache sync reconnect failed: {e!r}")
+                await self._close_quietly()
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _close_quietly(self) -> None:
+        try:
+            await self._close()
+        except Exception as e:
+            print(f"Cache sync close failed: {e!r}")
+
+    async def apply(self, event: dict) -> None:
+        """Apply one change event to the in-memory caches"""
+        handler = {
+            "students": self._apply_student,
+            "classes": self._apply_class,
+            "api_keys": self._apply_api_key,
+        }.get(event.get("table"))
+        if handler is not None:
+            await handler(event["op"], event["row"], event.get("old"))
+
+    async def _apply_student(self, op: str, row: dict, old: Optional[dict]) -> None:
+        if not face_service.manages_encodings:
+            # Another worker owns the shared index and publishes this change
+            return
+        if op == "DELETE":
+            await face_service.remove_student(row["id"])
+            return
+        # The payload omits encodings; read the committed row and its templates
+        await face_service.reload_student(row["id"])
+
+    async def _apply_class(self, op: str, row: dict, old: Optional[dict]) -> None:
+        if op == "INSERT":
+            face_service.register_class(row["id"], row["name"])
+        elif op == "UPDATE":
+            old_name = face_service.class_name_for(row["id"]) or (old or {}).get("name")
+            if old_name is not None and old_name != row["name"]:
+                face_service.rename_class(old_name, row["name"])
+                auth_service.rename_class(old_name, row["name"])
+            face_service.register_class(row["id"], row["name"])
+        elif op == "DELETE":
+            name = face_service.class_name_for(row["id"]) or row["name"]
+            face_service.remove_class(name)
+            auth_service.remove_class(name)
+
+    async def _apply_api_key(self, op: str, row: dict, old: Optional[dict]) -> None:
+        if old is not None and old["key_hash"] != row["key_hash"]:
+            auth_service.evict_key(old["key_hash"])
+        if op == "DELETE" or not row.get("is_active"):
+            auth_service.evict_key(row["key_hash"])
+            return
+        class_name = face_service.class_name_for(row["class_id"]) if row.get("class_id") else None
+        auth_service.cache_key(row["key_hash"], class_name)
+
+
+# Global singleton instance
+cache_sync = CacheSyncListener(settings.DATABASE_URL)
@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Callable, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches face descriptor computation across camera connections.
+
+    Callers hand in the aligned face chips of one frame and await their
+    descriptors. The first chips of a batch start a window timer; the batch
+    is computed when the window expires or max_batch chips are waiting,
+    whichever comes first, with one call of compute on the executor. Each
+    caller's future then gets its own slice of the result.
+
+    Batches are cut at max_batch only between callers, so the chips of one
+    frame are never split. Batches can overlap on the executor; the window
+    bounds the extra latency a lone frame pays.
+    """
+
+    def __init__(self, compute: Callable[[List[np.ndarray]], List[np.ndarray]],
+                 executor: Optional[Executor] = None, window: float = 0.005, max_batch: int = 16):
+        """
+        Args:
+            compute: Chips -> descriptors, e.g. face_encoder.chip_descriptors (picklable for process executors)
+            executor: Executor compute runs on (None = the event loop's default)
+            window: Seconds to wait for more chips after the first one of a batch
+            max_batch: Chips that trigger a batch before the window expires
+        """
+        self.compute = compute
+        self.executor = executor
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.chips = 0
+        self.largest_batch = 0
+        self._pending: List[Tuple[List[np.ndarray], asyncio.Future]] = []
+        self._pending_chips = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Running batches; kept referenced until done so stop() can wait for them
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def descriptors(self, chips: List[np.ndarray]) -> List[np.ndarray]:
+        """Descriptors of one frame's chips, computed together with other callers' chips"""
+        if not chips:
+            return []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((list(chips), future))
+        self._pending_chips += len(chips)
+        if self._pending_chips >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_chips = self._pending, [], 0
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self) -> None:
+        """Compute any waiting chips now and wait for running batches (call before shutting the executor down)"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, batch: List[Tuple[List[np.ndarray], asyncio.Future]]) -> None:
+        chips = [chip for frame_chips, _ in batch for chip in frame_chips]
+        self.batches += 1
+        self.chips += len(chips)
+        self.largest_batch = max(self.largest_batch, len(chips))
+        try:
+            descriptors = await asyncio.get_running_loop().run_in_executor(self.executor, self.compute, chips)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        start = 0
+        for frame_chips, future in batch:
+            if not future.done():
+                future.set_result(descriptors[start:start + len(frame_chips)])
+            start += len(frame_chips)
+
+    @property
+    def mean_batch(self) -> float:
+        return self.chips / self.batches if self.batches else 0.0
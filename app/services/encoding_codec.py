@@ -0,0 +1,57 @@
+import pickle
+from typing import List, Sequence, Tuple
+import numpy as np
+
+from app.services.encoding_index import ENCODING_DIM
+
+
+# students.face_encoding storage formats, told apart by length alone: the
+# compact format is exactly ENCODING_DIM little-endian float32 values
+# (512 bytes), while legacy rows hold a pickled float64 ndarray (~1.2 KB).
+# A future format must therefore use a length neither of these can have.
+ENCODING_DTYPE = np.dtype("<f4")
+ENCODING_NBYTES = ENCODING_DIM * ENCODING_DTYPE.itemsize
+
+
+def encode_encoding(encoding: np.ndarray) -> bytes:
+    """Serialize a 128-d encoding in the compact float32 format"""
+    return np.ascontiguousarray(encoding, dtype=ENCODING_DTYPE).reshape(ENCODING_DIM).tobytes()
+
+
+def is_compact(blob: bytes) -> bool:
+    return len(blob) == ENCODING_NBYTES
+
+
+def decode_encoding(blob: bytes) -> np.ndarray:
+    """Deserialize one stored encoding, accepting the legacy pickle format"""
+    if is_compact(blob):
+        return np.frombuffer(blob, dtype=ENCODING_DTYPE).astype(np.float32)
+    return np.asarray(decode_legacy(blob), dtype=np.float32)
+
+
+def decode_legacy(blob: bytes) -> np.ndarray:
+    """Unpickle a legacy encoding row (trusted database content only)"""
+    encoding = pickle.loads(blob)
+    if np.shape(encoding) != (ENCODING_DIM,):
+        raise ValueError(f"unexpected encoding shape {np.shape(encoding)}")
+    return encoding
+
+
+def decode_compact_batch(blobs: Sequence[bytes]) -> np.ndarray:
+    """
+    Decode many compact rows with a single frombuffer over their concatenation.
+
+    Returns:
+        (N, 128) float32 array (a view over one joined buffer)
+    """
+    if not blobs:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    return np.frombuffer(b"".join(blobs), dtype=ENCODING_DTYPE).reshape(len(blobs), ENCODING_DIM)
+
+
+def split_by_format(blobs: Sequence[bytes]) -> Tuple[List[int], List[int]]:
+    """Indices of compact and legacy rows"""
+    compact, legacy = [], []
+    for i, blob in enumerate(blobs):
+        (compact if is_compact(blob) else legacy).append(i)
+    return compact, legacy
@@ -0,0 +1,512 @@
+import threading
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+import numpy as np
+
+
+ENCODING_DIM = 128
+
+
+def squared_distances(matrix: np.ndarray, sq_norms: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """
+    Squared euclidean distances from every row of matrix to query.
+
+    Uses |x - q|^2 = |x|^2 - 2 x.q + |q|^2 with precomputed row norms, so the
+    only O(N*128) work is a single BLAS matrix-vector product.
+
+    Args:
+        matrix: (N, 128) float32 encodings
+        sq_norms: (N,) float32 squared row norms of matrix
+        query: (128,) float32 encoding
+
+    Returns:
+        (N,) float32 squared distances, clamped at 0
+    """
+    d2 = sq_norms - 2.0 * (matrix @ query)
+    d2 += float(query @ query)
+    np.maximum(d2, 0.0, out=d2)
+    return d2
+
+
+def nearest_row(matrix: np.ndarray, sq_norms: np.ndarray, query: np.ndarray) -> Optional[Tuple[int, float]]:
+    """
+    Closest row of matrix to query.
+
+    Returns:
+        (row, distance) or None if matrix is empty
+    """
+    if matrix.shape[0] == 0:
+        return None
+    d2 = squared_distances(matrix, sq_norms, query)
+    row = int(np.argmin(d2))
+    # Recompute the winner exactly to avoid cancellation error in the expansion
+    return row, float(np.linalg.norm(matrix[row] - query))
+
+
+def nearest_rows(matrix: np.ndarray, sq_norms: np.ndarray, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Closest row of matrix for each of several queries in one matrix product.
+
+    Args:
+        matrix: (N, 128) float32 encodings, N > 0
+        sq_norms: (N,) squared row norms
+        queries: (M, 128) float32 encodings
+
+    Returns:
+        (rows, distances), each (M,); distances recomputed exactly as in nearest_row
+    """
+    d2 = sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    rows = np.argmin(d2, axis=1)
+    return rows, np.linalg.norm(matrix[rows] - queries, axis=1)
+
+
+def nearest_students(matrix: np.ndarray, sq_norms: np.ndarray, groups: np.ndarray, query: np.ndarray,
+                     k: int, top_k: int = 1, bound: float = np.inf) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k closest distinct students when each student may own several
+    template rows, scored by the mean distance of the student's top_k closest
+    templates (top_k=1: the closest template).
+
+    With top_k=1 this is an argpartition over the rows, widened until the
+    candidates cover k students. Otherwise the argpartition takes the
+    k * (most templates per student) closest rows, which always covers k
+    students, and a group-reduce (one lexsort + reduceat) scores only the
+    students owning those rows. A student left out has every template at
+    least as far as the farthest candidate row, and its mean is never below
+    its best template, so the result is exact once k scored students are at
+    most that far; otherwise the candidates are widened. Students whose best
+    template is farther than bound are dropped.
+
+    Args:
+        matrix: (N, 128) float32 templates
+        sq_norms: (N,) squared row norms
+        groups: (N,) student ordinal of every row
+        query: (128,) float32 encoding
+        k: Number of students to return
+        top_k: Templates averaged per student (fewer if the student has fewer)
+        bound: Students whose best template is farther than this are left out
+
+    Returns:
+        (rows, distances), closest first: each student's closest template row
+        and its score, recomputed exactly; at most k entries
+    """
+    n = matrix.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    d2 = squared_distances(matrix, sq_norms, query)
+
+    if top_k == 1:
+        c = min(k, n)
+        while True:
+            cand = np.argpartition(d2, c - 1)[:c] if c < n else np.arange(n)
+            cand = cand[np.argsort(d2[cand], kind="stable")]
+            # First occurrence of each student in distance order is its closest row
+            _, first = np.unique(groups[cand], return_index=True)
+            if len(first) >= k or c == n:
+                break
+            c = min(n, c * 4)
+        rows = cand[np.sort(first)[:k]]
+        distances = np.linalg.norm(matrix[rows] - query, axis=1)
+        order = np.argsort(distances, kind="stable")
+        rows, distances = rows[order], distances[order]
+        within = distances <= bound
+        return rows[within], distances[within]
+
+    d = np.sqrt(np.maximum(d2, 0.0))
+    sizes = np.bincount(groups)
+    c = min(n, k * int(sizes.max()))
+    while True:
+        cand = np.argpartition(d2, c - 1)[:c] if c < n else np.arange(n)
+        farthest = d[cand].max()
+        owners = np.zeros(len(sizes), dtype=bool)
+        owners[groups[cand]] = True
+        rows = np.flatnonzero(owners[groups])
+        rows = rows[np.lexsort((d[rows], groups[rows]))]
+        g = groups[rows]
+        starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+        counts = np.diff(np.r_[starts, len(rows)])
+        keep = np.arange(len(rows)) - np.repeat(starts, counts) < top_k
+        means = np.add.reduceat(np.where(keep, d[rows], 0.0), starts) / np.minimum(counts, top_k)
+        # Rows sort per student, so each student's first row is its best template
+        scored = np.flatnonzero(d[rows[starts]] <= bound)
+        best = scored[np.argsort(means[scored], kind="stable")[:k]]
+        # Students outside the candidates score >= farthest (and are beyond bound if it is)
+        if c == n or farthest > bound or (len(best) == k and means[best[-1]] <= farthest):
+            break
+        c = min(n, c * 4)
+    # Exact distances for the winners' kept templates, as in nearest_row
+    distances = np.array([
+        np.linalg.norm(matrix[rows[starts[i]:starts[i] + min(top_k, counts[i])]] - query, axis=1).mean()
+        for i in best
+    ])
+    order = np.argsort(distances, kind="stable")
+    return rows[starts[best]][order], distances[order]
+
+
+def nearest_student(matrix: np.ndarray, sq_norms: np.ndarray, groups: np.ndarray,
+                    query: np.ndarray, top_k: int, bound: float) -> Optional[Tuple[int, float]]:
+    """
+    Closest student by mean distance of its top_k closest templates; see nearest_students.
+
+    Returns:
+        (row of the winner's closest template, mean distance) or None if
+        matrix is empty; when no student is within bound, the nearest row and
+        its distance are returned (and will fail the caller's tolerance check)
+    """
+    rows, distances = nearest_students(matrix, sq_norms, groups, query, 1, top_k, bound)
+    if len(rows):
+        return int(rows[0]), float(distances[0])
+    return nearest_row(matrix, sq_norms, query)
+
+
+def student_groups(student_ids: np.ndarray) -> np.ndarray:
+    """Ordinal of each row's student id (rows of one student share a value)"""
+    if len(student_ids) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(student_ids, return_inverse=True)[1].reshape(-1)
+
+
+def as_query(encoding: np.ndarray) -> np.ndarray:
+    """Cast an encoding to the float32 layout used by the index matrices"""
+    return np.ascontiguousarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+
+
+class ClassEncodings:
+    """
+    Contiguous float32 encoding matrix for one class, with parallel
+    student_id / full_name / student_code arrays. A student may own several
+    rows (face templates).
+
+    Rows are stored in a preallocated (capacity, 128) buffer that doubles when
+    full, so appends are amortized O(1) and matching works on a single view
+    without building per-frame lists. Squared row norms are kept alongside
+    for the dot-product distance kernel.
+    """
+
+    def __init__(self, capacity: int = 16):
+        capacity = max(1, capacity)
+        self.count = 0
+        self.matrix = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        self.sq_norms_buffer = np.empty(capacity, dtype=np.float32)
+        self.student_ids = np.empty(capacity, dtype=object)
+        self.full_names = np.empty(capacity, dtype=object)
+        self.student_codes = np.empty(capacity, dtype=object)
+        self._groups: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_arrays(cls, matrix: np.ndarray, sq_norms: np.ndarray, student_ids: np.ndarray,
+                    full_names: np.ndarray, student_codes: np.ndarray) -> "ClassEncodings":
+        """
+        Wrap existing arrays (e.g. read-only views of a memory-mapped snapshot)
+        without copying. They are copied to private buffers on the first write.
+        """
+        self = cls.__new__(cls)
+        self.count = matrix.shape[0]
+        self.matrix = matrix
+        self.sq_norms_buffer = sq_norms
+        self.student_ids = student_ids
+        self.full_names = full_names
+        self.student_codes = student_codes
+        self._groups = None
+        return self
+
+    @property
+    def capacity(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def encodings(self) -> np.ndarray:
+        """(count, 128) view over the filled rows"""
+        return self.matrix[:self.count]
+
+    @property
+    def sq_norms(self) -> np.ndarray:
+        """(count,) squared norms of the filled rows"""
+        return self.sq_norms_buffer[:self.count]
+
+    @property
+    def groups(self) -> np.ndarray:
+        """(count,) student ordinal of every row, for per-student reductions"""
+        if self._groups is None:
+            self._groups = student_groups(self.student_ids[:self.count])
+        return self._groups
+
+    def _grow(self, min_capacity: int) -> None:
+        new_capacity = max(min_capacity, self.capacity * 2, 1)
+        for attr in ("matrix", "sq_norms_buffer", "student_ids", "full_names", "student_codes"):
+            old = getattr(self, attr)
+            new = np.empty((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, attr, new)
+
+    def copy(self, extra: int = 0) -> "ClassEncodings":
+        """Private copy of the filled rows with room for extra more"""
+        clone = ClassEncodings(capacity=self.count + extra)
+        n = clone.count = self.count
+        for attr in ("matrix", "sq_norms_buffer", "student_ids", "full_names", "student_codes"):
+            getattr(clone, attr)[:n] = getattr(self, attr)[:n]
+        return clone
+
+    def _reserve(self, n: int) -> None:
+        """Make room for n more rows in writable buffers"""
+        self._groups = None
+        if self.count + n > self.capacity or not self.matrix.flags.writeable:
+            self._grow(self.count + n)
+
+    def append(self, encoding: np.ndarray, student_id: str, full_name: str, student_code: str) -> None:
+        self._reserve(1)
+        i = self.count
+        self.matrix[i] = encoding
+        self.sq_norms_buffer[i] = self.matrix[i] @ self.matrix[i]
+        self.student_ids[i] = student_id
+        self.full_names[i] = full_name
+        self.student_codes[i] = student_code
+        self.count += 1
+
+    def extend(self, encodings: np.ndarray, student_ids: List[str],
+               full_names: List[str], student_codes: List[str]) -> None:
+        """Append a block of rows with one copy and one norm pass"""
+        n = len(encodings)
+        self._reserve(n)
+        start, end = self.count, self.count + n
+        block = self.matrix[start:end]
+        block[:] = encodings
+        self.sq_norms_buffer[start:end] = np.einsum("ij,ij->i", block, block)
+        self.student_ids[start:end] = student_ids
+        self.full_names[start:end] = full_names
+        self.student_codes[start:end] = student_codes
+        self.count = end
+
+    def find(self, student_id: str) -> int:
+        """Row of a student, or -1"""
+        rows = np.flatnonzero(self.student_ids[:self.count] == student_id)
+        return int(rows[0]) if rows.size else -1
+
+    def remove_row(self, i: int) -> None:
+        """Delete row i by moving the last row into its place (row order is not preserved)"""
+        if not 0 <= i < self.count:
+            raise IndexError("ClassEncodings index out of range")
+        self._reserve(0)
+        last = self.count - 1
+        for attr in ("matrix", "sq_norms_buffer", "student_ids", "full_names", "student_codes"):
+            buffer = getattr(self, attr)
+            buffer[i] = buffer[last]
+        for attr in ("student_ids", "full_names", "student_codes"):
+            getattr(self, attr)[last] = None
+        self.count = last
+
+    def remove_student(self, student_id: str) -> int:
+        """Delete every row (template) of a student; returns the number removed"""
+        removed = 0
+        row = self.find(student_id)
+        while row >= 0:
+            self.remove_row(row)
+            removed += 1
+            row = self.find(student_id)
+        return removed
+
+    def collapsed(self) -> "ClassEncodings":
+        """Copy with each student's templates averaged into one centroid row"""
+        ids = self.student_ids[:self.count]
+        _, first, groups = np.unique(ids, return_index=True, return_inverse=True)
+        groups = groups.reshape(-1)
+        if len(first) == self.count:
+            return self
+        sums = np.zeros((len(first), ENCODING_DIM), dtype=np.float64)
+        np.add.at(sums, groups, self.encodings)
+        centroids = sums / np.bincount(groups)[:, None]
+        clone = ClassEncodings(capacity=len(first))
+        clone.extend(centroids, ids[first], self.full_names[first], self.student_codes[first])
+        return clone
+
+    def __len__(self) -> int:
+        return self.count
+
+    def nearest(self, query: np.ndarray) -> Optional[Tuple[int, float]]:
+        """(row, distance) of the closest student in this class, or None if empty"""
+        return nearest_row(self.encodings, self.sq_norms, query)
+
+    def nearest_batch(self, queries: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, distances) of the closest row for each query, or None if empty"""
+        if self.count == 0:
+            return None
+        return nearest_rows(self.encodings, self.sq_norms, queries)
+
+    def nearest_student(self, query: np.ndarray, top_k: int, bound: float) -> Optional[Tuple[int, float]]:
+        """(row, mean top_k template distance) of the closest student; see nearest_student"""
+        return nearest_student(self.encodings, self.sq_norms, self.groups, query, top_k, bound)
+
+    def nearest_students(self, query: np.ndarray, k: int, top_k: int = 1,
+                         bound: float = np.inf) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, distances) of the k closest students, closest first; see nearest_students"""
+        return nearest_students(self.encodings, self.sq_norms, self.groups, query, k, top_k, bound)
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, str, str, str]:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("ClassEncodings index out of range")
+        return (self.matrix[i], self.student_ids[i], self.full_names[i], self.student_codes[i])
+
+
+class GlobalEncodingIndex:
+    """
+    All classes concatenated into one (N, 128) matrix with a class-offset table.
+
+    Row range class_offsets[k]:class_offsets[k + 1] belongs to class_names[k],
+    so an unscoped match is one distance pass and one argmin regardless of how
+    many classes are enrolled. Nearest-neighbour search is delegated to a
+    matcher built by matcher_factory(matrix, sq_norms) (see app.services.matchers)
+    on first use, so training it runs on a matching thread rather than where
+    the index is created; without one, search is exact brute force.
+    """
+
+    def __init__(self, known_encodings: Dict[str, ClassEncodings],
+                 matcher_factory: Optional[Callable] = None):
+        entries = [(name, entry) for name, entry in known_encodings.items() if len(entry) > 0]
+        self.class_names: List[str] = [name for name, _ in entries]
+        sizes = [len(entry) for _, entry in entries]
+        self.class_offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.class_offsets[1:])
+
+        if entries:
+            self.matrix = np.concatenate([entry.encodings for _, entry in entries])
+            self.sq_norms = np.concatenate([entry.sq_norms for _, entry in entries])
+            self.student_ids = np.concatenate([entry.student_ids[:len(entry)] for _, entry in entries])
+            self.full_names = np.concatenate([entry.full_names[:len(entry)] for _, entry in entries])
+            self.student_codes = np.concatenate([entry.student_codes[:len(entry)] for _, entry in entries])
+        else:
+            self.matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+            self.sq_norms = np.empty(0, dtype=np.float32)
+            self.student_ids = np.empty(0, dtype=object)
+            self.full_names = np.empty(0, dtype=object)
+            self.student_codes = np.empty(0, dtype=object)
+
+        self._matcher_factory = matcher_factory
+        self._matcher = None
+        self._matcher_lock = threading.Lock()
+        self._groups: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_arrays(cls, matrix: np.ndarray, sq_norms: np.ndarray, student_ids: np.ndarray,
+                    full_names: np.ndarray, student_codes: np.ndarray, class_names: List[str],
+                    class_offsets: np.ndarray, matcher_factory: Optional[Callable] = None) -> "GlobalEncodingIndex":
+        """Wrap arrays already laid out class by class (e.g. a mapped snapshot) without copying"""
+        self = cls.__new__(cls)
+        self.class_names = list(class_names)
+        self.class_offsets = class_offsets
+        self.matrix = matrix
+        self.sq_norms = sq_norms
+        self.student_ids = student_ids
+        self.full_names = full_names
+        self.student_codes = student_codes
+        self._matcher_factory = matcher_factory
+        self._matcher = None
+        self._matcher_lock = threading.Lock()
+        self._groups = None
+        return self
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def matcher(self):
+        """
+        Nearest-neighbour matcher, or None for plain brute force; built on
+        first use by one thread while others racing on it wait for the result.
+        """
+        if self._matcher is None and self._matcher_factory is not None:
+            with self._matcher_lock:
+                if self._matcher is None:
+                    self._matcher = self._matcher_factory(self.matrix, self.sq_norms)
+        return self._matcher
+
+    def class_of(self, row: int) -> str:
+        """Class name owning a global row index"""
+        k = int(np.searchsorted(self.class_offsets, row, side="right")) - 1
+        return self.class_names[k]
+
+    def nearest(self, query: np.ndarray) -> Optional[Tuple[int, float]]:
+        """(row, distance) of the closest student across all classes, or None if empty"""
+        if self.matcher is not None:
+            return self.matcher.nearest(query)
+        return nearest_row(self.matrix, self.sq_norms, query)
+
+    def nearest_batch(self, queries: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, distances) of the closest row for each query across all classes, or None if empty"""
+        if len(self) == 0:
+            return None
+        if self.matcher is not None and self.matcher.backend != "brute":
+            # Approximate matchers answer one query at a time; brute force is one matrix product
+            found = [self.matcher.nearest(query) for query in queries]
+            return np.array([row for row, _ in found]), np.array([distance for _, distance in found])
+        return nearest_rows(self.matrix, self.sq_norms, queries)
+
+    @property
+    def groups(self) -> np.ndarray:
+        """(N,) student ordinal of every row; built on first use"""
+        groups = self._groups
+        if groups is None:
+            groups = self._groups = student_groups(self.student_ids)
+        return groups
+
+    def nearest_student(self, query: np.ndarray, top_k: int, bound: float) -> Optional[Tuple[int, float]]:
+        """
+        (row, mean top_k template distance) of the closest student across all
+        classes. Always exact over every row: approximate matchers only
+        return a single nearest row, so they are bypassed here.
+        """
+        return nearest_student(self.matrix, self.sq_norms, self.groups, query, top_k, bound)
+
+    def nearest_students(self, query: np.ndarray, k: int, top_k: int = 1,
+                         bound: float = np.inf) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, distances) of the k closest students across all classes (exact, like nearest_student)"""
+        return nearest_students(self.matrix, self.sq_norms, self.groups, query, k, top_k, bound)
+
+
+class IndexSnapshot:
+    """
+    Immutable version of the whole encoding cache.
+
+    Matching reads FaceService.index once and uses only that object, so it
+    sees one consistent set of classes, class ids and global matrix without
+    taking locks. Writers never modify a published snapshot or the
+    ClassEncodings it holds: they build a new snapshot that shares the
+    unchanged classes and swap the reference, which is atomic.
+    """
+
+    def __init__(self, classes: Optional[Mapping[str, ClassEncodings]] = None,
+                 class_ids: Optional[Mapping[str, str]] = None,
+                 global_index: Optional[GlobalEncodingIndex] = None):
+        self.classes: Mapping[str, ClassEncodings] = MappingProxyType(dict(classes or {}))
+        self.class_ids: Mapping[str, str] = MappingProxyType(dict(class_ids or {}))
+        self._global_index = global_index
+        self._build_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(entry) for entry in self.classes.values())
+
+    def global_index(self, matcher_factory: Optional[Callable] = None) -> GlobalEncodingIndex:
+        """
+        Cross-class index, built on first use.
+
+        Every write invalidates it, and with an approximate matcher a rebuild
+        is costly, so only the first thread builds it; threads racing on the
+        same version wait and share the result.
+        """
+        index = self._global_index
+        if index is None:
+            with self._build_lock:
+                index = self._global_index
+                if index is None:
+                    index = GlobalEncodingIndex(self.classes, matcher_factory=matcher_factory)
+                    self._global_index = index
+        return index
+
+    def replace(self, classes: Optional[Mapping[str, ClassEncodings]] = None,
+                class_ids: Optional[Mapping[str, str]] = None) -> "IndexSnapshot":
+        """New snapshot with the given parts replaced; the global index is kept if classes are unchanged"""
+        class_ids = self.class_ids if class_ids is None else class_ids
+        if classes is None:
+            return IndexSnapshot(self.classes, class_ids, self._global_index)
+        return IndexSnapshot(classes, class_ids)
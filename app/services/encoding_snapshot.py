@@ -0,0 +1,149 @@
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional
+from uuid import uuid4
+import numpy as np
+
+from app.services.encoding_index import ENCODING_DIM, ClassEncodings
+
+
+SNAPSHOT_VERSION = 1
+META_FILE = "encodings.json"
+
+
+@dataclass
+class EncodingSnapshot:
+    """
+    Encodings as of high_water_mark (max students.updated_at).
+
+    classes maps class id to a ClassEncodings view; the full matrix and
+    parallel arrays are also exposed, in class order, together with the class
+    names and offsets at write time and the class registry (name -> id).
+    collapsed records whether students' templates were averaged into centroids.
+    """
+    high_water_mark: Optional[datetime]
+    classes: Dict[str, ClassEncodings]
+    generation: int
+    class_ids: Dict[str, str]
+    class_names: List[str]
+    class_offsets: np.ndarray
+    matrix: np.ndarray
+    sq_norms: np.ndarray
+    student_ids: np.ndarray
+    full_names: np.ndarray
+    student_codes: np.ndarray
+    collapsed: bool = False
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+
+def write_snapshot(directory: str, known_encodings: Mapping[str, ClassEncodings],
+                   class_ids: Mapping[str, str], high_water_mark: Optional[datetime],
+                   generation: int = 0, collapsed: bool = False) -> None:
+    """
+    Persist the encoding cache as an .npy matrix plus JSON metadata.
+
+    Rows are grouped by class so each class is one contiguous slice of the
+    matrix. Matrix files carry a unique suffix and the metadata file is
+    replaced atomically last, so readers (including other workers that still
+    map an older matrix) never see a torn snapshot.
+
+    Raises:
+        ValueError: A class with encodings has no known class id
+    """
+    entries = [(name, entry) for name, entry in known_encodings.items() if len(entry) > 0]
+    missing = [name for name, _ in entries if name not in class_ids]
+    if missing:
+        raise ValueError(f"Classes without ids cannot be snapshotted: {missing}")
+
+    os.makedirs(directory, exist_ok=True)
+    token = uuid4().hex
+    matrix_file, norms_file = f"encodings.{token}.npy", f"sq_norms.{token}.npy"
+    if entries:
+        matrix = np.concatenate([entry.encodings for _, entry in entries])
+        sq_norms = np.concatenate([entry.sq_norms for _, entry in entries])
+    else:
+        matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        sq_norms = np.empty(0, dtype=np.float32)
+    np.save(os.path.join(directory, matrix_file), matrix)
+    np.save(os.path.join(directory, norms_file), sq_norms)
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "generation": generation,
+        "collapsed": collapsed,
+        "high_water_mark": high_water_mark.isoformat() if high_water_mark else None,
+        "class_ids": dict(class_ids),
+        "matrix": matrix_file,
+        "sq_norms": norms_file,
+        "rows": int(matrix.shape[0]),
+        "classes": [{"class_id": class_ids[name], "name": name, "count": len(entry)} for name, entry in entries],
+        "student_ids": [sid for _, entry in entries for sid in entry.student_ids[:len(entry)]],
+        "full_names": [n for _, entry in entries for n in entry.full_names[:len(entry)]],
+        "student_codes": [c for _, entry in entries for c in entry.student_codes[:len(entry)]],
+    }
+    meta_path = os.path.join(directory, META_FILE)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    # Unlinking is safe for processes that still have an old matrix mapped
+    for name in os.listdir(directory):
+        if name.endswith(".npy") and name not in (matrix_file, norms_file):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def read_snapshot(directory: str) -> Optional[EncodingSnapshot]:
+    """
+    Memory-map a snapshot written by write_snapshot.
+
+    Returns:
+        The snapshot, or None if there is none or it is unreadable
+    """
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            return None
+        matrix = np.load(os.path.join(directory, meta["matrix"]), mmap_mode="r")
+        sq_norms = np.load(os.path.join(directory, meta["sq_norms"]), mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    rows = meta["rows"]
+    if matrix.shape != (rows, ENCODING_DIM) or sq_norms.shape != (rows,) or len(meta["student_ids"]) != rows:
+        return None
+
+    student_ids = np.array(meta["student_ids"], dtype=object)
+    full_names = np.array(meta["full_names"], dtype=object)
+    student_codes = np.array(meta["student_codes"], dtype=object)
+    classes: Dict[str, ClassEncodings] = {}
+    class_offsets = np.zeros(len(meta["classes"]) + 1, dtype=np.int64)
+    np.cumsum([entry["count"] for entry in meta["classes"]], out=class_offsets[1:])
+    for k, entry in enumerate(meta["classes"]):
+        start, end = class_offsets[k], class_offsets[k + 1]
+        classes[entry["class_id"]] = ClassEncodings.from_arrays(
+            matrix[start:end], sq_norms[start:end],
+            student_ids[start:end], full_names[start:end], student_codes[start:end]
+        )
+
+    high_water_mark = meta["high_water_mark"]
+    return EncodingSnapshot(
+        high_water_mark=datetime.fromisoformat(high_water_mark) if high_water_mark else None,
+        classes=classes,
+        generation=meta.get("generation", 0),
+        class_ids=meta.get("class_ids", {}),
+        class_names=[entry.get("name") for entry in meta["classes"]],
+        class_offsets=class_offsets,
+        matrix=matrix,
+        sq_norms=sq_norms,
+        student_ids=student_ids,
+        full_names=full_names,
+        student_codes=student_codes,
+        collapsed=meta.get("collapsed", False)
+    )
@@ -0,0 +1,331 @@
+import io
+import time
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+import face_recognition
+from PIL import Image
+
+
+# Face box in face_recognition order: (top, right, bottom, left)
+FaceBox = Tuple[int, int, int, int]
+# Seconds spent per pipeline stage ("decode", "detect", "landmark", "embed") of one call
+StageTimings = Dict[str, float]
+
+
+@contextmanager
+def timed(timings: Optional[StageTimings], stage: str):
+    """Add the wall time of a with block to timings[stage] (no-op if timings is None)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def scale_box(box: FaceBox, factor: float, height: int, width: int) -> FaceBox:
+    """Scale a (top, right, bottom, left) box by factor and clamp it to the image"""
+    top, right, bottom, left = box
+    return (
+        max(0, int(round(top * factor))),
+        min(width, int(round(right * factor))),
+        min(height, int(round(bottom * factor))),
+        max(0, int(round(left * factor)))
+    )
+
+
+def box_area(box: FaceBox) -> int:
+    top, right, bottom, left = box
+    return max(0, bottom - top) * max(0, right - left)
+
+
+def box_iou(a: FaceBox, b: FaceBox) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    intersection = box_area((max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])))
+    if intersection == 0:
+        return 0.0
+    return intersection / float(box_area(a) + box_area(b) - intersection)
+
+
+class DetectedFace(NamedTuple):
+    """One face found by FaceEncoder.encode_faces"""
+    box: FaceBox
+    encoding: Optional[np.ndarray]  # None when the face continues a track
+    track: Optional[int] = None  # index of the track box the face continues
+
+
+def batch_face_encodings(image: np.ndarray, boxes: List[FaceBox],
+                         timings: Optional[StageTimings] = None) -> List[np.ndarray]:
+    """
+    face_recognition.face_encodings for several faces in one ResNet pass.
+    
+    face_encodings computes one descriptor per call; dlib's
+    compute_face_descriptor also takes all landmark sets of an image and
+    runs them through the network as one batch, with identical results.
+    Landmarks use the same 5-point model as face_encodings' default, so
+    descriptors stay comparable with enrolled encodings. Landmarks and the
+    embedding are timed as separate stages.
+    """
+    api = face_recognition.api
+    with timed(timings, "landmark"):
+        landmarks = list(api._raw_face_landmarks(image, boxes, model="small"))
+    with timed(timings, "embed"):
+        if len(landmarks) <= 1:
+            # What face_encodings does for a single face
+            return [np.array(api.face_encoder.compute_face_descriptor(image, shape, 1)) for shape in landmarks]
+        import dlib
+        shapes = dlib.full_object_detections()
+        for shape in landmarks:
+            shapes.append(shape)
+        return [np.array(d) for d in api.face_encoder.compute_face_descriptor(image, shapes, 1)]
+
+
+def face_chips(image: np.ndarray, boxes: List[FaceBox],
+               timings: Optional[StageTimings] = None) -> List[np.ndarray]:
+    """
+    Aligned 150x150 face chips, cut exactly as compute_face_descriptor cuts
+    them from (image, landmarks): 5-point landmarks, padding 0.25.
+    Landmarks and alignment count as the "landmark" stage.
+    """
+    import dlib
+    with timed(timings, "landmark"):
+        landmarks = face_recognition.api._raw_face_landmarks(image, boxes, model="small")
+        return [dlib.get_face_chip(image, shape, size=150, padding=0.25) for shape in landmarks]
+
+
+def chip_descriptors(chips: List[np.ndarray]) -> List[np.ndarray]:
+    """128-d descriptors of aligned chips (see face_chips), one ResNet batch for all of them"""
+    if not chips:
+        return []
+    return [np.array(d) for d in face_recognition.api.face_encoder.compute_face_descriptor(list(chips), 1)]
+
+
+class FaceEncoder:
+    """
+    JPEG bytes -> 128-d face encoding pipeline.
+    
+    Holds only plain detection settings so it can be rebuilt inside worker
+    processes (see init_encode_worker) as well as used from FaceService threads.
+    """
+    
+    def __init__(self, scale: float = 1.0, model: str = "hog", upsample: int = 1):
+        """
+        Args:
+            scale: Resize factor (0, 1] for the frame used in face detection
+            model: face_recognition detector, "hog" or "cnn"
+            upsample: Number of times the detector upsamples the (scaled) frame
+        """
+        if not 0.0 < scale <= 1.0:
+            raise ValueError("detection_scale must be in (0, 1]")
+        self.scale = scale
+        self.model = model
+        self.upsample = upsample
+    
+    def decode_for_detection(self, image_bytes: bytes) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        Decode a frame at roughly the detection scale of its size.
+        
+        For JPEG input, Image.draft lets libjpeg apply DCT scaling and decode
+        straight to 1/2, 1/4 or 1/8 size. That skips most IDCT work and avoids
+        allocating a full-resolution RGB buffer. Any remaining difference to
+        the target size is closed with a cheap resize of the small image.
+        
+        Returns:
+            (small RGB array, (full_width, full_height))
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        full_size = image.size
+        target = (
+            max(1, int(full_size[0] * self.scale)),
+            max(1, int(full_size[1] * self.scale))
+        )
+        if self.scale < 1.0 and image.format == "JPEG":
+            image.draft("RGB", target)
+        image = image.convert("RGB")
+        if image.size[0] > target[0]:
+            image = image.resize(target, Image.BILINEAR)
+        return np.asarray(image), full_size
+    
+    def detect_faces(self, small: np.ndarray, full_size: Tuple[int, int]) -> List[FaceBox]:
+        """
+        Detect faces on the reduced frame.
+        
+        HOG/CNN detection cost grows with pixel count, so detecting at 0.5x does
+        about a quarter of the work; boxes are mapped back to full resolution.
+        
+        Returns:
+            Face boxes in full-resolution coordinates
+        """
+        width, height = full_size
+        locations = face_recognition.face_locations(
+            small,
+            number_of_times_to_upsample=self.upsample,
+            model=self.model
+        )
+        if small.shape[:2] != (height, width):
+            factor = (width / small.shape[1] + height / small.shape[0]) / 2.0
+            locations = [scale_box(loc, factor, height, width) for loc in locations]
+        return locations
+    
+    def decode_face_roi(self, image_bytes: bytes, boxes: List[FaceBox],
+                         full_size: Tuple[int, int]) -> Tuple[np.ndarray, List[FaceBox]]:
+        """
+        Decode the full-resolution region around one or more faces.
+        
+        The crop keeps a margin of half the box size on each side of every
+        face so landmark alignment has the context it needs; several faces
+        share one crop (their union) and one decode.
+        
+        Returns:
+            (RGB crop, boxes relative to the crop)
+        """
+        width, height = full_size
+        crop = (
+            max(0, min(left - (right - left) // 2 for top, right, bottom, left in boxes)),
+            max(0, min(top - (bottom - top) // 2 for top, right, bottom, left in boxes)),
+            min(width, max(right + (right - left) // 2 for top, right, bottom, left in boxes)),
+            min(height, max(bottom + (bottom - top) // 2 for top, right, bottom, left in boxes))
+        )
+        image = Image.open(io.BytesIO(image_bytes))
+        roi = np.asarray(image.crop(crop).convert("RGB"))
+        return roi, [(top - crop[1], right - crop[0], bottom - crop[1], left - crop[0])
+                     for top, right, bottom, left in boxes]
+    
+    def encode(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """
+        Encode the largest face in a frame.
+        
+        Detection runs on a reduced decode of the frame (see decode_for_detection);
+        only when a face is found is the region around the largest face decoded
+        at full resolution for landmarks and the embedding.
+        
+        Args:
+            image_bytes: JPEG or PNG image bytes
+            
+        Returns:
+            128-dimensional face encoding array or None if no face detected
+        """
+        faces = self.encode_faces(image_bytes, max_faces=1)
+        return faces[0].encoding if faces else None
+    
+    def encode_faces(self, image_bytes: bytes, max_faces: int = 1, track_boxes: Sequence[FaceBox] = (),
+                     min_iou: float = 0.5, timings: Optional[StageTimings] = None) -> List[DetectedFace]:
+        """
+        Encode up to max_faces faces of a frame, largest first.
+        
+        Faces overlapping one of track_boxes by at least min_iou continue that
+        track: they are detected but not encoded, and the caller reuses the
+        track's identity. The remaining faces share one full-resolution
+        region decode and one batched embedding pass.
+        
+        Args:
+            image_bytes: JPEG or PNG image bytes
+            max_faces: Largest faces kept per frame
+            track_boxes: Face boxes of the caller's previous frame whose identities may be reused
+            min_iou: Overlap with a track box that counts as the same face
+            timings: Filled with the seconds spent per stage, if given
+        
+        Returns:
+            Detected faces, largest first; empty if no face was detected
+        """
+        faces, pending, roi, roi_boxes = self._locate(image_bytes, max_faces, track_boxes, min_iou, timings)
+        if pending:
+            for i, encoding in zip(pending, batch_face_encodings(roi, roi_boxes, timings)):
+                faces[i] = faces[i]._replace(encoding=encoding)
+        # Faces the embedding could not be computed for are dropped
+        return [face for face in faces if face.track is not None or face.encoding is not None]
+    
+    def align_faces(self, image_bytes: bytes, max_faces: int = 1, track_boxes: Sequence[FaceBox] = (),
+                    min_iou: float = 0.5, timings: Optional[StageTimings] = None
+                    ) -> Tuple[List[DetectedFace], List[np.ndarray]]:
+        """
+        Everything encode_faces does except the embedding, for callers that
+        batch descriptors across frames (see EmbeddingBatcher).
+        
+        Returns:
+            (faces, chips): faces largest first, all without encoding, and one
+            aligned chip (see face_chips) per face that continues no track, in order
+        """
+        faces, pending, roi, roi_boxes = self._locate(image_bytes, max_faces, track_boxes, min_iou, timings)
+        return faces, face_chips(roi, roi_boxes, timings) if pending else []
+    
+    def _locate(self, image_bytes: bytes, max_faces: int, track_boxes: Sequence[FaceBox], min_iou: float,
+                timings: Optional[StageTimings] = None):
+        """
+        Detect, keep the largest faces, associate them with tracks and decode
+        the region around the faces that need an embedding.
+        
+        Returns:
+            (faces, indices of faces to encode, shared RGB crop or None, their boxes in the crop)
+        """
+        with timed(timings, "decode"):
+            small, full_size = self.decode_for_detection(image_bytes)
+        with timed(timings, "detect"):
+            locations = sorted(self.detect_faces(small, full_size), key=box_area, reverse=True)[:max_faces]
+        faces = []
+        free = list(range(len(track_boxes)))
+        for box in locations:
+            overlaps = [(box_iou(box, track_boxes[t]), t) for t in free]
+            best = max(overlaps, default=(0.0, None))
+            if best[1] is not None and best[0] >= min_iou:
+                # Each track is continued by at most one face
+                free.remove(best[1])
+                faces.append(DetectedFace(box, None, best[1]))
+            else:
+                faces.append(DetectedFace(box, None))
+        
+        pending = [i for i, face in enumerate(faces) if face.track is None]
+        if not pending:
+            return faces, pending, None, []
+        with timed(timings, "decode"):
+            roi, roi_boxes = self.decode_face_roi(image_bytes, [faces[i].box for i in pending], full_size)
+        return faces, pending, roi, roi_boxes
+
+
+# Per-process encoder used by the ProcessPoolExecutor mode of FaceService
+_worker_encoder: Optional[FaceEncoder] = None
+
+
+def init_encode_worker(scale: float, model: str, upsample: int) -> None:
+    """
+    ProcessPoolExecutor initializer: build the encoder once per worker process.
+    
+    face_recognition loads the dlib detector, landmark and ResNet models at
+    import; a dummy detection pages them in so the first real frame is not slow.
+    """
+    global _worker_encoder
+    _worker_encoder = FaceEncoder(scale=scale, model=model, upsample=upsample)
+    face_recognition.face_locations(np.zeros((32, 32, 3), dtype=np.uint8), model=model)
+
+
+def encode_in_worker(image_bytes: bytes) -> Optional[np.ndarray]:
+    """Encode one frame inside a worker process; only the 128-d vector is sent back"""
+    try:
+        return _worker_encoder.encode(image_bytes)
+    except Exception as e:
+        print(f"Error encoding face: {e}")
+        return None
+
+
+def align_faces_in_worker(image_bytes: bytes, max_faces: int, track_boxes: Sequence[FaceBox], min_iou: float
+                          ) -> Tuple[List[DetectedFace], List[np.ndarray], StageTimings]:
+    """FaceEncoder.align_faces inside a worker process; chips (150x150 RGB) and stage timings are sent back"""
+    timings: StageTimings = {}
+    try:
+        faces, chips = _worker_encoder.align_faces(image_bytes, max_faces, track_boxes, min_iou, timings)
+        return faces, chips, timings
+    except Exception as e:
+        print(f"Error encoding face: {e}")
+        return [], [], timings
+
+
+def encode_faces_in_worker(image_bytes: bytes, max_faces: int, track_boxes: Sequence[FaceBox],
+                           min_iou: float) -> Tuple[List[DetectedFace], StageTimings]:
+    """FaceEncoder.encode_faces inside a worker process; stage timings are sent back with the faces"""
+    timings: StageTimings = {}
+    try:
+        return _worker_encoder.encode_faces(image_bytes, max_faces, track_boxes, min_iou, timings), timings
+    except Exception as e:
+        print(f"Error encoding face: {e}")
+        return [], timings
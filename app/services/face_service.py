@@ -1,12 +1,58 @@
 import asyncio
-import io
-import pickle
-from typing import Dict, List, Tuple, Optional
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, List, Mapping, Sequence, Tuple, Optional
 from dataclasses import dataclass
+from datetime import timedelta
 from uuid import UUID
 import numpy as np
-import face_recognition
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.config import settings
+from app.services.face_encoder import (
+    DetectedFace, FaceBox, FaceEncoder, StageTimings, align_faces_in_worker, chip_descriptors,
+    encode_faces_in_worker, encode_in_worker, init_encode_worker
+)
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.metrics import STAGE_SECONDS, observe_stages
+from app.services.encoding_codec import decode_compact_batch, decode_encoding, decode_legacy, split_by_format
+from app.services.encoding_snapshot import EncodingSnapshot, read_snapshot, write_snapshot
+from app.services.shared_index import SharedEncodingIndex
+from app.services.encoding_index import ENCODING_DIM, ClassEncodings, GlobalEncodingIndex, IndexSnapshot, as_query
+from app.services.matchers import build_matcher
+
+
+# Student rows as loaded into the cache; callers append the WHERE clause
+STUDENT_ROWS_QUERY = '''
+    SELECT s.id as student_id, s.full_name, s.student_code, s.face_encoding, c.name as class_name, c.id as class_id
+    FROM students s
+    JOIN classes c ON s.class_id = c.id
+'''
+
+# Extra face templates (student_face_templates) as rows of the same shape
+TEMPLATE_ROWS_QUERY = '''
+    SELECT s.id as student_id, s.full_name, s.student_code, t.face_encoding, c.name as class_name, c.id as class_id
+    FROM student_face_templates t
+    JOIN students s ON t.student_id = s.id
+    JOIN classes c ON s.class_id = c.id
+'''
+
+# Rows per class for sizing the class matrices of a cold load
+CLASS_SIZES_QUERY = '''
+    SELECT c.name,
+        (SELECT count(s.face_encoding) FROM students s WHERE s.class_id = c.id)
+        + (SELECT count(*) FROM student_face_templates t
+           JOIN students s ON t.student_id = s.id WHERE s.class_id = c.id) AS encodings
+    FROM classes c
+'''
+
+TEMPLATE_SCORINGS = ("min", "mean_topk", "centroid")
+
+# Re-read rows updated slightly before the snapshot's high-water mark, so
+# transactions that committed after the snapshot with an earlier now() are not missed
+SNAPSHOT_OVERLAP = timedelta(minutes=5)
 
 
 @dataclass
@@ -18,6 +64,7 @@ class MatchResult:
     student_code: Optional[str]
     class_name: Optional[str]
     confidence: Optional[float]  # 1.0 - face_distance
+    class_id: Optional[str] = None
 
 
 class FaceService:
@@ -28,18 +75,125 @@ class FaceService:
     Requirements: 2.1, 2.2, 2.4, 2.5, 3.1, 3.2, 3.3, 3.4
     """
     
-    def __init__(self, tolerance: float = 0.5, max_workers: int = 4):
+    def __init__(self, tolerance: float = 0.5, max_workers: int = 4,
+                 matcher_backend: str = "brute", matcher_min_rows: int = 5000,
+                 matcher_params: Optional[dict] = None, detection_scale: float = 1.0,
+                 detection_model: str = "hog", detection_upsample: int = 1,
+                 encode_executor: str = "thread", encode_workers: int = 0,
+                 load_chunk_size: int = 5000, snapshot_dir: Optional[str] = None,
+                 shared_index_dir: Optional[str] = None, shared_poll_interval: float = 0.5,
+                 template_scoring: str = "min", template_top_k: int = 3, match_margin: float = 0.0,
+                 embed_batch_window_ms: float = 0.0, embed_batch_size: int = 16):
         """
         Initialize FaceService with ThreadPoolExecutor
         
         Args:
             tolerance: Face distance tolerance for matching (default 0.5)
             max_workers: Number of worker threads for CPU-bound operations (default 4)
+            matcher_backend: Nearest-neighbour backend for unscoped matching ("brute" or "ivf")
+            matcher_min_rows: Enrolment size below which approximate backends use brute force
+            matcher_params: Backend specific options, e.g. {"n_lists": 0, "n_probe": 8} for ivf
+            detection_scale: Resize factor (0, 1] for the frame used in face detection;
+                boxes are scaled back and encodings use the full-resolution face region
+            detection_model: face_recognition detector, "hog" or "cnn"
+            detection_upsample: Number of times the detector upsamples the (scaled) frame
+            encode_executor: "thread" runs face encoding on the shared thread pool;
+                "process" runs it on a ProcessPoolExecutor whose workers load the dlib
+                models once and receive raw JPEG bytes
+            encode_workers: Worker processes for "process" mode (0 = CPU count)
+            load_chunk_size: Rows fetched per cursor round trip by load_all_encodings
+            snapshot_dir: Directory for the memory-mapped encoding snapshot; when set,
+                startup maps the snapshot and only fetches rows changed since it
+            shared_index_dir: Coordination directory for sharing one mapped encoding
+                matrix between worker processes (see SharedEncodingIndex)
+            shared_poll_interval: Seconds between shared index generation checks
+            template_scoring: How students with several face templates are scored:
+                "min" (closest template), "mean_topk" (mean distance of the
+                template_top_k closest templates) or "centroid" (templates are
+                averaged into one row per student when cached)
+            template_top_k: Templates averaged per student by "mean_topk"
+            match_margin: Reject a match when the second-closest student is less
+                than this much farther than the closest (0 = off)
+            embed_batch_window_ms: Window for batching face descriptors of frames
+                from different cameras into one ResNet call (0 = off; see EmbeddingBatcher)
+            embed_batch_size: Chips that end a batch window early
         """
-        # In-memory encodings: dict[class_name, list[tuple[encoding, student_id, name, student_code]]]
-        self.known_encodings: Dict[str, List[Tuple[np.ndarray, str, str, str]]] = {}
+        # Current immutable cache version; replaced wholesale on every change
+        self.index = IndexSnapshot()
+        # Serializes writers only; matching never takes it
+        self._write_lock = threading.Lock()
+        # Students (and whether classes) changed by writers while a full load runs; None = no load
+        self._load_journal: Optional[set] = None
+        self._load_classes_changed = False
+        self.matcher_backend = matcher_backend
+        self.matcher_min_rows = matcher_min_rows
+        self.matcher_params = matcher_params or {}
+        self._matcher = None
+        self.load_chunk_size = max(1, load_chunk_size)
+        self.snapshot_dir = snapshot_dir or None
+        # Rows, encodings and seconds of the last load_all_encodings
+        self.load_stats: Dict[str, float] = {}
+        self.shared_index = SharedEncodingIndex(shared_index_dir, shared_poll_interval) if shared_index_dir else None
+        # Shared index generation currently mapped, and whether the leader has unpublished changes
+        self.generation = 0
+        self._shared_dirty = False
+        self._shared_sync_task: Optional[asyncio.Task] = None
+        self.encoder = FaceEncoder(scale=detection_scale, model=detection_model, upsample=detection_upsample)
         self.tolerance = tolerance
+        if template_scoring not in TEMPLATE_SCORINGS:
+            raise ValueError(f"Unknown template scoring: {template_scoring}")
+        self.template_scoring = template_scoring
+        self.template_top_k = max(1, template_top_k)
+        self.match_margin = match_margin
+        # Matches within tolerance rejected by the margin check; matching threads update it under the lock
+        self.ambiguous_rejections = 0
+        self._ambiguous_lock = threading.Lock()
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        if encode_executor not in ("thread", "process"):
+            raise ValueError(f"Unknown encode executor: {encode_executor}")
+        self.encode_executor_mode = encode_executor
+        self.encode_executor: Optional[ProcessPoolExecutor] = None
+        if encode_executor == "process":
+            # spawn: forking a process that already runs an event loop and threads is unsafe
+            self.encode_executor = ProcessPoolExecutor(
+                max_workers=encode_workers or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_encode_worker,
+                initargs=(detection_scale, detection_model, detection_upsample)
+            )
+        self.embedding_batcher: Optional[EmbeddingBatcher] = None
+        if embed_batch_window_ms > 0:
+            self.embedding_batcher = EmbeddingBatcher(
+                chip_descriptors,
+                executor=self.encode_executor or self.executor,
+                window=embed_batch_window_ms / 1000.0,
+                max_batch=embed_batch_size
+            )
+    
+    @property
+    def known_encodings(self) -> Mapping[str, ClassEncodings]:
+        """In-memory encodings of the current index: class_name -> ClassEncodings (read-only)"""
+        return self.index.classes
+    
+    @property
+    def class_ids(self) -> Mapping[str, str]:
+        """Class registry of the current index: class_name -> class_id (UUID string) (read-only)"""
+        return self.index.class_ids
+    
+    def _swap(self, index: IndexSnapshot, changed: bool = True) -> None:
+        """Publish a new index version to readers"""
+        self.index = index
+        if changed:
+            self._shared_dirty = True
+    
+    def _note_write(self, student_id: Optional[str] = None) -> None:
+        """Record a write for a running full load to catch up on (caller holds _write_lock)"""
+        if self._load_journal is None:
+            return
+        if student_id is None:
+            self._load_classes_changed = True
+        else:
+            self._load_journal.add(student_id)
     
     async def load_all_encodings(self) -> None:
         """
@@ -49,13 +203,36 @@ class FaceService:
         
         The encodings dictionary structure:
         {
-            "class_name": [
-                (encoding_array, student_id, full_name, student_code),
-                ...
-            ]
+            "class_name": ClassEncodings(
+                matrix=float32[N, 128], student_ids, full_names, student_codes
+            ),
+            ...
         }
+        
+        Rows are streamed through a server-side cursor in chunks of
+        load_chunk_size, so only one chunk of raw rows is held at a time, and
+        each chunk is decoded in bulk straight into class matrices that were
+        sized up front from per-class counts.
+        
+        With snapshot_dir set, the last snapshot is memory-mapped instead and
+        only students with updated_at past its high-water mark are streamed;
+        the snapshot is rewritten afterwards if anything changed.
+        
+        A student contributes one row for students.face_encoding plus one per
+        student_face_templates row; with "centroid" scoring each student's
+        rows are averaged into one before the cache is published.
+        
+        With a shared index, only the leader worker loads from the database
+        and publishes the result; other workers map the latest generation.
+        
+        The new cache is built privately and swapped in at the end, so
+        matches running during a reload keep using the previous version.
+        Writes made meanwhile (enrolments, class changes) would be lost with
+        the old version, so they are journaled and re-read from the database
+        once the new cache is in place.
         """
-        self.known_encodings.clear()
+        if self.shared_index is not None and not await self._lead_or_follow():
+            return
         
         print("Loading all encodings from database...")
         from app.database import pool
@@ -63,32 +240,310 @@ class FaceService:
             print("Error: DB Pool not initialized!")
             return
         
+        collapse = self.template_scoring == "centroid"
+        snapshot = read_snapshot(self.snapshot_dir) if self.snapshot_dir else None
+        if snapshot is not None and snapshot.collapsed != collapse:
+            # Centroids cannot be split back into templates (or vice versa)
+            snapshot = None
+        known: Dict[str, ClassEncodings] = {}
+        class_ids: Dict[str, str] = {}
+        started = time.perf_counter()
+        with self._write_lock:
+            self._load_journal, self._load_classes_changed = set(), False
+        try:
+            rows, legacy, removed, high_water_mark = await self._load_rows(
+                pool, snapshot, known, class_ids
+            )
+        except BaseException:
+            with self._write_lock:
+                self._load_journal = None
+            raise
+        
+        if legacy:
+            print(f"{legacy} encodings use the legacy pickle format; run scripts/migrate_encodings.py")
+        if collapse:
+            known = {name: entry.collapsed() for name, entry in known.items()}
+        
+        index = IndexSnapshot(known, class_ids)
+        with self._write_lock:
+            self._swap(index, changed=False)
+            changed_students, classes_changed = self._load_journal, self._load_classes_changed
+            self._load_journal = None
+        elapsed = time.perf_counter() - started
+        count = len(index)
+        self.load_stats = {"rows": rows, "encodings": count, "seconds": elapsed}
+        source = f"snapshot + {rows} changed rows" if snapshot is not None else f"{rows} rows"
+        print(f"Loaded {count} encodings across {len(index.classes)} classes from {source} "
+              f"in {elapsed:.2f}s ({rows / elapsed if elapsed > 0 else 0:.0f} rows/s).")
+        if changed_students or classes_changed:
+            await self._catch_up(pool, changed_students, classes_changed)
+        
+        if self.snapshot_dir and (snapshot is None or rows or removed):
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    self.executor, write_snapshot, self.snapshot_dir,
+                    index.classes, index.class_ids, high_water_mark, 0, collapse
+                )
+                if snapshot is not None and snapshot.high_water_mark:
+                    await self._prune_deletions(pool, snapshot.high_water_mark - SNAPSHOT_OVERLAP)
+            except Exception as e:
+                print(f"Failed to write encoding snapshot: {e}")
+        
+        if self.shared_index is not None:
+            await self._publish_shared()
+    
+    async def _catch_up(self, pool, student_ids: set, classes_changed: bool) -> None:
+        """Re-apply writes made while a full load ran, reading them back from the database"""
+        if classes_changed:
+            async with pool.acquire() as conn:
+                records = await conn.fetch('SELECT id, name FROM classes')
+            names = {str(record['id']): record['name'] for record in records}
+            for name, class_id in list(self.index.class_ids.items()):
+                if class_id not in names:
+                    self.remove_class(name)
+                elif names[class_id] != name:
+                    self.rename_class(name, names[class_id])
+            for class_id, name in names.items():
+                self.register_class(class_id, name)
+        for student_id in student_ids:
+            await self.reload_student(student_id)
+        print(f"Caught up on {len(student_ids)} students"
+              f"{' and class changes' if classes_changed else ''} written during the load.")
+    
+    async def _load_rows(self, pool, snapshot: Optional[EncodingSnapshot], known: Dict[str, ClassEncodings],
+                         class_ids: Dict[str, str]):
+        """
+        Fill known and class_ids from the database (and the snapshot, if any).
+        
+        Returns:
+            (rows streamed, legacy rows, rows removed, high-water mark or None)
+        """
+        rows = legacy = removed = 0
+        high_water_mark = None
         async with pool.acquire() as conn:
-            records = await conn.fetch('''
-                SELECT s.id as student_id, s.full_name, s.student_code, s.face_encoding, c.name as class_name 
-                FROM students s
-                JOIN classes c ON s.class_id = c.id
-                WHERE s.face_encoding IS NOT NULL
-            ''')
-            
-            for record in records:
-                class_name = record['class_name']
-                if class_name not in self.known_encodings:
-                    self.known_encodings[class_name] = []
+            # One snapshot for the sizing query and the cursor, so counts match the rows streamed
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                classes = await conn.fetch('SELECT id, name FROM classes')
+                for record in classes:
+                    class_ids[record['name']] = str(record['id'])
+                if self.snapshot_dir:
+                    high_water_mark = await conn.fetchval('SELECT max(updated_at) FROM students')
                 
-                try:
-                    encoding = pickle.loads(record['face_encoding'])
-                    self.known_encodings[class_name].append((
-                        encoding,
-                        str(record['student_id']),
-                        record['full_name'],
-                        record['student_code']
-                    ))
-                except Exception as e:
-                    print(f"Failed to load encoding for {record['student_code']}: {e}")
-        
-        count = sum(len(encs) for encs in self.known_encodings.values())
-        print(f"Loaded {count} encodings across {len(self.known_encodings)} classes.")
+                located = None
+                if snapshot is not None:
+                    # Warm start: only rows touched since the snapshot (NULL encodings mean removal)
+                    located = self._restore_snapshot(snapshot, known, class_ids)
+                    since = snapshot.high_water_mark - SNAPSHOT_OVERLAP if snapshot.high_water_mark else None
+                    # Template changes bump students.updated_at, so one filter covers both
+                    changed = 'WHERE $1::timestamp IS NULL OR s.updated_at >= $1'
+                    queries = [(STUDENT_ROWS_QUERY + changed, since), (TEMPLATE_ROWS_QUERY + changed, since)]
+                else:
+                    for record in await conn.fetch(CLASS_SIZES_QUERY):
+                        if record['encodings']:
+                            known[record['name']] = ClassEncodings(capacity=record['encodings'])
+                    queries = [(STUDENT_ROWS_QUERY + 'WHERE s.face_encoding IS NOT NULL',), (TEMPLATE_ROWS_QUERY,)]
+                # Primary rows first: replacing a changed student drops all of its
+                # rows once, before its templates are appended
+                for query in queries:
+                    cursor = await conn.cursor(*query)
+                    while True:
+                        chunk = await cursor.fetch(self.load_chunk_size)
+                        if not chunk:
+                            break
+                        rows += len(chunk)
+                        legacy += self._load_chunk(chunk, known, located)
+                if snapshot is not None:
+                    removed = await self._drop_deleted(conn, known, located, since)
+        return rows, legacy, removed, high_water_mark
+    
+    @property
+    def manages_encodings(self) -> bool:
+        """False for workers that follow another worker's shared index"""
+        return self.shared_index is None or self.shared_index.is_leader
+    
+    async def _lead_or_follow(self) -> bool:
+        """
+        Take shared index leadership, or attach to the leader's latest generation.
+        
+        Returns:
+            True if this worker leads and must load from the database
+        """
+        while not self.shared_index.try_lead():
+            snapshot = self.shared_index.read()
+            if snapshot is not None:
+                self._attach_shared(snapshot)
+                print(f"Attached to shared encoding index generation {snapshot.generation}")
+                return False
+            # The leader is still loading
+            await asyncio.sleep(self.shared_index.poll_interval)
+        return True
+    
+    async def _publish_shared(self) -> None:
+        """Publish the cache as a new generation and map it back (leader only)"""
+        index = self.index
+        self._shared_dirty = False
+        # The published index is immutable, so it can be written off the event loop
+        generation = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.shared_index.publish, index.classes, index.class_ids
+        )
+        snapshot = self.shared_index.read()
+        # Changes made while writing stay private until the next publish
+        if snapshot is not None and snapshot.generation == generation and self.index is index:
+            self._attach_shared(snapshot)
+    
+    def _attach_shared(self, snapshot: EncodingSnapshot) -> None:
+        """
+        Replace the cache with read-only views of a published generation.
+        
+        Runs on the event loop; the matcher is only trained by the first match
+        against the generation, on an executor thread.
+        """
+        global_index = GlobalEncodingIndex.from_arrays(
+            snapshot.matrix, snapshot.sq_norms, snapshot.student_ids, snapshot.full_names,
+            snapshot.student_codes, snapshot.class_names, snapshot.class_offsets,
+            matcher_factory=self._build_matcher
+        )
+        self._swap(IndexSnapshot(dict(zip(snapshot.class_names, snapshot.classes.values())),
+                                 snapshot.class_ids, global_index), changed=False)
+        self.generation = snapshot.generation
+    
+    def start_shared_sync(self) -> None:
+        """Start publishing (leader) or following (other workers) shared index generations"""
+        if self.shared_index is not None and self._shared_sync_task is None:
+            self._shared_sync_task = asyncio.create_task(self._run_shared_sync())
+    
+    async def _run_shared_sync(self) -> None:
+        while True:
+            await asyncio.sleep(self.shared_index.poll_interval)
+            try:
+                if self.shared_index.is_leader:
+                    # Changes are batched into at most one generation per interval
+                    if self._shared_dirty:
+                        await self._publish_shared()
+                elif self.shared_index.try_lead():
+                    print("Previous shared index leader exited; taking over")
+                    await self.load_all_encodings()
+                elif self.shared_index.read_generation() != self.generation:
+                    snapshot = self.shared_index.read()
+                    if snapshot is not None:
+                        self._attach_shared(snapshot)
+            except Exception as e:
+                print(f"Shared encoding index sync failed: {e}")
+    
+    @staticmethod
+    def _restore_snapshot(snapshot: EncodingSnapshot, known: Dict[str, ClassEncodings],
+                          class_ids: Dict[str, str]) -> Dict[str, str]:
+        """
+        Install memory-mapped snapshot classes into known under their current names.
+        
+        Classes deleted since the snapshot are dropped with their students.
+        
+        Returns:
+            student_id -> class_name for every restored row
+        """
+        names = {class_id: name for name, class_id in class_ids.items()}
+        located = {}
+        for class_id, entry in snapshot.classes.items():
+            name = names.get(class_id)
+            if name is None:
+                continue
+            known[name] = entry
+            located.update(dict.fromkeys(entry.student_ids[:len(entry)], name))
+        return located
+    
+    @staticmethod
+    async def _drop_deleted(conn, known: Dict[str, ClassEncodings], located: Dict[str, str], since) -> int:
+        """
+        Remove restored students deleted since the snapshot.
+        
+        Deletions leave no updated_at trace; the student_deletions tombstones
+        written by a trigger (see scripts/init_db.py) record them instead, so
+        this reads only the deletions since the snapshot. Students who lost
+        their encodings were updated and are handled with the changed rows.
+        
+        Args:
+            located: student_id -> class_name of restored students not replaced by changed rows
+            since: Snapshot high-water mark minus the overlap (None = every tombstone)
+        
+        Returns:
+            Number of rows removed
+        """
+        deleted = await conn.fetch(
+            'SELECT student_id FROM student_deletions WHERE $1::timestamp IS NULL OR deleted_at >= $1', since
+        )
+        removed = 0
+        for record in deleted:
+            class_name = located.pop(str(record['student_id']), None)
+            if class_name is not None:
+                removed += known[class_name].remove_student(str(record['student_id']))
+        return removed
+    
+    @staticmethod
+    async def _prune_deletions(pool, before) -> None:
+        """
+        Delete tombstones no warm start needs any more.
+        
+        Called once a newer snapshot has replaced the one just loaded: warm
+        starts only read tombstones from their snapshot's high-water mark minus
+        the overlap, and the replaced snapshot's is the oldest still readable.
+        """
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute('DELETE FROM student_deletions WHERE deleted_at < $1', before)
+        except Exception as e:
+            print(f"Failed to prune student deletion tombstones: {e}")
+    
+    @staticmethod
+    def _load_chunk(records, known: Dict[str, ClassEncodings],
+                    located: Optional[Dict[str, str]] = None) -> int:
+        """
+        Decode one chunk of student rows and append them to their classes.
+        
+        Compact rows are decoded with a single frombuffer; legacy pickles one by one.
+        
+        Args:
+            records: Student rows
+            known: Classes being built (not yet published)
+            located: student_id -> class_name of students already cached; all
+                their rows are replaced, and rows with a NULL encoding only removed
+        
+        Returns:
+            Number of rows in the legacy pickle format
+        """
+        if located is not None:
+            for record in records:
+                class_name = located.pop(str(record['student_id']), None)
+                if class_name is not None:
+                    known[class_name].remove_student(str(record['student_id']))
+            records = [record for record in records if record['face_encoding'] is not None]
+        
+        blobs = [record['face_encoding'] for record in records]
+        compact_rows, legacy_rows = split_by_format(blobs)
+        encodings = np.empty((len(records), ENCODING_DIM), dtype=np.float32)
+        valid = np.zeros(len(records), dtype=bool)
+        if compact_rows:
+            encodings[compact_rows] = decode_compact_batch([blobs[i] for i in compact_rows])
+            valid[compact_rows] = True
+        for i in legacy_rows:
+            try:
+                encodings[i] = decode_legacy(blobs[i])
+                valid[i] = True
+            except Exception as e:
+                print(f"Failed to load encoding for {records[i]['student_code']}: {e}")
+        
+        by_class: Dict[str, List[int]] = {}
+        for i in np.flatnonzero(valid):
+            by_class.setdefault(records[i]['class_name'], []).append(i)
+        for class_name, rows in by_class.items():
+            if class_name not in known:
+                known[class_name] = ClassEncodings(capacity=len(rows))
+            known[class_name].extend(
+                encodings[rows],
+                [str(records[i]['student_id']) for i in rows],
+                [records[i]['full_name'] for i in rows],
+                [records[i]['student_code'] for i in rows]
+            )
+        return len(legacy_rows)
     
     def _encode_face_sync(self, image_bytes: bytes) -> Optional[np.ndarray]:
         """
@@ -101,11 +556,7 @@ class FaceService:
             128-dimensional face encoding array or None if no face detected
         """
         try:
-            image = face_recognition.load_image_file(io.BytesIO(image_bytes))
-            encodings = face_recognition.face_encodings(image)
-            if len(encodings) > 0:
-                return encodings[0]
-            return None
+            return self.encoder.encode(image_bytes)
         except Exception as e:
             print(f"Error encoding face: {e}")
             return None
@@ -123,51 +574,252 @@ class FaceService:
             128-dimensional face encoding array or None if no face detected
         """
         loop = asyncio.get_running_loop()
+        if self.encode_executor is not None:
+            return await loop.run_in_executor(self.encode_executor, encode_in_worker, image_bytes)
         return await loop.run_in_executor(self.executor, self._encode_face_sync, image_bytes)
     
-    def _match_face_sync(self, unknown_encoding: np.ndarray, class_name: Optional[str] = None) -> Optional[dict]:
+    def _encode_faces_sync(self, image_bytes: bytes, max_faces: int, track_boxes: Sequence[FaceBox],
+                           min_iou: float, timings: Optional[StageTimings] = None) -> List[DetectedFace]:
+        try:
+            return self.encoder.encode_faces(image_bytes, max_faces, track_boxes, min_iou, timings)
+        except Exception as e:
+            print(f"Error encoding face: {e}")
+            return []
+    
+    def _align_faces_sync(self, image_bytes: bytes, max_faces: int, track_boxes: Sequence[FaceBox],
+                          min_iou: float) -> Tuple[List[DetectedFace], List[np.ndarray], StageTimings]:
+        timings: StageTimings = {}
+        try:
+            faces, chips = self.encoder.align_faces(image_bytes, max_faces, track_boxes, min_iou, timings)
+            return faces, chips, timings
+        except Exception as e:
+            print(f"Error encoding face: {e}")
+            return [], [], timings
+    
+    async def encode_faces(self, image_bytes: bytes, max_faces: int = 1,
+                           track_boxes: Sequence[FaceBox] = (), min_iou: float = 0.5) -> List[DetectedFace]:
+        """
+        Detect up to max_faces faces, largest first, and encode those that do
+        not continue a track, in one batched embedding pass.
+        
+        With an embedding batcher, detection and alignment run per frame and
+        the aligned chips join a batch shared with other callers.
+        
+        Seconds spent per stage (decode, detect, landmark, embed) are recorded
+        in the recognition_stage_seconds histogram.
+        
+        Args:
+            image_bytes: JPEG or PNG image bytes
+            max_faces: Largest faces kept per frame
+            track_boxes: Face boxes of the previous frame whose identities may be reused
+            min_iou: Overlap with a track box that counts as the same face
+        
+        Returns:
+            DetectedFace list (see FaceEncoder.encode_faces); empty if no face detected
+        """
+        loop = asyncio.get_running_loop()
+        track_boxes = list(track_boxes)
+        if self.embedding_batcher is not None:
+            return await self._encode_faces_batched(image_bytes, max_faces, track_boxes, min_iou)
+        if self.encode_executor is not None:
+            faces, timings = await loop.run_in_executor(
+                self.encode_executor, encode_faces_in_worker, image_bytes, max_faces, track_boxes, min_iou
+            )
+        else:
+            timings = {}
+            faces = await loop.run_in_executor(
+                self.executor, self._encode_faces_sync, image_bytes, max_faces, track_boxes, min_iou, timings
+            )
+        observe_stages(timings)
+        return faces
+    
+    async def _encode_faces_batched(self, image_bytes: bytes, max_faces: int,
+                                    track_boxes: List[FaceBox], min_iou: float) -> List[DetectedFace]:
+        loop = asyncio.get_running_loop()
+        if self.encode_executor is not None:
+            faces, chips, timings = await loop.run_in_executor(
+                self.encode_executor, align_faces_in_worker, image_bytes, max_faces, track_boxes, min_iou
+            )
+        else:
+            faces, chips, timings = await loop.run_in_executor(
+                self.executor, self._align_faces_sync, image_bytes, max_faces, track_boxes, min_iou
+            )
+        observe_stages(timings)
+        start = time.perf_counter()
+        try:
+            descriptors = iter(await self.embedding_batcher.descriptors(chips))
+        except Exception as e:
+            print(f"Error encoding face: {e}")
+            return []
+        if chips:
+            # Includes the batch window: that is what the embedding costs this frame
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="embed")
+        return [face if face.track is not None else face._replace(encoding=next(descriptors)) for face in faces]
+    
+    def _match_face_sync(self, unknown_encoding: np.ndarray, class_name: Optional[str] = None,
+                         count: bool = True) -> Optional[dict]:
         """
         Synchronous face matching (runs in ThreadPoolExecutor).
         
         Args:
             unknown_encoding: Face encoding to match
-            class_name: Optional class name to limit search scope
+            class_name: Optional class name to limit search scope; a class with
+                no enrolled encodings never matches
+            count: Count margin rejections in ambiguous_rejections (off for debug matches)
             
         Returns:
             Dictionary with match details or None if no match found
         """
-        best_match = None
-        best_distance = 1.0
+        query = as_query(unknown_encoding)
+        # One reference for the whole match; concurrent swaps cannot affect it
+        snapshot = self.index
         
-        # Determine which classes to check
-        classes_to_check = [class_name] if class_name and class_name in self.known_encodings else self.known_encodings.keys()
+        if class_name:
+            index = snapshot.classes.get(class_name)
+            if index is None:
+                return None
+            class_of = lambda row: class_name
+        else:
+            # Unscoped: one pass over every class at once
+            index = snapshot.global_index(self._build_matcher)
+            class_of = index.class_of
+        if self.match_margin > 0:
+            # A runner-up beyond tolerance + margin cannot violate the margin
+            rows, distances = index.nearest_students(
+                query, 2, self._scoring_top_k, self.tolerance + self.match_margin
+            )
+            if len(rows) == 0 or distances[0] > self.tolerance:
+                return None
+            if len(rows) > 1 and distances[1] - distances[0] < self.match_margin:
+                if count:
+                    with self._ambiguous_lock:
+                        self.ambiguous_rejections += 1
+                return None
+            nearest = int(rows[0]), float(distances[0])
+        elif self.template_scoring == "mean_topk":
+            nearest = index.nearest_student(query, self.template_top_k, self.tolerance)
+        else:
+            nearest = index.nearest(query)
         
-        for c_name in classes_to_check:
-            class_students = self.known_encodings.get(c_name, [])
-            if not class_students:
-                continue
-            
-            # Extract encodings for this class
-            encs = [item[0] for item in class_students]
-            
-            # Calculate face distances
-            distances = face_recognition.face_distance(encs, unknown_encoding)
-            
-            # Find best match in this class
-            for i, distance in enumerate(distances):
-                if distance <= self.tolerance and distance < best_distance:
-                    best_distance = distance
-                    best_match = {
-                        "student_id": class_students[i][1],
-                        "name": class_students[i][2],
-                        "student_code": class_students[i][3],
-                        "class_name": c_name,
-                        "confidence": 1.0 - distance
-                    }
-        
-        return best_match
-    
-    async def match_face(self, unknown_encoding: np.ndarray, class_name: Optional[str] = None) -> MatchResult:
+        if nearest is None:
+            return None
+        row, distance = nearest
+        if distance > self.tolerance:
+            return None
+        return self._match_dict(snapshot, index, class_of, row, distance)
+    
+    @property
+    def _scoring_top_k(self) -> int:
+        """Templates scored per student (1 unless scoring is "mean_topk")"""
+        return self.template_top_k if self.template_scoring == "mean_topk" else 1
+    
+    @staticmethod
+    def _match_dict(snapshot: IndexSnapshot, index, class_of, row: int, distance: float) -> dict:
+        return {
+            "student_id": index.student_ids[row],
+            "name": index.full_names[row],
+            "student_code": index.student_codes[row],
+            "class_name": class_of(row),
+            "class_id": snapshot.class_ids.get(class_of(row)),
+            "confidence": 1.0 - distance
+        }
+    
+    def _match_face_topk_sync(self, unknown_encoding: np.ndarray, k: int = 5,
+                              class_name: Optional[str] = None) -> List[dict]:
+        """
+        The k closest students, whether or not they are within tolerance.
+        
+        Students are scored as in _match_face_sync (see template_scoring);
+        the k best are selected with argpartition rather than a full sort.
+        Unscoped queries always scan every row exactly.
+        
+        Returns:
+            Match dictionaries plus "distance", closest first
+        """
+        query = as_query(unknown_encoding)
+        snapshot = self.index
+        if class_name:
+            index = snapshot.classes.get(class_name)
+            if index is None:
+                return []
+            class_of = lambda row: class_name
+        else:
+            index = snapshot.global_index(self._build_matcher)
+            class_of = index.class_of
+        rows, distances = index.nearest_students(query, k, self._scoring_top_k)
+        return [
+            {**self._match_dict(snapshot, index, class_of, int(row), float(distance)), "distance": float(distance)}
+            for row, distance in zip(rows, distances)
+        ]
+    
+    async def match_face_topk(self, unknown_encoding: np.ndarray, k: int = 5,
+                              class_name: Optional[str] = None) -> List[dict]:
+        """
+        Return the k closest students to an encoding with their distances.
+        
+        Args:
+            unknown_encoding: 128-dimensional face encoding
+            k: Number of students to return
+            class_name: Optional class name to limit the search to
+        
+        Returns:
+            Match dictionaries plus "distance", closest first
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._match_face_topk_sync, unknown_encoding, k, class_name)
+    
+    def _match_faces_sync(self, encodings: Sequence[np.ndarray],
+                          class_name: Optional[str] = None) -> List[Optional[dict]]:
+        """
+        Match several faces of one frame against the same index version.
+        
+        With plain closest-template scoring all queries are answered by one
+        matrix product; per-student scoring and margin checks run per face.
+        
+        Returns:
+            One match dictionary (or None) per encoding, in order
+        """
+        if len(encodings) == 0:
+            return []
+        if self.match_margin > 0 or self.template_scoring == "mean_topk" or len(encodings) == 1:
+            return [self._match_face_sync(encoding, class_name) for encoding in encodings]
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        snapshot = self.index
+        if class_name:
+            index = snapshot.classes.get(class_name)
+            if index is None:
+                return [None] * len(queries)
+            class_of = lambda row: class_name
+        else:
+            index = snapshot.global_index(self._build_matcher)
+            class_of = index.class_of
+        nearest = index.nearest_batch(queries)
+        if nearest is None:
+            return [None] * len(queries)
+        return [
+            self._match_dict(snapshot, index, class_of, int(row), float(distance))
+            if distance <= self.tolerance else None
+            for row, distance in zip(*nearest)
+        ]
+    
+    def _get_global_index(self) -> GlobalEncodingIndex:
+        """Return the cross-class index of the current version, building it on first use"""
+        return self.index.global_index(self._build_matcher)
+    
+    def _build_matcher(self, matrix: np.ndarray, sq_norms: np.ndarray):
+        """Build the configured matcher, reusing trained state from the previous one"""
+        self._matcher = build_matcher(
+            self.matcher_backend,
+            matrix,
+            sq_norms,
+            min_rows=self.matcher_min_rows,
+            previous=self._matcher,
+            **self.matcher_params
+        )
+        return self._matcher
+    
+    async def match_face(self, unknown_encoding: np.ndarray, class_name: Optional[str] = None,
+                         count: bool = True) -> MatchResult:
         """
         Match face encoding against in-memory encodings with tolerance 0.5.
         
@@ -176,6 +828,7 @@ class FaceService:
         Args:
             unknown_encoding: 128-dimensional face encoding to match
             class_name: Optional class name to limit search to specific class
+            count: Count margin rejections in ambiguous_rejections (False for debug matches)
             
         Returns:
             MatchResult with match details or matched=False if no match found
@@ -185,9 +838,29 @@ class FaceService:
             self.executor,
             self._match_face_sync,
             unknown_encoding,
-            class_name
+            class_name,
+            count
         )
+        return self._match_result(match_dict)
+    
+    async def match_faces(self, encodings: Sequence[np.ndarray],
+                          class_name: Optional[str] = None) -> List[MatchResult]:
+        """
+        Match all faces of one frame in a single executor call.
+        
+        Args:
+            encodings: 128-dimensional face encodings
+            class_name: Optional class name to limit search to specific class
         
+        Returns:
+            One MatchResult per encoding, in order
+        """
+        loop = asyncio.get_running_loop()
+        match_dicts = await loop.run_in_executor(self.executor, self._match_faces_sync, list(encodings), class_name)
+        return [self._match_result(match_dict) for match_dict in match_dicts]
+    
+    @staticmethod
+    def _match_result(match_dict: Optional[dict]) -> MatchResult:
         if match_dict:
             return MatchResult(
                 matched=True,
@@ -195,7 +868,8 @@ class FaceService:
                 student_name=match_dict["name"],
                 student_code=match_dict["student_code"],
                 class_name=match_dict["class_name"],
-                confidence=match_dict["confidence"]
+                confidence=match_dict["confidence"],
+                class_id=match_dict["class_id"]
             )
         else:
             return MatchResult(
@@ -208,7 +882,8 @@ class FaceService:
             )
     
     async def add_student_encoding(self, student_id: UUID, class_name: str, full_name: str, 
-                                   student_code: str, encoding: np.ndarray) -> None:
+                                   student_code: str, encoding: np.ndarray,
+                                   class_id: Optional[UUID] = None) -> None:
         """
         Add a new student encoding to the in-memory cache immediately.
         
@@ -220,29 +895,184 @@ class FaceService:
             full_name: Student full name
             student_code: Student code
             encoding: Face encoding array
+            class_id: Class UUID, recorded in the class registry
         """
-        self._add_student_encoding_sync(student_id, class_name, full_name, student_code, encoding)
+        self._add_student_encoding_sync(student_id, class_name, full_name, student_code, encoding, class_id)
     
     def _add_student_encoding_sync(self, student_id: UUID, class_name: str, full_name: str,
-                                   student_code: str, encoding: np.ndarray) -> None:
+                                   student_code: str, encoding: np.ndarray,
+                                   class_id: Optional[UUID] = None) -> None:
+        """Synchronous version of add_student_encoding for internal use."""
+        self._add_student_templates_sync(student_id, class_name, full_name, student_code, [encoding], class_id)
+        print(f"Added encoding for {student_code} to in-memory cache")
+    
+    def _add_student_templates_sync(self, student_id: UUID, class_name: str, full_name: str,
+                                    student_code: str, encodings: Sequence[np.ndarray],
+                                    class_id: Optional[UUID] = None) -> None:
         """
-        Synchronous version of add_student_encoding for internal use.
+        Cache all face templates of a student, replacing whatever was cached.
+        
+        Idempotent per student: existing rows for student_id (in any class)
+        are replaced, so the same change arriving from the router and from the
+        cache sync listener is applied once.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        if self.template_scoring == "centroid":
+            encodings = encodings.mean(axis=0, keepdims=True)
+        n = len(encodings)
+        with self._write_lock:
+            self._note_write(str(student_id))
+            classes, class_ids = dict(self.index.classes), dict(self.index.class_ids)
+            self._without_student(classes, str(student_id))
+            if class_id is not None:
+                class_ids[class_name] = str(class_id)
+            # Copy-on-write: published ClassEncodings are never modified
+            entry = classes.get(class_name)
+            entry = entry.copy(extra=n) if entry is not None else ClassEncodings(capacity=n)
+            entry.extend(encodings, [str(student_id)] * n, [full_name] * n, [student_code] * n)
+            classes[class_name] = entry
+            self._swap(IndexSnapshot(classes, class_ids))
+    
+    async def reload_student(self, student_id: UUID) -> bool:
         """
-        if class_name not in self.known_encodings:
-            self.known_encodings[class_name] = []
+        Re-read a student's encoding and face templates into the cache.
         
-        self.known_encodings[class_name].append((
-            encoding,
-            str(student_id),
-            full_name,
-            student_code
-        ))
-        print(f"Added encoding for {student_code} to in-memory cache")
+        Returns:
+            True if the student has any encoding and is now cached; otherwise
+            the student is removed from the cache
+        """
+        from app.database import pool
+        async with pool.acquire() as conn:
+            record = await conn.fetchrow(STUDENT_ROWS_QUERY + ' WHERE s.id = $1', student_id)
+            templates = []
+            if record is not None:
+                templates = await conn.fetch(TEMPLATE_ROWS_QUERY + ' WHERE t.student_id = $1', student_id)
+        blobs = [r['face_encoding'] for r in [record, *templates] if r is not None and r['face_encoding'] is not None]
+        if not blobs:
+            await self.remove_student(student_id)
+            return False
+        self._add_student_templates_sync(
+            record['student_id'], record['class_name'], record['full_name'], record['student_code'],
+            [decode_encoding(blob) for blob in blobs], record['class_id']
+        )
+        return True
+    
+    async def remove_student(self, student_id: UUID) -> bool:
+        """
+        Remove a student's encoding from the in-memory cache.
+        
+        Returns:
+            True if the student was cached
+        """
+        return self._remove_student_sync(student_id)
+    
+    def _remove_student_sync(self, student_id: UUID) -> bool:
+        with self._write_lock:
+            self._note_write(str(student_id))
+            classes = dict(self.index.classes)
+            if not self._without_student(classes, str(student_id)):
+                return False
+            self._swap(self.index.replace(classes=classes))
+            return True
+    
+    @staticmethod
+    def _without_student(classes: Dict[str, ClassEncodings], student_id: str) -> bool:
+        """Replace the class holding student_id in classes with a copy lacking its rows"""
+        for name, entry in classes.items():
+            if entry.find(student_id) >= 0:
+                entry = entry.copy()
+                entry.remove_student(student_id)
+                classes[name] = entry
+                return True
+        return False
+    
+    def class_name_for(self, class_id: UUID) -> Optional[str]:
+        """Class name registered for a class id, or None"""
+        class_id = str(class_id)
+        for name, known_id in self.class_ids.items():
+            if known_id == class_id:
+                return name
+        return None
+    
+    def register_class(self, class_id: UUID, class_name: str) -> None:
+        """Record a newly created class in the class registry"""
+        with self._write_lock:
+            self._note_write()
+            if self.index.class_ids.get(class_name) != str(class_id):
+                self._swap(self.index.replace(class_ids={**self.index.class_ids, class_name: str(class_id)}))
+    
+    def rename_class(self, old_name: str, new_name: str) -> None:
+        """Move a class's registry entry and encodings to its new name"""
+        with self._write_lock:
+            self._note_write()
+            index = self.index
+            if old_name not in index.class_ids and old_name not in index.classes:
+                return
+            class_ids = dict(index.class_ids)
+            if old_name in class_ids:
+                class_ids[new_name] = class_ids.pop(old_name)
+            classes = None
+            if old_name in index.classes:
+                classes = dict(index.classes)
+                classes[new_name] = classes.pop(old_name)
+            self._swap(index.replace(classes=classes, class_ids=class_ids))
+    
+    def remove_class(self, class_name: str) -> None:
+        """Forget a deleted class; its students are removed with it (ON DELETE CASCADE)"""
+        with self._write_lock:
+            self._note_write()
+            index = self.index
+            if class_name not in index.class_ids and class_name not in index.classes:
+                return
+            class_ids = {name: class_id for name, class_id in index.class_ids.items() if name != class_name}
+            classes = None
+            if class_name in index.classes:
+                classes = {name: entry for name, entry in index.classes.items() if name != class_name}
+            self._swap(index.replace(classes=classes, class_ids=class_ids))
+    
+    def executor_queue_depth(self) -> Dict[str, int]:
+        """
+        Jobs waiting for a worker, per executor ("thread" is the shared thread
+        pool, "process" the encode process pool if any). Read from the
+        executors' internal queues; good enough for monitoring, not for control.
+        """
+        depth = {"thread": self.executor._work_queue.qsize()}
+        if self.encode_executor is not None:
+            # Submitted and not yet finished; includes jobs running in a worker
+            depth["process"] = len(getattr(self.encode_executor, "_pending_work_items", {}))
+        return depth
     
     def shutdown(self):
-        """Shutdown the ThreadPoolExecutor"""
+        """Shutdown the ThreadPoolExecutor and the encode process pool, if any"""
+        if self._shared_sync_task is not None:
+            self._shared_sync_task.cancel()
+            self._shared_sync_task = None
+        if self.shared_index is not None:
+            self.shared_index.release()
         self.executor.shutdown(wait=True)
+        if self.encode_executor is not None:
+            self.encode_executor.shutdown(wait=True)
 
 
 # Global singleton instance
-face_service = FaceService(tolerance=0.5, max_workers=4)
+face_service = FaceService(
+    tolerance=0.5,
+    max_workers=4,
+    matcher_backend=settings.FACE_MATCHER_BACKEND,
+    matcher_min_rows=settings.FACE_MATCHER_MIN_ROWS,
+    matcher_params={"n_lists": settings.FACE_IVF_LISTS, "n_probe": settings.FACE_IVF_PROBE},
+    detection_scale=settings.FACE_DETECTION_SCALE,
+    detection_model=settings.FACE_DETECTION_MODEL,
+    detection_upsample=settings.FACE_DETECTION_UPSAMPLE,
+    encode_executor=settings.FACE_ENCODE_EXECUTOR,
+    encode_workers=settings.FACE_ENCODE_WORKERS,
+    load_chunk_size=settings.FACE_LOAD_CHUNK_SIZE,
+    snapshot_dir=settings.FACE_SNAPSHOT_DIR,
+    shared_index_dir=settings.FACE_SHARED_INDEX_DIR,
+    shared_poll_interval=settings.FACE_SHARED_POLL_MS / 1000.0,
+    template_scoring=settings.FACE_TEMPLATE_SCORING,
+    template_top_k=settings.FACE_TEMPLATE_TOP_K,
+    match_margin=settings.FACE_MATCH_MARGIN,
+    embed_batch_window_ms=settings.FACE_EMBED_BATCH_WINDOW_MS,
+    embed_batch_size=settings.FACE_EMBED_BATCH_SIZE
+)
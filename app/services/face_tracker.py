@@ -0,0 +1,74 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+from app.services.face_encoder import DetectedFace, FaceBox
+from app.services.face_service import MatchResult
+
+
+@dataclass
+class Track:
+    """One face followed across frames"""
+    box: FaceBox
+    identity: Optional[MatchResult]  # None until the face is matched to a student
+    reused: int = 0  # consecutive frames that reused identity
+
+
+class FaceTracker:
+    """
+    Tracks the faces of one camera connection across frames.
+
+    After a face is identified, the face in the next frame whose box overlaps
+    its previous box (IoU >= min_iou, see FaceEncoder.encode_faces) reuses
+    that identity instead of being encoded and matched again, for at most
+    max_reuse frames in a row. The next frame is then encoded again, which
+    re-confirms the identity and starts a new run. A track ends when its face
+    is not seen in a frame, and unknown faces are never reused.
+    """
+
+    def __init__(self, max_reuse: int = 5, min_iou: float = 0.5):
+        """
+        Args:
+            max_reuse: Consecutive frames that may reuse an identity (0 = tracking off)
+            min_iou: Box overlap between consecutive frames that counts as the same face
+        """
+        self.max_reuse = max_reuse
+        self.min_iou = min_iou
+        self.tracks: List[Track] = []
+        self.reused_total = 0
+        self._offered: List[Track] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_reuse > 0
+
+    def reusable_boxes(self) -> List[FaceBox]:
+        """Boxes the next frame's faces are compared with; DetectedFace.track indexes this list"""
+        self._offered = [
+            track for track in self.tracks
+            if self.enabled and track.identity is not None and track.reused < self.max_reuse
+        ]
+        return [track.box for track in self._offered]
+
+    def update(self, faces: Sequence[DetectedFace],
+               results: Sequence[Optional[MatchResult]]) -> List[MatchResult]:
+        """
+        Advance the tracks with the faces of a frame.
+
+        Args:
+            faces: Faces returned for the boxes of the last reusable_boxes call
+            results: Match result of every encoded face, None for faces that continue a track
+
+        Returns:
+            One MatchResult per face; continued faces get their track's identity
+        """
+        tracks = []
+        for face, result in zip(faces, results):
+            if face.track is not None:
+                previous = self._offered[face.track]
+                tracks.append(Track(face.box, previous.identity, previous.reused + 1))
+                self.reused_total += 1
+            else:
+                tracks.append(Track(face.box, result if result.matched else None))
+        self.tracks = tracks
+        return [track.identity if face.track is not None else result
+                for face, track, result in zip(faces, tracks, results)]
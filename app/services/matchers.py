@@ -0,0 +1,144 @@
+from typing import Optional, Tuple
+import numpy as np
+
+from app.services.encoding_index import nearest_row, squared_distances
+
+
+class BruteForceMatcher:
+    """Exact nearest neighbour: one distance pass over every row."""
+
+    backend = "brute"
+
+    def __init__(self, matrix: np.ndarray, sq_norms: np.ndarray):
+        self.matrix = matrix
+        self.sq_norms = sq_norms
+
+    def nearest(self, query: np.ndarray) -> Optional[Tuple[int, float]]:
+        return nearest_row(self.matrix, self.sq_norms, query)
+
+
+def kmeans(matrix: np.ndarray, n_clusters: int, n_iter: int = 10,
+           sample_size: int = 20000, seed: int = 0) -> np.ndarray:
+    """
+    Plain Lloyd's k-means on a row sample, returning (n_clusters, 128) float32 centroids.
+
+    Empty clusters are reseeded from random sample rows.
+    """
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    sample = matrix if n <= sample_size else matrix[rng.choice(n, sample_size, replace=False)]
+    n_clusters = min(n_clusters, sample.shape[0])
+    centroids = sample[rng.choice(sample.shape[0], n_clusters, replace=False)].copy()
+    sample_sq = np.einsum("ij,ij->i", sample, sample)
+
+    for _ in range(n_iter):
+        c_sq = np.einsum("ij,ij->i", centroids, centroids)
+        # (S, K) squared distances via the same norm expansion as matching
+        d2 = sample_sq[:, None] - 2.0 * (sample @ centroids.T) + c_sq[None, :]
+        assign = np.argmin(d2, axis=1)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = counts == 0
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+        if empty.any():
+            centroids[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+    return centroids.astype(np.float32)
+
+
+class IVFMatcher:
+    """
+    Inverted-file index: rows are partitioned by their nearest k-means centroid.
+
+    A query ranks centroids, scans only the n_probe closest lists and re-ranks
+    those candidates with exact distances, so cost is roughly
+    n_lists + n_probe * N / n_lists rows instead of N.
+    """
+
+    backend = "ivf"
+
+    def __init__(self, matrix: np.ndarray, sq_norms: np.ndarray, n_lists: int = 0,
+                 n_probe: int = 8, centroids: Optional[np.ndarray] = None):
+        """
+        Args:
+            matrix: (N, 128) float32 encodings
+            sq_norms: (N,) squared row norms
+            n_lists: Number of partitions (0 = about 2 * sqrt(N))
+            n_probe: Partitions scanned per query
+            centroids: Previously trained centroids to reuse instead of retraining
+        """
+        n = matrix.shape[0]
+        if centroids is None:
+            if n_lists <= 0:
+                n_lists = max(1, int(2 * np.sqrt(n)))
+            centroids = kmeans(matrix, n_lists) if n else np.empty((0, matrix.shape[1]), np.float32)
+        self.centroids = centroids
+        self.centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+        self.n_probe = max(1, n_probe)
+
+        n_lists = centroids.shape[0]
+        if n:
+            assign = np.argmin(
+                sq_norms[:, None] - 2.0 * (matrix @ centroids.T) + self.centroid_sq_norms[None, :],
+                axis=1
+            )
+        else:
+            assign = np.empty(0, dtype=np.int64)
+        # Store rows grouped by list so every probe is a contiguous block
+        self.order = np.argsort(assign, kind="stable")
+        self.list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=self.list_offsets[1:])
+        self.matrix = np.ascontiguousarray(matrix[self.order])
+        self.sq_norms = sq_norms[self.order]
+
+    def nearest(self, query: np.ndarray) -> Optional[Tuple[int, float]]:
+        if self.matrix.shape[0] == 0:
+            return None
+        n_lists = self.centroids.shape[0]
+        n_probe = min(self.n_probe, n_lists)
+        c_d2 = squared_distances(self.centroids, self.centroid_sq_norms, query)
+        probes = np.argpartition(c_d2, n_probe - 1)[:n_probe] if n_probe < n_lists else np.arange(n_lists)
+
+        best_pos, best_d2 = -1, np.inf
+        for lst in probes:
+            start, end = self.list_offsets[lst], self.list_offsets[lst + 1]
+            if start == end:
+                continue
+            d2 = squared_distances(self.matrix[start:end], self.sq_norms[start:end], query)
+            i = int(np.argmin(d2))
+            if d2[i] < best_d2:
+                best_pos, best_d2 = start + i, d2[i]
+        if best_pos < 0:
+            return None
+        # Exact re-rank of the winner, reported in original row numbering
+        return int(self.order[best_pos]), float(np.linalg.norm(self.matrix[best_pos] - query))
+
+
+MATCHER_BACKENDS = ("brute", "ivf")
+
+
+def build_matcher(backend: str, matrix: np.ndarray, sq_norms: np.ndarray,
+                  min_rows: int = 0, previous=None, **params):
+    """
+    Create the nearest-neighbour matcher for an encoding matrix.
+
+    Args:
+        backend: One of MATCHER_BACKENDS
+        matrix: (N, 128) float32 encodings
+        sq_norms: (N,) squared row norms
+        min_rows: Below this many rows the approximate backends fall back to brute force
+        previous: Matcher built for an earlier version of the matrix; an IVF
+            index reuses its centroids unless the row count has more than doubled
+        **params: Backend specific options (n_lists, n_probe for ivf)
+    """
+    if backend not in MATCHER_BACKENDS:
+        raise ValueError(f"Unknown matcher backend: {backend}")
+    n = matrix.shape[0]
+    if backend == "brute" or n < max(min_rows, 1):
+        return BruteForceMatcher(matrix, sq_norms)
+
+    centroids = None
+    if isinstance(previous, IVFMatcher) and 0 < previous.matrix.shape[0] and n <= 2 * previous.matrix.shape[0]:
+        centroids = previous.centroids
+    return IVFMatcher(matrix, sq_norms, centroids=centroids, **params)
@@ -0,0 +1,249 @@
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+
+# Seconds; spans a sub-millisecond match up to a multi-second overloaded frame
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+# What a callback metric returns: one unlabelled value, or a value per label tuple
+CallbackValue = Union[float, Mapping[LabelValues, float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Mapping[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], LabelValues, float]]:
+        """(name, label names, label values, value) of every exposed sample"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, values, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, self.labelnames, key, value
+
+
+class Histogram(_Metric):
+    """
+    Cumulative-bucket histogram per label set, as Prometheus expects it:
+    _bucket{le=...} counts observations <= le, plus _sum and _count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts incl. +Inf, sum)
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the wall time of a with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def samples(self):
+        bucket_labels = self.labelnames + ("le",)
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", bucket_labels, key + (_format_value(bound),), cumulative
+            yield f"{self.name}_sum", self.labelnames, key, total[0]
+            yield f"{self.name}_count", self.labelnames, key, cumulative
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge or counter read at scrape time, for values services already keep
+    (queue lengths, their own counters) so the hot path does no extra work.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], CallbackValue],
+                 labelnames: Sequence[str] = (), kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, Mapping):
+            for key, sample in sorted(value.items()):
+                yield self.name, self.labelnames, tuple(str(v) for v in key), sample
+        else:
+            yield self.name, self.labelnames, (), value
+
+
+class LabelLimiter:
+    """
+    Caps the distinct values of a label taken from client input (e.g. a
+    camera's device_id): the first limit values pass through, later ones are
+    reported as overflow, so a misbehaving client cannot grow the registry
+    without bound.
+    """
+
+    def __init__(self, limit: int, overflow: str = "other"):
+        self.limit = max(0, limit)
+        self.overflow = overflow
+        self._seen: Set[str] = set()
+
+    def __call__(self, value: str) -> str:
+        if value in self._seen:
+            return value
+        if len(self._seen) < self.limit and value != self.overflow:
+            self._seen.add(value)
+            return value
+        return self.overflow
+
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text exposition format.
+
+    Metrics are updated from the event loop only (stage timings measured in
+    executors are handed back and observed by the awaiting coroutine), so no
+    locks are needed. Every uvicorn worker keeps its own registry; scrape
+    each worker, or run a single worker when planning capacity.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, fn: Callable[[], CallbackValue],
+                 labelnames: Sequence[str] = (), kind: str = "gauge") -> CallbackMetric:
+        return self._register(CallbackMetric(name, help, fn, labelnames, kind))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """All metrics in the text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One failing callback must not take the whole scrape down
+                print(f"Metrics error in {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+# Global singleton registry and the metrics recorded on the recognition path
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "recognition_stage_seconds",
+    "Time spent in each recognition stage, per frame (db_write per attendance batch, broadcast per event)",
+    ["stage"]
+)
+FRAME_SECONDS = metrics.histogram(
+    "recognition_frame_seconds",
+    "Time from taking a camera frame off the mailbox to sending its reply"
+)
+FRAMES = metrics.counter(
+    "camera_frames_total",
+    "Camera frames by reply status (recognized, unknown, no_face, no_change, busy)",
+    ["device", "status"]
+)
+FACES = metrics.counter(
+    "camera_faces_total",
+    "Faces in camera replies by status (recognized, unknown)",
+    ["device", "status"]
+)
+FRAMES_DROPPED = metrics.counter(
+    "camera_frames_dropped_total",
+    "Camera frames replaced by a newer one before being processed",
+    ["device"]
+)
+POOL_WAIT_SECONDS = metrics.histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for a database connection from the pool"
+)
+
+
+def observe_stages(timings: Mapping[str, float]) -> None:
+    """Record stage timings measured in an executor, e.g. by FaceEncoder.encode_faces"""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
@@ -0,0 +1,76 @@
+import io
+import time
+from typing import Optional
+import numpy as np
+from PIL import Image
+
+
+def frame_thumbnail(image_bytes: bytes, size: int = 32) -> Optional[np.ndarray]:
+    """
+    Tiny grayscale thumbnail of a frame for change detection.
+
+    JPEG frames are decoded through Image.draft at 1/8 scale, so only a
+    fraction of the IDCT work of a full decode is done.
+
+    Returns:
+        (size, size) float32 grey levels, or None if the frame cannot be decoded
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.format == "JPEG":
+            image.draft("L", (size, size))
+        image = image.convert("L").resize((size, size), Image.BILINEAR)
+    except Exception:
+        return None
+    return np.asarray(image, dtype=np.float32)
+
+
+class MotionGate:
+    """
+    Frame differencing for one camera connection.
+
+    Keeps the thumbnail of the last frame that went through recognition. A
+    new frame counts as changed when the mean absolute difference of its
+    thumbnail from that reference exceeds threshold (grey levels, 0-255).
+    Comparing against the last recognized frame instead of the previous one
+    lets slow changes accumulate until they trigger. Frames that cannot be
+    decoded always count as changed.
+    """
+
+    def __init__(self, threshold: float, size: int = 32, max_idle: float = 0.0):
+        """
+        Args:
+            threshold: Mean absolute grey level difference that counts as change (0 = gate off)
+            size: Thumbnail edge in pixels
+            max_idle: Seconds after which a frame is recognized even without change (0 = never)
+        """
+        self.threshold = threshold
+        self.size = size
+        self.max_idle = max_idle
+        self.skipped = 0
+        self._reference: Optional[np.ndarray] = None
+        self._reference_time = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def thumbnail(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        return frame_thumbnail(image_bytes, self.size)
+
+    def changed(self, thumbnail: Optional[np.ndarray]) -> bool:
+        """Whether a frame differs enough from the reference to be recognized"""
+        if not self.enabled or thumbnail is None or self._reference is None:
+            return True
+        if self.max_idle and time.monotonic() - self._reference_time > self.max_idle:
+            return True
+        if float(np.mean(np.abs(thumbnail - self._reference))) > self.threshold:
+            return True
+        self.skipped += 1
+        return False
+
+    def accept(self, thumbnail: Optional[np.ndarray]) -> None:
+        """Make a recognized frame the new reference"""
+        if thumbnail is not None:
+            self._reference = thumbnail
+            self._reference_time = time.monotonic()
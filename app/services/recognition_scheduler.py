@@ -0,0 +1,130 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional, Set
+
+from app.config import settings
+
+
+class RecognitionBusy(Exception):
+    """Raised when a recognition request is shed because the server is overloaded"""
+
+
+@dataclass
+class _Job:
+    func: Callable
+    args: tuple
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class RecognitionScheduler:
+    """
+    Admission control and fair scheduling for recognition work from all cameras.
+
+    At most max_in_flight jobs run at once. Waiting jobs are kept in one FIFO
+    per device and devices are served round-robin, so a chatty camera cannot
+    starve the others. Jobs are shed with RecognitionBusy when the estimated
+    queueing delay exceeds latency_budget at submit time, or when a job has
+    already waited longer than the budget by the time a slot frees up.
+
+    Runs entirely on the event loop; no locks are needed.
+    """
+
+    def __init__(self, max_in_flight: int = 4, latency_budget: float = 2.0):
+        """
+        Args:
+            max_in_flight: Global limit on concurrently running recognitions
+            latency_budget: Maximum queueing delay in seconds before shedding
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.latency_budget = latency_budget
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.shed = 0
+        # Exponentially weighted average of job run time, in seconds
+        self.service_time: Optional[float] = None
+        self._queues: Dict[str, Deque[_Job]] = {}
+        # Devices with waiting jobs, in the order they will be served
+        self._ready: Deque[str] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def estimated_wait(self) -> float:
+        """Expected queueing delay for a job submitted now"""
+        if self.in_flight < self.max_in_flight and self.queued == 0:
+            return 0.0
+        if self.service_time is None:
+            return 0.0
+        return (self.queued + 1) / self.max_in_flight * self.service_time
+
+    async def run(self, device_id: str, func: Callable, *args) -> Any:
+        """
+        Run await func(*args) once the device's turn comes up.
+
+        Raises:
+            RecognitionBusy: The job was shed instead of run
+        """
+        if self.estimated_wait() > self.latency_budget:
+            self.shed += 1
+            raise RecognitionBusy(f"estimated wait {self.estimated_wait():.2f}s over budget")
+
+        loop = asyncio.get_running_loop()
+        job = _Job(func, args, loop.create_future(), loop.time())
+        queue = self._queues.get(device_id)
+        if queue is None:
+            queue = self._queues[device_id] = deque()
+            self._ready.append(device_id)
+        queue.append(job)
+        self.queued += 1
+        self._dispatch()
+        return await job.future
+
+    def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.in_flight < self.max_in_flight and self._ready:
+            device_id = self._ready.popleft()
+            queue = self._queues[device_id]
+            job = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._ready.append(device_id)
+            else:
+                del self._queues[device_id]
+
+            if job.future.done():
+                # Caller went away (e.g. camera disconnected) while queued
+                continue
+            if loop.time() - job.enqueued_at > self.latency_budget:
+                self.shed += 1
+                job.future.set_exception(RecognitionBusy("queued past latency budget"))
+                continue
+
+            self.in_flight += 1
+            task = loop.create_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: _Job) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            result = await job.func(*job.args)
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            elapsed = loop.time() - start
+            self.service_time = elapsed if self.service_time is None else 0.8 * self.service_time + 0.2 * elapsed
+            self.in_flight -= 1
+            self.completed += 1
+            self._dispatch()
+
+
+# Global singleton instance
+recognition_scheduler = RecognitionScheduler(
+    max_in_flight=settings.RECOGNITION_MAX_IN_FLIGHT,
+    latency_budget=settings.RECOGNITION_LATENCY_BUDGET_MS / 1000.0
+)
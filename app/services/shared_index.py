@@ -0,0 +1,115 @@
+import os
+from typing import Mapping, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from app.services.encoding_index import ClassEncodings
+from app.services.encoding_snapshot import EncodingSnapshot, read_snapshot, write_snapshot
+
+
+LOCK_FILE = "leader.lock"
+GENERATION_FILE = "generation"
+
+
+def check_shared_config(shared_dir: str, snapshot_dir: str, cache_sync_enabled: bool) -> None:
+    """
+    Reject shared index configurations that lose or corrupt data.
+    
+    Followers never write the shared index, so enrolments and class changes
+    handled by a follower reach the leader only through cache sync; without
+    it they vanish at the next generation. The shared directory and the
+    snapshot directory both hold encoding snapshot files and must differ.
+    
+    Raises:
+        ValueError: The configuration is unsafe
+    """
+    if not shared_dir:
+        return
+    if not cache_sync_enabled:
+        raise ValueError("FACE_SHARED_INDEX_DIR requires CACHE_SYNC_ENABLED=true, "
+                         "or changes handled by follower workers are lost")
+    if snapshot_dir and os.path.realpath(snapshot_dir) == os.path.realpath(shared_dir):
+        raise ValueError("FACE_SHARED_INDEX_DIR and FACE_SNAPSHOT_DIR must be different directories")
+
+
+class SharedEncodingIndex:
+    """
+    One copy of the encoding matrix shared by every uvicorn worker process.
+
+    Workers coordinate through a directory, ideally on tmpfs (/dev/shm). The
+    worker holding an exclusive flock on leader.lock is the leader: it loads
+    encodings from the database, applies changes, and publishes each version
+    as an encoding snapshot followed by a bump of the generation file. Every
+    worker maps the published matrix read-only, so the page cache holds a
+    single copy of the encodings however many workers run. Followers poll the
+    generation counter and remap when it changes. The lock dies with its
+    process, so when the leader exits the next follower to poll takes over.
+    """
+
+    def __init__(self, directory: str, poll_interval: float = 0.5):
+        """
+        Args:
+            directory: Coordination directory shared by all workers
+            poll_interval: Seconds between generation checks (and leader publishes)
+        """
+        if fcntl is None:
+            raise RuntimeError("Shared encoding index requires fcntl (POSIX)")
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.is_leader = False
+        self._lock_file = None
+
+    def try_lead(self) -> bool:
+        """Become the leader if no other worker is; returns whether this worker leads"""
+        if self.is_leader:
+            return True
+        if self._lock_file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock_file = open(os.path.join(self.directory, LOCK_FILE), "a+")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        self.is_leader = True
+        return True
+
+    def release(self) -> None:
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
+
+    def read_generation(self) -> int:
+        """Latest published generation, or 0 if nothing was published"""
+        try:
+            with open(os.path.join(self.directory, GENERATION_FILE)) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def publish(self, known_encodings: Mapping[str, ClassEncodings], class_ids: Mapping[str, str]) -> int:
+        """
+        Write a new generation (leader only).
+
+        Returns:
+            The published generation number
+        """
+        if not self.is_leader:
+            raise RuntimeError("Only the leader publishes the shared encoding index")
+        generation = self.read_generation() + 1
+        write_snapshot(self.directory, known_encodings, class_ids, None, generation=generation)
+        path = os.path.join(self.directory, GENERATION_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(str(generation))
+        os.replace(path + ".tmp", path)
+        return generation
+
+    def read(self) -> Optional[EncodingSnapshot]:
+        """Map the latest published generation, or None if there is none yet"""
+        snapshot = read_snapshot(self.directory)
+        if snapshot is None or snapshot.generation == 0:
+            return None
+        return snapshot
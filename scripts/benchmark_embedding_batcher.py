@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Encode throughput and latency with cross-camera embedding batching.
+
+Each simulated camera sends the same JPEG frame back to back through
+FaceService.encode_faces for a fixed duration, once per batch window
+(0 = no batching, every frame runs its own ResNet pass). Use it to pick
+FACE_EMBED_BATCH_WINDOW_MS: batching pays off when dlib can use more cores
+(or a GPU) per call than the executor has busy workers. Requires
+face_recognition/dlib to be installed.
+
+Usage:
+    python scripts/benchmark_embedding_batcher.py --cameras 4 16 --windows 0 2 5 10
+    python scripts/benchmark_embedding_batcher.py --image path/to/frame.jpg --executor process
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# FaceService reads Settings on import; the benchmark never touches the database
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/unused")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+from app.services.face_service import FaceService
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(__file__), "..", "classes", "10T1", "last_upload.jpg")
+
+
+async def camera(service: FaceService, frame: bytes, max_faces: int, deadline: float, latencies: list) -> None:
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await service.encode_faces(frame, max_faces)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(service: FaceService, frame: bytes, max_faces: int, cameras: int, seconds: float):
+    # Warm up every worker before timing
+    await asyncio.gather(*(service.encode_faces(frame, max_faces) for _ in range(cameras)))
+    latencies = []
+    start = time.perf_counter()
+    deadline = start + seconds
+    await asyncio.gather(*(camera(service, frame, max_faces, deadline, latencies) for _ in range(cameras)))
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, np.array(latencies) * 1000.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default=DEFAULT_IMAGE)
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10, 20], help="Batch windows in ms")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-faces", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--threads", type=int, default=4, help="Thread pool size")
+    parser.add_argument("--workers", type=int, default=0, help="Process count for process mode (0 = CPU count)")
+    parser.add_argument("--scale", type=float, default=0.5, help="Detection scale")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        frame = f.read()
+    print(f"frame={os.path.basename(args.image)} ({len(frame)} bytes), cpus={os.cpu_count()}, executor={args.executor}")
+
+    for window in args.windows:
+        service = FaceService(
+            max_workers=args.threads,
+            detection_scale=args.scale,
+            encode_executor=args.executor,
+            encode_workers=args.workers,
+            embed_batch_window_ms=window,
+            embed_batch_size=args.batch_size
+        )
+        try:
+            for cameras in args.cameras:
+                fps, latencies = asyncio.run(run(service, frame, args.max_faces, cameras, args.seconds))
+                batcher = service.embedding_batcher
+                mean_batch = f"{batcher.mean_batch:5.1f}" if batcher else "    -"
+                print(
+                    f"window={window:<5g}ms cameras={cameras:<3} throughput={fps:7.1f} frames/s  "
+                    f"p50={np.percentile(latencies, 50):7.1f} ms  p95={np.percentile(latencies, 95):7.1f} ms  "
+                    f"mean batch={mean_batch} chips"
+                )
+        finally:
+            service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Thread vs process encode throughput with N concurrent simulated cameras.
+
+Each simulated camera sends the same JPEG frame back to back through
+FaceService.encode_face, the way /ws/camera does, for a fixed duration.
+Requires face_recognition/dlib to be installed.
+
+Usage:
+    python scripts/benchmark_encode_executor.py --cameras 1 4 16 --seconds 10
+    python scripts/benchmark_encode_executor.py --image path/to/frame.jpg --workers 8
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# FaceService reads Settings on import; the benchmark never touches the database
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/unused")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+from app.services.face_service import FaceService
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(__file__), "..", "classes", "10T1", "last_upload.jpg")
+
+
+async def camera(service: FaceService, frame: bytes, deadline: float, latencies: list) -> None:
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await service.encode_face(frame)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(service: FaceService, frame: bytes, cameras: int, seconds: float):
+    # Warm up every worker before timing
+    await asyncio.gather(*(service.encode_face(frame) for _ in range(cameras)))
+    latencies = []
+    start = time.perf_counter()
+    deadline = start + seconds
+    await asyncio.gather(*(camera(service, frame, deadline, latencies) for _ in range(cameras)))
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, np.array(latencies) * 1000.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default=DEFAULT_IMAGE)
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--threads", type=int, default=4, help="Thread pool size for thread mode")
+    parser.add_argument("--workers", type=int, default=0, help="Process count for process mode (0 = CPU count)")
+    parser.add_argument("--scale", type=float, default=0.5, help="Detection scale")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        frame = f.read()
+    print(f"frame={os.path.basename(args.image)} ({len(frame)} bytes), cpus={os.cpu_count()}")
+
+    for mode in ("thread", "process"):
+        service = FaceService(
+            max_workers=args.threads,
+            detection_scale=args.scale,
+            encode_executor=mode,
+            encode_workers=args.workers
+        )
+        try:
+            for cameras in args.cameras:
+                fps, latencies = asyncio.run(run(service, frame, cameras, args.seconds))
+                print(
+                    f"{mode:<8} cameras={cameras:<3} throughput={fps:7.1f} frames/s  "
+                    f"p50={np.percentile(latencies, 50):7.1f} ms  p95={np.percentile(latencies, 95):7.1f} ms"
+                )
+        finally:
+            service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
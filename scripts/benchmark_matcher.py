@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Recall / latency benchmark for the face matcher backends.
+
+Generates synthetic 128-d encodings shaped like dlib descriptors (unit-ish
+norm, identities grouped around a few hundred population centres), queries
+with noisy copies of enrolled faces, and compares each backend against the
+exact brute-force answer.
+
+Usage:
+    python scripts/benchmark_matcher.py --rows 50000 --queries 2000
+    python scripts/benchmark_matcher.py --rows 50000 --probe 4 8 16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.encoding_index import ENCODING_DIM
+from app.services.matchers import BruteForceMatcher, build_matcher
+
+
+def synthetic_encodings(rows: int, groups: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0.0, 0.08, size=(groups, ENCODING_DIM))
+    members = rng.integers(0, groups, size=rows)
+    matrix = centres[members] + rng.normal(0.0, 0.06, size=(rows, ENCODING_DIM))
+    return matrix.astype(np.float32)
+
+
+def time_queries(matcher, queries: np.ndarray):
+    results = []
+    timings = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        results.append(matcher.nearest(query))
+        timings[i] = time.perf_counter() - start
+    return results, timings * 1000.0
+
+
+def report(label: str, results, timings, reference, tolerance: float) -> None:
+    agree = sum(1 for r, ref in zip(results, reference) if r is not None and r[0] == ref[0])
+    accepted = sum(1 for r in results if r is not None and r[1] <= tolerance)
+    print(
+        f"{label:<24} recall@1={agree / len(reference):6.4f}  "
+        f"accepted={accepted / len(reference):6.4f}  "
+        f"mean={timings.mean():7.3f} ms  p50={np.percentile(timings, 50):7.3f} ms  "
+        f"p99={np.percentile(timings, 99):7.3f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--groups", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=0.02, help="Per-dimension query noise")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--lists", type=int, default=0, help="IVF partitions (0 = auto)")
+    parser.add_argument("--probe", type=int, nargs="+", default=[4, 8, 16])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    matrix = synthetic_encodings(args.rows, args.groups)
+    sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+    picks = rng.integers(0, args.rows, size=args.queries)
+    queries = (matrix[picks] + rng.normal(0.0, args.noise, size=(args.queries, ENCODING_DIM))).astype(np.float32)
+
+    print(f"{args.rows} encodings, {args.queries} queries, noise={args.noise}")
+    brute = BruteForceMatcher(matrix, sq_norms)
+    reference, timings = time_queries(brute, queries)
+    report("brute", reference, timings, reference, args.tolerance)
+
+    previous = None
+    for n_probe in args.probe:
+        start = time.perf_counter()
+        matcher = build_matcher("ivf", matrix, sq_norms, previous=previous, n_lists=args.lists, n_probe=n_probe)
+        build_ms = (time.perf_counter() - start) * 1000.0
+        previous = matcher
+        results, timings = time_queries(matcher, queries)
+        label = f"ivf lists={matcher.centroids.shape[0]} probe={n_probe}"
+        report(label, results, timings, reference, args.tolerance)
+        print(f"{'':<24} build={build_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
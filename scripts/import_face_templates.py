@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Import the per-person encodings built by encode_known_faces.py
+(<class_dir>/encodings.npz, several images per person) as
+student_face_templates rows.
+
+Each name in the file is matched to a student of the class by student_code,
+then by full_name. Existing templates of a matched student are replaced, so
+the script is safe to re-run after rebuilding the encodings.
+
+Usage:
+    python scripts/import_face_templates.py classes/12T1 --class-name 12T1 [--dry-run]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncpg
+import numpy as np
+from app.config import settings
+from app.services.encoding_codec import encode_encoding
+
+
+async def import_templates(class_dir: str, class_name: str, dry_run: bool) -> None:
+    data = np.load(os.path.join(class_dir, "encodings.npz"))
+    by_name = {}
+    for name, encoding in zip(data["names"], data["encodings"]):
+        by_name.setdefault(str(name), []).append(encode_encoding(encoding))
+
+    conn = await asyncpg.connect(settings.DATABASE_URL)
+    imported = 0
+    try:
+        students = await conn.fetch('''
+            SELECT s.id, s.student_code, s.full_name FROM students s
+            JOIN classes c ON s.class_id = c.id
+            WHERE c.name = $1
+        ''', class_name)
+        lookup = {r['full_name']: r['id'] for r in students}
+        lookup.update({r['student_code']: r['id'] for r in students})
+
+        for name, blobs in by_name.items():
+            student_id = lookup.get(name)
+            if student_id is None:
+                print(f"Skipping {name}: no student with that code or name in {class_name}")
+                continue
+            if not dry_run:
+                async with conn.transaction():
+                    await conn.execute('DELETE FROM student_face_templates WHERE student_id = $1', student_id)
+                    await conn.executemany(
+                        'INSERT INTO student_face_templates (student_id, face_encoding) VALUES ($1, $2)',
+                        [(student_id, blob) for blob in blobs]
+                    )
+            imported += len(blobs)
+            print(f"{name}: {len(blobs)} templates")
+    finally:
+        await conn.close()
+
+    action = "would be imported" if dry_run else "imported"
+    print(f"Done: {imported} templates {action}.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('class_dir')
+    parser.add_argument('--class-name', required=True)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    asyncio.run(import_templates(args.class_dir, args.class_name, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,95 @@ import sys
 # Add root directory to sys.path to import app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine
 from app.config import settings
 from app.models import Base
 
+# Idempotent DDL that create_all cannot express or apply to existing tables
+SCHEMA_UPGRADES = [
+    "ALTER TABLE students ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS idx_students_updated_at ON students (updated_at)",
+    # updated_at drives incremental loads from the encoding snapshot
+    """
+    CREATE OR REPLACE FUNCTION students_touch_updated_at() RETURNS trigger AS $$
+    BEGIN
+        NEW.updated_at := now();
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS students_touch_updated_at ON students",
+    """
+    CREATE TRIGGER students_touch_updated_at BEFORE UPDATE ON students
+    FOR EACH ROW EXECUTE FUNCTION students_touch_updated_at()
+    """,
+    # Template changes bump the owning student, so snapshot deltas and
+    # cache sync events pick them up through students alone
+    """
+    CREATE OR REPLACE FUNCTION touch_student_from_template() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            UPDATE students SET updated_at = now() WHERE id = OLD.student_id;
+        ELSE
+            UPDATE students SET updated_at = now() WHERE id = NEW.student_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS face_templates_touch_student ON student_face_templates",
+    """
+    CREATE TRIGGER face_templates_touch_student AFTER INSERT OR UPDATE OR DELETE ON student_face_templates
+    FOR EACH ROW EXECUTE FUNCTION touch_student_from_template()
+    """,
+    # Deletions leave no updated_at trace; tombstones let snapshot warm starts find them
+    """
+    CREATE OR REPLACE FUNCTION students_record_deletion() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO student_deletions (student_id, deleted_at) VALUES (OLD.id, now())
+        ON CONFLICT (student_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS students_record_deletion ON students",
+    """
+    CREATE TRIGGER students_record_deletion AFTER DELETE ON students
+    FOR EACH ROW EXECUTE FUNCTION students_record_deletion()
+    """,
+    # Change events for app.services.cache_sync (channel "cache_changes");
+    # encodings and image paths are left out to stay under the 8000 byte payload limit
+    """
+    CREATE OR REPLACE FUNCTION notify_cache_change() RETURNS trigger AS $$
+    DECLARE
+        payload jsonb := jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP);
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            payload := payload || jsonb_build_object('row', to_jsonb(OLD) - 'face_encoding' - 'image_path');
+        ELSE
+            payload := payload || jsonb_build_object('row', to_jsonb(NEW) - 'face_encoding' - 'image_path');
+        END IF;
+        IF TG_OP = 'UPDATE' THEN
+            payload := payload || jsonb_build_object('old', to_jsonb(OLD) - 'face_encoding' - 'image_path');
+        END IF;
+        PERFORM pg_notify('cache_changes', payload::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+] + [
+    statement
+    for table in ("students", "classes", "api_keys")
+    for statement in (
+        f"DROP TRIGGER IF EXISTS {table}_notify_cache_change ON {table}",
+        f"""
+        CREATE TRIGGER {table}_notify_cache_change AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION notify_cache_change()
+        """,
+    )
+]
+
 async def init_db():
     """
     Initialize database schema with all tables and indexes.
@@ -29,13 +114,17 @@ async def init_db():
             
             # Create all tables with indexes defined in models
             await conn.run_sync(Base.metadata.create_all)
+            for statement in SCHEMA_UPGRADES:
+                await conn.execute(text(statement))
             
             print("\n" + "="*60)
             print("Database initialization completed successfully!")
             print("="*60)
             print("\nCreated tables:")
             print("  - classes")
-            print("  - students (with idx_students_class)")
+            print("  - students (with idx_students_class, idx_students_updated_at)")
+            print("  - student_face_templates (with idx_face_templates_student)")
+            print("  - student_deletions (with idx_student_deletions_deleted_at)")
             print("  - attendance_records (with idx_attendance_recorded_at, idx_attendance_class_time)")
             print("  - api_keys (with idx_api_keys_active)")
             print("\n")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Rewrite legacy pickled students.face_encoding values in the compact
+float32 format (see app.services.encoding_codec).
+
+Idempotent: rows already 512 bytes long are left untouched, so the script is
+safe to re-run and to run while the server is up (the loader reads both formats).
+
+Usage:
+    python scripts/migrate_encodings.py [--batch-size 500] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncpg
+from app.config import settings
+from app.services.encoding_codec import ENCODING_NBYTES, decode_legacy, encode_encoding
+
+
+async def migrate(batch_size: int, dry_run: bool) -> None:
+    conn = await asyncpg.connect(settings.DATABASE_URL)
+    converted = failed = 0
+    last_id = None
+    try:
+        while True:
+            # Keyset pagination so converted rows never shift the window
+            records = await conn.fetch('''
+                SELECT id, student_code, face_encoding FROM students
+                WHERE face_encoding IS NOT NULL
+                  AND octet_length(face_encoding) <> $1
+                  AND ($2::uuid IS NULL OR id > $2)
+                ORDER BY id
+                LIMIT $3
+            ''', ENCODING_NBYTES, last_id, batch_size)
+            if not records:
+                break
+            last_id = records[-1]['id']
+
+            updates = []
+            for record in records:
+                try:
+                    updates.append((record['id'], encode_encoding(decode_legacy(record['face_encoding']))))
+                except Exception as e:
+                    failed += 1
+                    print(f"Skipping {record['student_code']}: {e}")
+            if updates and not dry_run:
+                async with conn.transaction():
+                    await conn.executemany('UPDATE students SET face_encoding = $2 WHERE id = $1', updates)
+            converted += len(updates)
+            print(f"{converted} rows converted...")
+    finally:
+        await conn.close()
+
+    action = "would be converted" if dry_run else "converted"
+    print(f"Done: {converted} rows {action}, {failed} skipped.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Unit tests for attendance recording helpers.
+"""
+
+import asyncio
+import pytest
+import asyncpg
+from uuid import uuid4
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services.attendance_service import AttendanceCooldown, AttendanceEvent, AttendanceWriter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+class TestAttendanceCooldown:
+    """Test per-(student, class) deduplication window"""
+    
+    def test_first_recognition_recorded(self):
+        cooldown = AttendanceCooldown(ttl=300, clock=FakeClock())
+        assert cooldown.is_suppressed("s1", "12T1") is False
+    
+    def test_repeat_within_ttl_suppressed(self):
+        clock = FakeClock()
+        cooldown = AttendanceCooldown(ttl=300, clock=clock)
+        cooldown.record("s1", "12T1")
+        
+        clock.now += 299
+        assert cooldown.is_suppressed("s1", "12T1") is True
+        assert cooldown.suppressed == 1
+    
+    def test_recorded_again_after_ttl(self):
+        clock = FakeClock()
+        cooldown = AttendanceCooldown(ttl=300, clock=clock)
+        cooldown.record("s1", "12T1")
+        
+        clock.now += 300
+        assert cooldown.is_suppressed("s1", "12T1") is False
+        assert cooldown.suppressed == 0
+    
+    def test_keys_are_independent(self):
+        cooldown = AttendanceCooldown(ttl=300, clock=FakeClock())
+        cooldown.record("s1", "12T1")
+        assert cooldown.is_suppressed("s2", "12T1") is False
+        assert cooldown.is_suppressed("s1", "10T1") is False
+    
+    def test_expired_entries_evicted(self):
+        clock = FakeClock()
+        cooldown = AttendanceCooldown(ttl=60, clock=clock)
+        for i in range(100):
+            cooldown.record(f"s{i}", "12T1")
+        assert len(cooldown) == 100
+        
+        clock.now += 61
+        assert cooldown.is_suppressed("s-new", "12T1") is False
+        cooldown.record("s-new", "12T1")
+        assert len(cooldown) == 1
+    
+    def test_zero_ttl_disables(self):
+        cooldown = AttendanceCooldown(ttl=0, clock=FakeClock())
+        cooldown.record("s1", "12T1")
+        assert cooldown.is_suppressed("s1", "12T1") is False
+        assert len(cooldown) == 0
+    
+    def test_released_key_can_record_again(self):
+        cooldown = AttendanceCooldown(ttl=300, clock=FakeClock())
+        assert cooldown.is_suppressed("s1", "12T1") is False
+        cooldown.record("s1", "12T1")
+        assert cooldown.is_suppressed("s1", "12T1") is True
+        
+        cooldown.release("s1", "12T1")
+        assert cooldown.is_suppressed("s1", "12T1") is False
+        assert cooldown.suppressed == 1
+
+
+def make_event(student_code="ST001", class_name="12T1", class_id="c-12t1"):
+    return AttendanceEvent(
+        student_id=str(uuid4()),
+        student_name="Student",
+        student_code=student_code,
+        class_name=class_name,
+        class_id=class_id,
+        device_id="cam1",
+        confidence=0.8
+    )
+
+
+class TestAttendanceWriter:
+    """Test write-behind batching of attendance records"""
+    
+    @pytest.fixture
+    def mock_pool(self):
+        """Mock database connection pool."""
+        pool = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.fetch = AsyncMock()
+        mock_conn.copy_records_to_table = AsyncMock()
+        pool.acquire = MagicMock()
+        pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+        # Return False so exceptions raised inside "async with" propagate
+        pool.acquire.return_value.__aexit__ = AsyncMock(return_value=False)
+        return pool, mock_conn
+    
+    @pytest.mark.asyncio
+    async def test_events_coalesced_into_one_copy(self, mock_pool):
+        pool, mock_conn = mock_pool
+        writer = AttendanceWriter(flush_interval=0.05, batch_size=100)
+        broadcast = AsyncMock()
+        
+        with patch('app.database.pool', pool), \
+             patch('app.services.attendance_service.broadcast_attendance', broadcast):
+            writer.start()
+            events = [make_event(f"ST{i}") for i in range(10)]
+            for event in events:
+                assert writer.submit(event) is True
+            await asyncio.sleep(0.15)
+            await writer.stop()
+        
+        mock_conn.copy_records_to_table.assert_awaited_once()
+        records = mock_conn.copy_records_to_table.await_args.kwargs['records']
+        assert len(records) == 10
+        assert records[0][0] == events[0].id
+        assert records[0][2] == "c-12t1"
+        # Class ids come from the event; flushing never queries classes
+        mock_conn.fetch.assert_not_awaited()
+        assert writer.written == 10
+        assert broadcast.await_count == 10
+        assert broadcast.await_args_list[0][0][0]["data"]["id"] == str(events[0].id)
+    
+    @pytest.mark.asyncio
+    async def test_full_batch_flushes_before_interval(self, mock_pool):
+        pool, mock_conn = mock_pool
+        writer = AttendanceWriter(flush_interval=10, batch_size=5)
+        
+        with patch('app.database.pool', pool), \
+             patch('app.services.attendance_service.broadcast_attendance', AsyncMock()):
+            writer.start()
+            for i in range(12):
+                writer.submit(make_event(f"ST{i}"))
+            await asyncio.sleep(0.05)
+            assert writer.written == 10
+            await writer.stop()
+        
+        sizes = [len(call.kwargs['records']) for call in mock_conn.copy_records_to_table.await_args_list]
+        assert sizes == [5, 5, 2]
+    
+    @pytest.mark.asyncio
+    async def test_stop_drains_queue(self, mock_pool):
+        pool, mock_conn = mock_pool
+        writer = AttendanceWriter(flush_interval=10, batch_size=100)
+        
+        with patch('app.database.pool', pool), \
+             patch('app.services.attendance_service.broadcast_attendance', AsyncMock()):
+            writer.start()
+            for i in range(3):
+                writer.submit(make_event(f"ST{i}"))
+            await writer.stop()
+        
+        assert writer.written == 3
+        assert writer.pending == 0
+        assert writer.submit(make_event()) is False
+    
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self, mock_pool):
+        pool, mock_conn = mock_pool
+        mock_conn.copy_records_to_table.side_effect = [
+            asyncpg.exceptions.ConnectionDoesNotExistError("lost"),
+            None
+        ]
+        writer = AttendanceWriter(flush_interval=0.01, retry_backoff=0.01)
+        
+        with patch('app.database.pool', pool), \
+             patch('app.services.attendance_service.broadcast_attendance', AsyncMock()):
+            writer.start()
+            writer.submit(make_event())
+            await writer.stop()
+        
+        assert mock_conn.copy_records_to_table.await_count == 2
+        assert writer.written == 1
+        assert writer.failed == 0
+    
+    @pytest.mark.asyncio
+    async def test_non_transient_error_drops_batch(self, mock_pool):
+        """A bad row fails the COPY; the batch is split so only that row is dropped"""
+        pool, mock_conn = mock_pool
+        events = [make_event(f"ST{i}") for i in range(5)]
+        bad = events[3].student_id
+        
+        async def copy(table, records, columns):
+            if any(record[1] == bad for record in records):
+                raise asyncpg.exceptions.ForeignKeyViolationError("student deleted")
+        mock_conn.copy_records_to_table.side_effect = copy
+        writer = AttendanceWriter(flush_interval=0.01)
+        broadcast = AsyncMock()
+        
+        with patch('app.database.pool', pool), \
+             patch('app.services.attendance_service.broadcast_attendance', broadcast):
+            writer.start()
+            for event in events:
+                writer.submit(event)
+            await writer.stop()
+        
+        assert writer.failed == 1
+        assert writer.written == 4
+        broadcast_ids = {call.args[0]["data"]["id"] for call in broadcast.await_args_list}
+        assert broadcast_ids == {str(event.id) for event in events if event.student_id != bad}
+    
+    @pytest.mark.asyncio
+    async def test_failed_events_reported(self, mock_pool):
+        """Events that could not be written are handed to on_failed (e.g. to release their cooldown)"""
+        pool, mock_conn = mock_pool
+        mock_conn.copy_records_to_table.side_effect = asyncpg.exceptions.ConnectionDoesNotExistError("lost")
+        failed = []
+        writer = AttendanceWriter(flush_interval=0.01, max_retries=1, retry_backoff=0.01, on_failed=failed.append)
+        event = make_event()
+        
+        with patch('app.database.pool', pool), \
+             patch('app.services.attendance_service.broadcast_attendance', AsyncMock()):
+            writer.start()
+            writer.submit(event)
+            await writer.stop()
+        
+        assert failed == [event]
+        assert writer.failed == 1
+    
+    @pytest.mark.asyncio
+    async def test_bounded_queue_drops_overflow(self):
+        writer = AttendanceWriter(flush_interval=10, max_queue=2)
+        writer._task = MagicMock()
+        
+        assert writer.submit(make_event()) is True
+        assert writer.submit(make_event()) is True
+        assert writer.submit(make_event()) is False
+        assert writer.dropped == 1
+    
+    @pytest.mark.asyncio
+    async def test_event_without_class_id_not_written(self, mock_pool):
+        pool, mock_conn = mock_pool
+        failed = []
+        registry = {"10T1": "c-10t1"}
+        writer = AttendanceWriter(flush_interval=0.01, on_failed=failed.append, resolve_class_id=registry.get)
+        deleted = make_event(class_name="Deleted", class_id=None)
+        
+        with patch('app.database.pool', pool), \
+             patch('app.services.attendance_service.broadcast_attendance', AsyncMock()):
+            writer.start()
+            writer.submit(make_event(class_name="12T1"))
+            writer.submit(deleted)
+            # Class created after the match: resolved from the registry at flush time
+            writer.submit(make_event(class_name="10T1", class_id=None))
+            await writer.stop()
+        
+        records = mock_conn.copy_records_to_table.await_args.kwargs['records']
+        assert [record[2] for record in records] == ["c-12t1", "c-10t1"]
+        assert writer.written == 2
+        assert writer.failed == 1
+        assert failed == [deleted]
@@ -95,6 +95,24 @@ class TestAuthService:
         assert old_hash not in auth_service.active_keys
         assert new_hash in auth_service.active_keys
     
+    @pytest.mark.asyncio
+    async def test_load_api_keys_caches_bound_class(self, auth_service, mock_pool):
+        """Test that each key's bound class name is cached alongside the hash."""
+        pool, mock_conn = mock_pool
+        bound_hash = hashlib.sha256(b"bound_key").hexdigest()
+        free_hash = hashlib.sha256(b"free_key").hexdigest()
+        mock_conn.fetch.return_value = [
+            {'key_hash': bound_hash, 'class_name': '12T1'},
+            {'key_hash': free_hash, 'class_name': None},
+        ]
+        
+        with patch('app.database.pool', pool):
+            await auth_service.load_api_keys()
+        
+        assert auth_service.get_key_class("bound_key") == "12T1"
+        assert auth_service.get_key_class("free_key") is None
+        assert auth_service.get_key_class("unknown_key") is None
+    
     # Test Requirement 4.2: Validate API key against in-memory cache
     @pytest.mark.asyncio
     async def test_validate_key_valid(self, auth_service):
@@ -187,6 +205,32 @@ class TestAuthService:
         result = await auth_service.validate_key(api_key)
         assert result is True
     
+    @pytest.mark.asyncio
+    async def test_add_key_with_class_caches_binding(self, auth_service, mock_pool):
+        """Test that adding a class-bound key caches its class name."""
+        pool, mock_conn = mock_pool
+        mock_conn.fetchval.return_value = "10T1"
+        
+        with patch('app.database.pool', pool):
+            await auth_service.add_key("class_key", class_id="123e4567-e89b-12d3-a456-426614174000")
+            assert auth_service.get_key_class("class_key") == "10T1"
+            
+            await auth_service.deactivate_key("class_key")
+            assert auth_service.get_key_class("class_key") is None
+    
+    def test_class_rename_and_removal_update_bindings(self, auth_service):
+        """Test that class rename/delete keep cached key bindings in sync."""
+        key_hash = hashlib.sha256(b"class_key").hexdigest()
+        auth_service.active_keys.add(key_hash)
+        auth_service.key_classes[key_hash] = "12T1"
+        
+        auth_service.rename_class("12T1", "12A1")
+        assert auth_service.get_key_class("class_key") == "12A1"
+        
+        auth_service.remove_class("12A1")
+        assert auth_service.get_key_class("class_key") is None
+        assert key_hash in auth_service.active_keys
+    
     # Test Requirement 4.4: Deactivate API key in database and cache
     @pytest.mark.asyncio
     async def test_deactivate_key_basic(self, auth_service, mock_pool):
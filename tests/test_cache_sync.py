@@ -0,0 +1,219 @@
+"""
+Unit tests for the LISTEN/NOTIFY cache sync listener
+"""
+
+import asyncio
+import asyncpg
+import json
+import sys
+import numpy as np
+import pytest
+from uuid import uuid4
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Mock face_recognition module if not available
+if 'face_recognition' not in sys.modules:
+    sys.modules['face_recognition'] = MagicMock()
+
+from app.services import cache_sync as cache_sync_module
+from app.services.auth_service import AuthService
+from app.services.cache_sync import CacheSyncListener
+from app.services.encoding_codec import encode_encoding
+from app.services.face_service import FaceService
+
+
+@pytest.fixture
+def services():
+    face_service, auth_service = FaceService(), AuthService()
+    with patch.object(cache_sync_module, 'face_service', face_service), \
+         patch.object(cache_sync_module, 'auth_service', auth_service):
+        yield face_service, auth_service
+    face_service.shutdown()
+
+
+@pytest.fixture
+def mock_pool():
+    pool = MagicMock()
+    mock_conn = MagicMock()
+    mock_conn.fetchrow = AsyncMock()
+    mock_conn.fetch = AsyncMock(return_value=[])
+    pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+    pool.acquire.return_value.__aexit__ = AsyncMock(return_value=False)
+    with patch('app.database.pool', pool):
+        yield mock_conn
+
+
+def student_record(student_id, class_id, encoding, class_name='12T1'):
+    return {'student_id': student_id, 'full_name': 'Student 1', 'student_code': 'ST001',
+            'face_encoding': None if encoding is None else encode_encoding(encoding),
+            'class_name': class_name, 'class_id': class_id}
+
+
+class TestStudentEvents:
+    """Test student inserts, updates and deletes"""
+
+    @pytest.mark.asyncio
+    async def test_insert_then_update_moves_student(self, services, mock_pool):
+        face_service, _ = services
+        listener = CacheSyncListener("postgresql://unused")
+        student_id, class_a, class_b = uuid4(), uuid4(), uuid4()
+        encoding = np.random.rand(128)
+        event = {"table": "students", "op": "INSERT", "row": {"id": str(student_id)}}
+
+        mock_pool.fetchrow.return_value = student_record(student_id, class_a, encoding)
+        await listener.apply(event)
+        # Same change delivered twice (e.g. router + notification) is applied once
+        await listener.apply(event)
+        assert len(face_service.known_encodings['12T1']) == 1
+
+        mock_pool.fetchrow.return_value = student_record(student_id, class_b, encoding, '10T1')
+        await listener.apply({**event, "op": "UPDATE"})
+
+        assert len(face_service.known_encodings['12T1']) == 0
+        result = face_service._match_face_sync(encoding)
+        assert result["class_name"] == '10T1'
+        assert result["class_id"] == str(class_b)
+
+    @pytest.mark.asyncio
+    async def test_cleared_encoding_and_delete_remove(self, services, mock_pool):
+        face_service, _ = services
+        listener = CacheSyncListener("postgresql://unused")
+        first, second = uuid4(), uuid4()
+        face_service._add_student_encoding_sync(first, '12T1', 'Student 1', 'ST001', np.random.rand(128))
+        face_service._add_student_encoding_sync(second, '12T1', 'Student 2', 'ST002', np.random.rand(128))
+
+        mock_pool.fetchrow.return_value = student_record(first, uuid4(), None)
+        await listener.apply({"table": "students", "op": "UPDATE", "row": {"id": str(first)}})
+        await listener.apply({"table": "students", "op": "DELETE", "row": {"id": str(second)}})
+
+        assert len(face_service.known_encodings['12T1']) == 0
+        mock_pool.fetchrow.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_student_event_reloads_templates(self, services, mock_pool):
+        face_service, _ = services
+        listener = CacheSyncListener("postgresql://unused")
+        student_id, class_id = uuid4(), uuid4()
+        primary, template = np.random.rand(128), np.random.rand(128)
+        mock_pool.fetchrow.return_value = student_record(student_id, class_id, primary)
+        mock_pool.fetch.return_value = [student_record(student_id, class_id, template)]
+
+        await listener.apply({"table": "students", "op": "UPDATE", "row": {"id": str(student_id)}})
+
+        assert len(face_service.known_encodings['12T1']) == 2
+        assert face_service._match_face_sync(template)["student_id"] == str(student_id)
+
+
+class TestClassEvents:
+    """Test class registry and key binding updates"""
+
+    @pytest.mark.asyncio
+    async def test_insert_rename_delete(self, services):
+        face_service, auth_service = services
+        listener = CacheSyncListener("postgresql://unused")
+        class_id = str(uuid4())
+        auth_service.cache_key("hash-1", "12T1")
+
+        await listener.apply({"table": "classes", "op": "INSERT", "row": {"id": class_id, "name": "12T1"}})
+        assert face_service.class_ids == {"12T1": class_id}
+
+        await listener.apply({"table": "classes", "op": "UPDATE", "row": {"id": class_id, "name": "12A1"},
+                              "old": {"id": class_id, "name": "12T1"}})
+        assert face_service.class_ids == {"12A1": class_id}
+        assert auth_service.key_classes == {"hash-1": "12A1"}
+
+        await listener.apply({"table": "classes", "op": "DELETE", "row": {"id": class_id, "name": "12A1"}})
+        assert face_service.class_ids == {}
+        assert auth_service.key_classes == {}
+
+
+class TestApiKeyEvents:
+    """Test api key activation, deactivation and deletion"""
+
+    @pytest.mark.asyncio
+    async def test_key_lifecycle(self, services):
+        face_service, auth_service = services
+        listener = CacheSyncListener("postgresql://unused")
+        class_id = str(uuid4())
+        face_service.register_class(class_id, "12T1")
+        row = {"key_hash": "hash-1", "is_active": True, "class_id": class_id}
+
+        await listener.apply({"table": "api_keys", "op": "INSERT", "row": row})
+        assert auth_service.active_keys == {"hash-1"}
+        assert auth_service.key_classes == {"hash-1": "12T1"}
+
+        await listener.apply({"table": "api_keys", "op": "UPDATE", "row": {**row, "is_active": False}, "old": row})
+        assert auth_service.active_keys == set()
+
+        await listener.apply({"table": "api_keys", "op": "UPDATE", "row": {**row, "class_id": None},
+                              "old": {**row, "is_active": False}})
+        assert auth_service.active_keys == {"hash-1"}
+        assert auth_service.key_classes == {}
+
+        await listener.apply({"table": "api_keys", "op": "DELETE", "row": row})
+        assert auth_service.active_keys == set()
+
+
+class TestListenerLoop:
+    """Test notification delivery and reconnects"""
+
+    @pytest.mark.asyncio
+    async def test_notifications_applied_in_order(self, services):
+        face_service, _ = services
+        listener = CacheSyncListener("postgresql://unused")
+        class_id = str(uuid4())
+        task = asyncio.create_task(listener._run())
+
+        listener._on_notify(None, 1, "cache_changes", json.dumps(
+            {"table": "classes", "op": "INSERT", "row": {"id": class_id, "name": "12T1"}}))
+        listener._on_notify(None, 1, "cache_changes", json.dumps(
+            {"table": "classes", "op": "UPDATE", "row": {"id": class_id, "name": "12A1"}}))
+        listener._on_notify(None, 1, "cache_changes", "not json")
+        await asyncio.sleep(0.01)
+        task.cancel()
+
+        assert face_service.class_ids == {"12A1": class_id}
+        assert listener.applied == 2
+        assert listener.failed == 1
+
+    @pytest.mark.asyncio
+    async def test_termination_triggers_reconnect_and_reload(self, services):
+        listener = CacheSyncListener("postgresql://unused", reconnect_delay=0)
+        conn = MagicMock()
+        conn.add_listener = AsyncMock()
+        conn.is_closed.return_value = True
+        face_service, auth_service = services
+        with patch('app.services.cache_sync.asyncpg.connect', AsyncMock(side_effect=[OSError("down"), conn])), \
+             patch.object(face_service, 'load_all_encodings', AsyncMock()) as load_encodings, \
+             patch.object(auth_service, 'load_api_keys', AsyncMock()) as load_keys:
+            task = asyncio.create_task(listener._run())
+            listener._on_terminate(None)
+            await asyncio.sleep(0.01)
+            task.cancel()
+
+        conn.add_listener.assert_awaited_once_with("cache_changes", listener._on_notify)
+        load_encodings.assert_awaited_once()
+        load_keys.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_reconnect_retries_any_error(self, services):
+        """Interface errors, timeouts and failed reloads must not end the listener"""
+        listener = CacheSyncListener("postgresql://unused", reconnect_delay=0)
+        conn = MagicMock()
+        conn.add_listener = AsyncMock()
+        conn.is_closed.return_value = True
+        face_service, auth_service = services
+        connect = AsyncMock(side_effect=[
+            asyncpg.exceptions.InterfaceError("bad state"), asyncio.TimeoutError(), conn, conn
+        ])
+        with patch('app.services.cache_sync.asyncpg.connect', connect), \
+             patch.object(face_service, 'load_all_encodings', AsyncMock(side_effect=[RuntimeError("reload"), None])), \
+             patch.object(auth_service, 'load_api_keys', AsyncMock()) as load_keys:
+            task = asyncio.create_task(listener._run())
+            listener._on_terminate(None)
+            await asyncio.sleep(0.05)
+            assert not task.done()
+            task.cancel()
+
+        assert connect.await_count == 4
+        load_keys.assert_awaited_once()
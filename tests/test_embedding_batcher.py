@@ -0,0 +1,138 @@
+"""
+Unit tests for cross-connection batching of face descriptors
+"""
+
+import asyncio
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.face_encoder import DetectedFace
+from app.services.face_service import FaceService
+
+
+def chip(value: float) -> np.ndarray:
+    return np.full((150, 150, 3), value, dtype=np.uint8)
+
+
+class RecordingCompute:
+    """Descriptor stand-in: the chip's pixel value repeated, recording every batch"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, chips):
+        self.batches.append(len(chips))
+        return [np.full(128, float(c[0, 0, 0])) for c in chips]
+
+
+class TestEmbeddingBatcher:
+    """Test micro-batching of descriptor computation"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_a_batch(self):
+        compute = RecordingCompute()
+        batcher = EmbeddingBatcher(compute, window=0.05, max_batch=16)
+
+        results = await asyncio.gather(
+            batcher.descriptors([chip(1), chip(2)]),
+            batcher.descriptors([chip(3)]),
+            batcher.descriptors([chip(4), chip(5), chip(6)])
+        )
+
+        assert compute.batches == [6]
+        assert [[d[0] for d in r] for r in results] == [[1, 2], [3], [4, 5, 6]]
+        assert batcher.batches == 1 and batcher.mean_batch == 6.0
+
+    @pytest.mark.asyncio
+    async def test_max_batch_flushes_before_window(self):
+        compute = RecordingCompute()
+        batcher = EmbeddingBatcher(compute, window=10.0, max_batch=3)
+
+        results = await asyncio.wait_for(asyncio.gather(
+            batcher.descriptors([chip(1), chip(2)]),
+            batcher.descriptors([chip(3), chip(4)])
+        ), timeout=2.0)
+
+        # The frame that crosses max_batch is kept whole
+        assert compute.batches == [4]
+        assert batcher.largest_batch == 4
+        assert [len(r) for r in results] == [2, 2]
+
+    @pytest.mark.asyncio
+    async def test_empty_frame_skips_compute(self):
+        compute = RecordingCompute()
+        batcher = EmbeddingBatcher(compute)
+
+        assert await batcher.descriptors([]) == []
+        assert compute.batches == []
+
+    @pytest.mark.asyncio
+    async def test_compute_error_reaches_every_caller(self):
+        def failing(chips):
+            raise RuntimeError("dlib failed")
+        batcher = EmbeddingBatcher(failing, window=0.01)
+
+        results = await asyncio.gather(
+            batcher.descriptors([chip(1)]),
+            batcher.descriptors([chip(2)]),
+            return_exceptions=True
+        )
+
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    @pytest.mark.asyncio
+    async def test_stop_flushes_and_waits_for_batches(self):
+        compute = RecordingCompute()
+        batcher = EmbeddingBatcher(compute, window=10.0, max_batch=16)
+
+        waiting = asyncio.ensure_future(batcher.descriptors([chip(1), chip(2)]))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(batcher.stop(), timeout=2.0)
+
+        assert compute.batches == [2]
+        assert batcher._tasks == set()
+        assert [d[0] for d in await waiting] == [1, 2]
+
+
+class TestFaceServiceBatching:
+    """Test encode_faces through the embedding batcher"""
+
+    @pytest.mark.asyncio
+    async def test_encode_faces_fills_untracked_faces(self):
+        service = FaceService(embed_batch_window_ms=20)
+        compute = RecordingCompute()
+        service.embedding_batcher.compute = compute
+        faces = [
+            DetectedFace((0, 200, 200, 0), None, track=0),
+            DetectedFace((0, 500, 150, 350), None),
+            DetectedFace((300, 100, 400, 0), None)
+        ]
+
+        with patch.object(service.encoder, "align_faces", return_value=(faces, [chip(7), chip(9)])):
+            first, second = await asyncio.gather(
+                service.encode_faces(b"frame", max_faces=3, track_boxes=[(0, 200, 200, 0)]),
+                service.encode_faces(b"frame", max_faces=3, track_boxes=[(0, 200, 200, 0)])
+            )
+
+        assert compute.batches == [4]
+        assert first[0].encoding is None and first[0].track == 0
+        assert [f.encoding[0] for f in first[1:]] == [7, 9]
+        assert [f.box for f in second] == [f.box for f in faces]
+        service.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_encode_faces_batcher_error_returns_no_faces(self):
+        service = FaceService(embed_batch_window_ms=1)
+        service.embedding_batcher.compute = lambda chips: 1 / 0
+        face = DetectedFace((0, 200, 200, 0), None)
+
+        with patch.object(service.encoder, "align_faces", return_value=([face], [chip(1)])):
+            assert await service.encode_faces(b"frame") == []
+        service.shutdown()
+
+    def test_batching_off_by_default(self):
+        service = FaceService()
+        assert service.embedding_batcher is None
+        service.shutdown()
@@ -0,0 +1,80 @@
+"""
+Unit tests for the memory-mapped encoding snapshot
+"""
+
+import json
+import numpy as np
+import pytest
+from datetime import datetime
+
+from app.services.encoding_index import ClassEncodings
+from app.services.encoding_snapshot import read_snapshot, write_snapshot
+
+
+def make_class(n, prefix):
+    entry = ClassEncodings()
+    for i in range(n):
+        entry.append(np.random.rand(128), f"{prefix}-{i}", f"Student {prefix}{i}", f"{prefix}{i:03d}")
+    return entry
+
+
+class TestEncodingSnapshot:
+    """Test snapshot write / mmap read round trip"""
+    
+    def test_round_trip(self, tmp_path):
+        known = {"12T1": make_class(3, "a"), "10T1": make_class(2, "b"), "11T1": ClassEncodings()}
+        class_ids = {"12T1": "id-12", "10T1": "id-10", "11T1": "id-11"}
+        
+        write_snapshot(str(tmp_path), known, class_ids, datetime(2024, 1, 1, 8, 30))
+        snapshot = read_snapshot(str(tmp_path))
+        
+        assert snapshot.high_water_mark == datetime(2024, 1, 1, 8, 30)
+        assert set(snapshot.classes) == {"id-12", "id-10"}
+        assert len(snapshot) == 5
+        for name, class_id in (("12T1", "id-12"), ("10T1", "id-10")):
+            restored = snapshot.classes[class_id]
+            assert np.array_equal(restored.encodings, known[name].encodings)
+            assert np.array_equal(restored.sq_norms, known[name].sq_norms)
+            assert list(restored.student_codes) == list(known[name].student_codes[:len(known[name])])
+    
+    def test_restored_rows_are_memory_mapped(self, tmp_path):
+        write_snapshot(str(tmp_path), {"12T1": make_class(2, "a")}, {"12T1": "id-12"}, None)
+        entry = read_snapshot(str(tmp_path)).classes["id-12"]
+        
+        assert isinstance(entry.matrix.base, np.memmap) or isinstance(entry.matrix, np.memmap)
+        assert not entry.matrix.flags.writeable
+    
+    def test_first_write_copies(self, tmp_path):
+        write_snapshot(str(tmp_path), {"12T1": make_class(2, "a")}, {"12T1": "id-12"}, None)
+        entry = read_snapshot(str(tmp_path)).classes["id-12"]
+        
+        entry.append(np.ones(128), "a-2", "Student a2", "a002")
+        entry.remove_row(0)
+        
+        assert len(entry) == 2
+        assert entry.matrix.flags.writeable
+        assert list(entry.student_ids[:2]) == ["a-2", "a-1"]
+        # The file on disk is untouched
+        assert len(read_snapshot(str(tmp_path))) == 2
+        assert read_snapshot(str(tmp_path)).classes["id-12"].student_ids[0] == "a-0"
+    
+    def test_rewrite_removes_stale_matrices(self, tmp_path):
+        write_snapshot(str(tmp_path), {"12T1": make_class(2, "a")}, {"12T1": "id-12"}, None)
+        write_snapshot(str(tmp_path), {"12T1": make_class(3, "a")}, {"12T1": "id-12"}, None)
+        
+        assert len(list(tmp_path.glob("*.npy"))) == 2
+        assert len(read_snapshot(str(tmp_path))) == 3
+    
+    def test_missing_or_mismatched_snapshot(self, tmp_path):
+        assert read_snapshot(str(tmp_path)) is None
+        
+        write_snapshot(str(tmp_path), {"12T1": make_class(2, "a")}, {"12T1": "id-12"}, None)
+        meta_path = tmp_path / "encodings.json"
+        meta = json.loads(meta_path.read_text())
+        meta["rows"] = 3
+        meta_path.write_text(json.dumps(meta))
+        assert read_snapshot(str(tmp_path)) is None
+    
+    def test_class_without_id_rejected(self, tmp_path):
+        with pytest.raises(ValueError):
+            write_snapshot(str(tmp_path), {"12T1": make_class(1, "a")}, {}, None)
@@ -7,18 +7,28 @@ Note: These tests verify the class structure and basic logic without requiring
 the face_recognition library to be installed.
 """
 
+import asyncio
+import io
+from collections.abc import Mapping
 import pytest
 import numpy as np
 import pickle
+from PIL import Image
+from datetime import datetime
 from uuid import uuid4
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import sys
 
 # Mock face_recognition module if not available
 if 'face_recognition' not in sys.modules:
     sys.modules['face_recognition'] = MagicMock()
 
-from app.services.face_service import FaceService, MatchResult
+from app.services.face_service import FaceService, MatchResult, ClassEncodings, SNAPSHOT_OVERLAP
+from app.services import encoding_index, matchers
+from app.services.face_encoder import scale_box
+from app.services.encoding_codec import (
+    ENCODING_NBYTES, decode_compact_batch, decode_encoding, encode_encoding, split_by_format
+)
 
 
 class TestFaceServiceInit:
@@ -29,7 +39,7 @@ class TestFaceServiceInit:
         service = FaceService()
         assert service.tolerance == 0.5
         assert service.executor._max_workers == 4
-        assert isinstance(service.known_encodings, dict)
+        assert isinstance(service.known_encodings, Mapping)
         assert len(service.known_encodings) == 0
         service.shutdown()
     
@@ -85,6 +95,478 @@ class TestFaceServiceEncodingCache:
         service.shutdown()
 
 
+class TestClassRegistry:
+    """Test the in-memory class name -> id registry"""
+    
+    @pytest.fixture
+    def mock_pool(self):
+        """Mock database connection pool."""
+        pool = MagicMock()
+        mock_conn = MagicMock()
+        pool.acquire = MagicMock()
+        pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+        pool.acquire.return_value.__aexit__ = AsyncMock(return_value=False)
+        mock_conn.transaction.return_value.__aenter__ = AsyncMock()
+        mock_conn.transaction.return_value.__aexit__ = AsyncMock(return_value=False)
+        return pool, mock_conn
+    
+    @staticmethod
+    def stream_rows(mock_conn, classes, rows, chunk_size=2, templates=()):
+        """
+        Serve classes from fetch, then student rows and template rows from
+        two server-side cursors in chunks; returns the student rows cursor
+        """
+        counts = {}
+        for row in [*rows, *templates]:
+            counts[row['class_name']] = counts.get(row['class_name'], 0) + 1
+        mock_conn.fetch = AsyncMock(return_value=[
+            {'id': class_id, 'name': name, 'encodings': counts.get(name, 0)} for class_id, name in classes
+        ])
+        cursors = []
+        for served in (rows, list(templates)):
+            chunks = [served[i:i + chunk_size] for i in range(0, len(served), chunk_size)]
+            cursor = MagicMock()
+            cursor.fetch = AsyncMock(side_effect=chunks + [[]])
+            cursors.append(cursor)
+        mock_conn.cursor = AsyncMock(side_effect=cursors)
+        return cursors[0]
+    
+    @pytest.mark.asyncio
+    async def test_load_populates_registry(self, mock_pool):
+        """Test that loading caches ids for every class, including empty ones"""
+        pool, mock_conn = mock_pool
+        class_12t1, class_10t1 = uuid4(), uuid4()
+        student_id = uuid4()
+        self.stream_rows(mock_conn, [(class_12t1, '12T1'), (class_10t1, '10T1')], [{
+            'student_id': student_id,
+            'full_name': 'Student 1',
+            'student_code': 'ST001',
+            'face_encoding': pickle.dumps(np.zeros(128)),
+            'class_name': '12T1'
+        }])
+        service = FaceService()
+        
+        with patch('app.database.pool', pool):
+            await service.load_all_encodings()
+        
+        assert service.class_ids == {'12T1': str(class_12t1), '10T1': str(class_10t1)}
+        result = await service.match_face(np.zeros(128))
+        assert result.matched
+        assert result.class_id == str(class_12t1)
+        service.shutdown()
+    
+    @pytest.mark.asyncio
+    async def test_load_mixed_formats(self, mock_pool):
+        """Test that compact and legacy pickled rows load side by side"""
+        pool, mock_conn = mock_pool
+        compact, legacy = np.random.rand(128), np.random.rand(128)
+        
+        def row(code, blob):
+            return {'student_id': uuid4(), 'full_name': code, 'student_code': code,
+                    'face_encoding': blob, 'class_name': '12T1'}
+        
+        self.stream_rows(mock_conn, [(uuid4(), '12T1')], [
+            row('ST001', encode_encoding(compact)), row('ST002', pickle.dumps(legacy)),
+            row('ST003', b'corrupt')
+        ])
+        service = FaceService()
+        
+        with patch('app.database.pool', pool):
+            await service.load_all_encodings()
+        
+        assert len(service.known_encodings['12T1']) == 2
+        assert service._match_face_sync(compact)["student_code"] == 'ST001'
+        assert service._match_face_sync(legacy)["student_code"] == 'ST002'
+        service.shutdown()
+    
+    @pytest.mark.asyncio
+    async def test_load_streams_chunks_into_preallocated_matrices(self, mock_pool):
+        """Test that rows are fetched in chunks and land in matrices sized once"""
+        pool, mock_conn = mock_pool
+        encodings = np.random.rand(7, 128).astype(np.float32)
+        rows = [{
+            'student_id': uuid4(), 'full_name': f'Student {i}', 'student_code': f'ST{i:03d}',
+            'face_encoding': encode_encoding(enc), 'class_name': '12T1' if i % 2 else '10T1'
+        } for i, enc in enumerate(encodings)]
+        cursor = self.stream_rows(mock_conn, [(uuid4(), '12T1'), (uuid4(), '10T1'), (uuid4(), '11T1')], rows, chunk_size=3)
+        service = FaceService(load_chunk_size=3)
+        
+        with patch('app.database.pool', pool):
+            await service.load_all_encodings()
+        
+        assert [c.args for c in cursor.fetch.call_args_list] == [(3,)] * 4
+        assert service.known_encodings['12T1'].capacity == len(service.known_encodings['12T1']) == 3
+        assert service.known_encodings['10T1'].capacity == len(service.known_encodings['10T1']) == 4
+        assert '11T1' not in service.known_encodings
+        assert '11T1' in service.class_ids
+        assert np.array_equal(service.known_encodings['10T1'].encodings, encodings[0::2])
+        assert np.allclose(service.known_encodings['10T1'].sq_norms, (encodings[0::2] ** 2).sum(axis=1))
+        assert service.load_stats["rows"] == 7
+        assert service.load_stats["encodings"] == 7
+        service.shutdown()
+    
+    @pytest.mark.asyncio
+    async def test_load_appends_face_templates(self, mock_pool):
+        """Test that template rows join their student's primary row"""
+        pool, mock_conn = mock_pool
+        student_id = uuid4()
+        encodings = np.random.rand(3, 128).astype(np.float32)
+        row = lambda enc: {'student_id': student_id, 'full_name': 'Student 1', 'student_code': 'ST001',
+                           'face_encoding': encode_encoding(enc), 'class_name': '12T1'}
+        self.stream_rows(mock_conn, [(uuid4(), '12T1')], [row(encodings[0])],
+                         templates=[row(encodings[1]), row(encodings[2])])
+        service = FaceService(template_scoring="centroid")
+        
+        with patch('app.database.pool', pool):
+            await service.load_all_encodings()
+        
+        assert mock_conn.cursor.await_count == 2
+        assert 'student_face_templates' in mock_conn.cursor.call_args.args[0]
+        assert service.load_stats["rows"] == 3
+        assert len(service.known_encodings['12T1']) == 1
+        assert np.allclose(service.known_encodings['12T1'].encodings[0], encodings.mean(axis=0), atol=1e-6)
+        service.shutdown()
+    
+    @pytest.mark.asyncio
+    async def test_load_catches_up_on_concurrent_writes(self, mock_pool):
+        """Test that enrolments made while a load streams survive its swap"""
+        pool, mock_conn = mock_pool
+        class_id = uuid4()
+        cursor = self.stream_rows(mock_conn, [(class_id, '12T1')], [])
+        streaming, release = asyncio.Event(), asyncio.Event()
+        
+        async def slow_fetch(n):
+            streaming.set()
+            await release.wait()
+            return []
+        cursor.fetch = AsyncMock(side_effect=slow_fetch)
+        service = FaceService()
+        student_id = uuid4()
+        
+        with patch('app.database.pool', pool), \
+             patch.object(service, 'reload_student', AsyncMock(return_value=True)) as reload_student:
+            load = asyncio.create_task(service.load_all_encodings())
+            await streaming.wait()
+            await service.add_student_encoding(student_id, '12T1', 'Student 1', 'ST001', np.zeros(128))
+            release.set()
+            await load
+        
+        reload_student.assert_awaited_once_with(str(student_id))
+        assert service._load_journal is None
+        service.shutdown()
+    
+    @pytest.mark.asyncio
+    async def test_warm_start_from_snapshot(self, mock_pool, tmp_path):
+        """Test that a snapshot plus changed rows reproduces the database"""
+        pool, mock_conn = mock_pool
+        class_a, class_b = uuid4(), uuid4()
+        encodings = np.random.rand(4, 128).astype(np.float32)
+        ids = [uuid4() for _ in range(4)]
+        
+        def row(i, class_name, encoding):
+            return {'student_id': ids[i], 'full_name': f'Student {i}', 'student_code': f'ST{i:03d}',
+                    'face_encoding': encoding if encoding is None else encode_encoding(encoding),
+                    'class_name': class_name}
+        
+        # Cold start writes the snapshot
+        self.stream_rows(mock_conn, [(class_a, '12T1'), (class_b, '10T1')],
+                         [row(0, '12T1', encodings[0]), row(1, '12T1', encodings[1]), row(2, '10T1', encodings[2])])
+        mock_conn.fetchval = AsyncMock(return_value=datetime(2024, 1, 1))
+        service = FaceService(snapshot_dir=str(tmp_path))
+        with patch('app.database.pool', pool):
+            await service.load_all_encodings()
+        assert (tmp_path / 'encodings.json').exists()
+        service.shutdown()
+        
+        # Since then: 12T1 renamed, student 0 re-enrolled, student 1 lost their
+        # encoding, student 3 added, student 2 deleted (no row, only a tombstone)
+        new_encoding = np.random.rand(128).astype(np.float32)
+        self.stream_rows(mock_conn, [(class_a, '12A1'), (class_b, '10T1')],
+                         [row(0, '12A1', new_encoding), row(1, '12A1', None), row(3, '10T1', encodings[3])])
+        mock_conn.fetch = AsyncMock(side_effect=[
+            mock_conn.fetch.return_value,
+            [{'student_id': ids[2]}, {'student_id': uuid4()}],
+        ])
+        mock_conn.fetchval = AsyncMock(return_value=datetime(2024, 2, 1))
+        mock_conn.execute = AsyncMock()
+        service = FaceService(snapshot_dir=str(tmp_path))
+        with patch('app.database.pool', pool):
+            await service.load_all_encodings()
+        
+        since = mock_conn.cursor.call_args.args[1]
+        assert since == datetime(2024, 1, 1) - SNAPSHOT_OVERLAP
+        # Warm start: no per-class sizing, and deletions read from tombstones since the snapshot
+        queries = [c.args[0] for c in mock_conn.fetch.await_args_list]
+        assert not any('count(' in query for query in queries)
+        assert 'student_deletions' in queries[1] and mock_conn.fetch.await_args.args[1] == since
+        # The replaced snapshot's tombstones are no longer needed once the new one is written
+        prune = mock_conn.execute.await_args.args
+        assert prune[0].startswith('DELETE FROM student_deletions') and prune[1] == since
+        assert service.load_stats["rows"] == 3
+        assert service.load_stats["encodings"] == 2
+        assert service._match_face_sync(new_encoding)["student_id"] == str(ids[0])
+        assert service._match_face_sync(new_encoding)["class_name"] == '12A1'
+        assert service._match_face_sync(encodings[3])["student_id"] == str(ids[3])
+        cached = {sid for entry in service.known_encodings.values() for sid in entry.student_ids[:len(entry)]}
+        assert cached == {str(ids[0]), str(ids[3])}
+        service.shutdown()
+    
+    def test_add_with_class_id_registers_class(self):
+        service = FaceService()
+        class_id = uuid4()
+        encoding = np.random.rand(128)
+        service._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", encoding, class_id)
+        
+        assert service._match_face_sync(encoding)["class_id"] == str(class_id)
+        service.shutdown()
+    
+    def test_rename_class(self):
+        service = FaceService()
+        class_id = uuid4()
+        encoding = np.random.rand(128)
+        service._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", encoding, class_id)
+        service._match_face_sync(encoding)
+        
+        service.rename_class("12T1", "12A1")
+        
+        result = service._match_face_sync(encoding)
+        assert result["class_name"] == "12A1"
+        assert result["class_id"] == str(class_id)
+        assert "12T1" not in service.class_ids
+        service.shutdown()
+    
+    def test_remove_class(self):
+        service = FaceService()
+        encoding = np.random.rand(128)
+        service._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", encoding, uuid4())
+        service._match_face_sync(encoding)
+        
+        service.remove_class("12T1")
+        
+        assert service._match_face_sync(encoding) is None
+        assert service.class_ids == {}
+        service.shutdown()
+
+
+class TestClassEncodings:
+    """Test contiguous per-class encoding matrix"""
+    
+    def test_append_grows_capacity(self):
+        """Test that appends past capacity keep earlier rows intact"""
+        entry = ClassEncodings(capacity=2)
+        encodings = [np.random.rand(128) for _ in range(5)]
+        for i, enc in enumerate(encodings):
+            entry.append(enc, f"id-{i}", f"Student {i}", f"ST{i:03d}")
+        
+        assert len(entry) == 5
+        assert entry.capacity >= 5
+        assert entry.encodings.shape == (5, 128)
+        assert entry.encodings.dtype == np.float32
+        assert entry.encodings.flags["C_CONTIGUOUS"]
+        for i, enc in enumerate(encodings):
+            assert np.allclose(entry.encodings[i], enc, atol=1e-6)
+            assert entry.student_ids[i] == f"id-{i}"
+            assert entry.student_codes[i] == f"ST{i:03d}"
+    
+    def test_getitem_returns_tuple(self):
+        """Test row access returns (encoding, student_id, name, student_code)"""
+        entry = ClassEncodings()
+        entry.append(np.zeros(128), "id-1", "Student 1", "ST001")
+        
+        encoding, student_id, name, code = entry[0]
+        assert encoding.shape == (128,)
+        assert (student_id, name, code) == ("id-1", "Student 1", "ST001")
+        with pytest.raises(IndexError):
+            entry[1]
+    
+    def test_remove_row_moves_last_row(self):
+        entry = ClassEncodings()
+        for i in range(3):
+            entry.append(np.full(128, i), f"id-{i}", f"Student {i}", f"ST{i:03d}")
+        
+        entry.remove_row(entry.find("id-0"))
+        
+        assert len(entry) == 2
+        assert list(entry.student_ids[:2]) == ["id-2", "id-1"]
+        assert np.array_equal(entry.encodings[0], np.full(128, 2))
+        assert entry.sq_norms[0] == pytest.approx(4 * 128)
+        assert entry.find("id-0") == -1
+
+
+class TestIndexSnapshots:
+    """Test copy-on-write index versions"""
+    
+    def test_writes_never_touch_published_versions(self):
+        service = FaceService()
+        first = uuid4()
+        service._add_student_encoding_sync(first, "12T1", "Student 1", "ST001", np.random.rand(128), uuid4())
+        before = service.index
+        entry_before = before.classes["12T1"]
+        
+        service._add_student_encoding_sync(uuid4(), "12T1", "Student 2", "ST002", np.random.rand(128))
+        service._remove_student_sync(first)
+        service.rename_class("12T1", "12A1")
+        
+        assert service.index is not before
+        assert len(entry_before) == 1
+        assert entry_before.student_ids[0] == str(first)
+        assert list(before.classes) == ["12T1"]
+        assert list(service.known_encodings) == ["12A1"]
+        service.shutdown()
+    
+    def test_registry_change_keeps_global_index(self):
+        service = FaceService()
+        service._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", np.random.rand(128))
+        global_index = service._get_global_index()
+        
+        service.register_class(uuid4(), "10T1")
+        
+        assert service._get_global_index() is global_index
+        service.shutdown()
+    
+    def test_global_index_built_once_under_concurrent_matches(self):
+        """Threads racing on a new version share one build of the index and its matcher"""
+        import threading
+        import time
+        service = FaceService(max_workers=8)
+        for i in range(10):
+            service._add_student_encoding_sync(uuid4(), "12T1", f"S{i}", f"ST{i}", np.random.rand(128))
+        builds = []
+        
+        def slow_matcher(matrix, sq_norms):
+            builds.append(len(matrix))
+            time.sleep(0.05)
+            return matchers.BruteForceMatcher(matrix, sq_norms)
+        
+        with patch.object(service, '_build_matcher', side_effect=slow_matcher):
+            threads = [threading.Thread(target=service._match_face_sync, args=(np.random.rand(128),)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        assert builds == [10]
+        service.shutdown()
+    
+    def test_matching_during_concurrent_writes(self):
+        """Matches see a consistent version while another thread keeps rewriting the index"""
+        import threading
+        service = FaceService()
+        stable = np.random.rand(128)
+        service._add_student_encoding_sync(uuid4(), "12T1", "Stable", "ST000", stable)
+        stop = threading.Event()
+        errors = []
+        
+        def writer():
+            ids = [uuid4() for _ in range(20)]
+            while not stop.is_set():
+                for student_id in ids:
+                    service._add_student_encoding_sync(student_id, "12T1", "Churn", "ST999", np.random.rand(128) + 5)
+                for student_id in ids:
+                    service._remove_student_sync(student_id)
+        
+        def reader():
+            try:
+                for _ in range(300):
+                    for class_name in ("12T1", None):
+                        result = service._match_face_sync(stable, class_name)
+                        assert result is not None and result["student_code"] == "ST000"
+            except Exception as e:
+                errors.append(e)
+        
+        thread = threading.Thread(target=writer)
+        thread.start()
+        readers = [threading.Thread(target=reader) for _ in range(3)]
+        for r in readers:
+            r.start()
+        for r in readers:
+            r.join()
+        stop.set()
+        thread.join()
+        
+        assert errors == []
+        service.shutdown()
+
+
+class TestFaceTemplates:
+    """Test students with several face templates"""
+    
+    @staticmethod
+    def enrol(service, student_id, code, encodings, class_name="12T1"):
+        service._add_student_templates_sync(student_id, class_name, f"Student {code}", code, encodings)
+    
+    def test_group_reduce_matches_reference(self):
+        """Test the vectorized mean-of-top-k against a per-student loop"""
+        rng = np.random.default_rng(0)
+        entry = ClassEncodings()
+        ids = [f"s{i}" for i in rng.integers(0, 20, size=120)]
+        matrix = rng.normal(scale=0.05, size=(120, 128)).astype(np.float32)
+        entry.extend(matrix, ids, ids, ids)
+        query = matrix[0] + 0.01
+        
+        row, distance = entry.nearest_student(query, top_k=3, bound=10.0)
+        
+        distances = np.linalg.norm(matrix - query, axis=1)
+        means = {sid: np.sort(distances[np.array(ids) == sid])[:3].mean() for sid in set(ids)}
+        best = min(means, key=means.get)
+        assert entry.student_ids[row] == best
+        assert distance == pytest.approx(means[best], abs=1e-5)
+    
+    def test_mean_topk_outvotes_single_close_template(self):
+        """Test that one lucky template loses to consistently close ones"""
+        service = FaceService(template_scoring="mean_topk", template_top_k=3)
+        query = np.zeros(128)
+        near = lambda d: np.eye(128)[0] * d
+        self.enrol(service, uuid4(), "LUCKY", [near(0.10), near(0.48), near(0.49)])
+        self.enrol(service, uuid4(), "STEADY", [near(0.20), near(0.21), near(0.22)])
+        
+        assert service._match_face_sync(query)["student_code"] == "STEADY"
+        assert service._match_face_sync(query)["confidence"] == pytest.approx(0.79)
+        assert service._match_face_sync(query, "12T1")["student_code"] == "STEADY"
+        service.template_scoring = "min"
+        assert service._match_face_sync(query)["student_code"] == "LUCKY"
+        service.shutdown()
+    
+    def test_re_enrolment_replaces_all_templates(self):
+        service = FaceService()
+        student_id = uuid4()
+        self.enrol(service, student_id, "ST001", np.random.rand(3, 128))
+        self.enrol(service, student_id, "ST001", np.random.rand(2, 128), class_name="10T1")
+        
+        assert len(service.known_encodings["12T1"]) == 0
+        assert len(service.known_encodings["10T1"]) == 2
+        assert service._remove_student_sync(student_id)
+        assert len(service.known_encodings["10T1"]) == 0
+        service.shutdown()
+    
+    def test_centroid_collapses_templates(self):
+        service = FaceService(template_scoring="centroid")
+        encodings = np.random.rand(3, 128)
+        self.enrol(service, uuid4(), "ST001", encodings)
+        
+        entry = service.known_encodings["12T1"]
+        assert len(entry) == 1
+        assert np.allclose(entry.encodings[0], encodings.mean(axis=0))
+        service.shutdown()
+    
+    def test_collapsed_groups_rows_by_student(self):
+        entry = ClassEncodings()
+        matrix = np.random.rand(5, 128).astype(np.float32)
+        ids = ["a", "b", "a", "c", "a"]
+        entry.extend(matrix, ids, ids, ids)
+        
+        collapsed = entry.collapsed()
+        
+        assert sorted(collapsed.student_ids[:len(collapsed)]) == ["a", "b", "c"]
+        row = collapsed.find("a")
+        assert np.allclose(collapsed.encodings[row], matrix[[0, 2, 4]].mean(axis=0), atol=1e-6)
+        assert np.allclose(collapsed.sq_norms, (collapsed.encodings ** 2).sum(axis=1), rtol=1e-5)
+    
+    def test_invalid_template_scoring(self):
+        with pytest.raises(ValueError):
+            FaceService(template_scoring="median")
+
+
 class TestFaceServiceMatchingSync:
     """Test face matching functionality (synchronous helper methods)"""
     
@@ -93,8 +575,7 @@ class TestFaceServiceMatchingSync:
         service = FaceService()
         unknown_encoding = np.random.rand(128)
         
-        with patch('face_recognition.face_distance', return_value=np.array([])):
-            result = service._match_face_sync(unknown_encoding)
+        result = service._match_face_sync(unknown_encoding)
         
         assert result is None
         service.shutdown()
@@ -108,9 +589,8 @@ class TestFaceServiceMatchingSync:
         student_id = uuid4()
         service._add_student_encoding_sync(student_id, "12T1", "Test Student", "ST001", known_encoding)
         
-        # Mock face_distance to return 0 (perfect match)
-        with patch('face_recognition.face_distance', return_value=np.array([0.0])):
-            result = service._match_face_sync(known_encoding.copy())
+        # Identical encoding (perfect match)
+        result = service._match_face_sync(known_encoding.copy())
         
         assert result is not None
         assert result["student_id"] == str(student_id)
@@ -125,22 +605,22 @@ class TestFaceServiceMatchingSync:
         # Create a base encoding
         base_encoding = np.zeros(128)
         
-        # Add two students
-        encoding1 = base_encoding + 0.1
+        # Add two students at distances 0.1 and 0.3 from the base
+        encoding1 = base_encoding.copy()
+        encoding1[0] = 0.1
         student_id1 = uuid4()
         service._add_student_encoding_sync(student_id1, "12T1", "Student 1", "ST001", encoding1)
         
-        encoding2 = base_encoding + 0.3
+        encoding2 = base_encoding.copy()
+        encoding2[0] = 0.3
         student_id2 = uuid4()
         service._add_student_encoding_sync(student_id2, "12T1", "Student 2", "ST002", encoding2)
         
-        # Mock face_distance to return distances [0.1, 0.3]
-        with patch('face_recognition.face_distance', return_value=np.array([0.1, 0.3])):
-            result = service._match_face_sync(base_encoding)
+        result = service._match_face_sync(base_encoding)
         
         assert result is not None
         assert result["student_id"] == str(student_id1)  # Closer match
-        assert result["confidence"] == 0.9  # 1 - 0.1
+        assert result["confidence"] == pytest.approx(0.9)  # 1 - 0.1
         
         service.shutdown()
     
@@ -153,9 +633,10 @@ class TestFaceServiceMatchingSync:
         student_id1 = uuid4()
         service._add_student_encoding_sync(student_id1, "12T1", "Student 1", "ST001", encoding1)
         
-        # Mock face_distance to return distance > tolerance
-        with patch('face_recognition.face_distance', return_value=np.array([0.6])):
-            result = service._match_face_sync(np.random.rand(128))
+        # Query at distance 0.6 > tolerance
+        query = encoding1.copy()
+        query[0] += 0.6
+        result = service._match_face_sync(query)
         
         assert result is None  # Should not match
         
@@ -175,12 +656,315 @@ class TestFaceServiceMatchingSync:
         service._add_student_encoding_sync(student_id2, "10T1", "Student 2", "ST002", encoding2)
         
         # Match with class filter - should only check 12T1
-        with patch('face_recognition.face_distance', return_value=np.array([0.2])):
-            result = service._match_face_sync(encoding1, class_name="12T1")
+        result = service._match_face_sync(encoding1, class_name="12T1")
         
         assert result is not None
         assert result["class_name"] == "12T1"
         
+        # Student 1 is not reachable when scoped to another class
+        result = service._match_face_sync(encoding1, class_name="10T1")
+        assert result is None
+        
+        # Scoping to a class without encodings does not widen the search
+        result = service._match_face_sync(encoding1, class_name="11T1")
+        assert result is None
+        
+        service.shutdown()
+    
+    def test_match_face_global_across_classes(self):
+        """Test unscoped matching finds the best student in any class"""
+        service = FaceService(tolerance=0.5)
+        
+        ids = {}
+        encodings = {}
+        for class_name in ("10T1", "11T1", "12T1"):
+            for j in range(3):
+                encoding = np.random.rand(128)
+                student_id = uuid4()
+                service._add_student_encoding_sync(student_id, class_name, f"S{j}", f"{class_name}-{j}", encoding)
+                ids[(class_name, j)] = str(student_id)
+                encodings[(class_name, j)] = encoding
+        
+        query = encodings[("11T1", 2)].copy()
+        query[5] += 0.05
+        result = service._match_face_sync(query)
+        
+        assert result is not None
+        assert result["student_id"] == ids[("11T1", 2)]
+        assert result["class_name"] == "11T1"
+        assert result["student_code"] == "11T1-2"
+        assert result["confidence"] == pytest.approx(0.95, abs=1e-4)
+        
+        service.shutdown()
+    
+    def test_match_faces_batch_agrees_with_single(self):
+        """Test that one batched match returns what per-face matching would"""
+        service = FaceService(tolerance=0.5)
+        encodings = np.random.rand(6, 128)
+        for i, encoding in enumerate(encodings):
+            service._add_student_encoding_sync(uuid4(), "12T1" if i % 2 else "10T1", f"S{i}", f"ST{i}", encoding)
+        queries = [encodings[1] + 0.01, encodings[4] - 0.01, np.full(128, 5.0)]
+        
+        for class_name in (None, "12T1"):
+            batched = service._match_faces_sync(queries, class_name)
+            single = [service._match_face_sync(q, class_name) for q in queries]
+            assert [m and m["student_id"] for m in batched] == [m and m["student_id"] for m in single]
+            for b, m in zip(batched, single):
+                if m is not None:
+                    assert b["confidence"] == pytest.approx(m["confidence"])
+        assert [m and m["student_code"] for m in service._match_faces_sync(queries)] == ["ST1", "ST4", None]
+        assert service._match_faces_sync(queries, "11T1") == [None] * 3
+        assert service._match_faces_sync([]) == []
+        service.shutdown()
+    
+    def test_unscoped_batch_is_one_matrix_product(self):
+        """Test that the default brute-force backend matches all faces of a frame at once"""
+        service = FaceService(tolerance=0.5)
+        encodings = np.random.rand(20, 128)
+        for i, encoding in enumerate(encodings):
+            service._add_student_encoding_sync(uuid4(), f"1{i % 3}T1", f"S{i}", f"ST{i}", encoding)
+        
+        with patch('app.services.encoding_index.nearest_rows', wraps=encoding_index.nearest_rows) as rows, \
+             patch('app.services.matchers.nearest_row', wraps=matchers.nearest_row) as row:
+            matches = service._match_faces_sync(encodings[:4] + 0.01)
+        
+        assert rows.call_count == 1 and row.call_count == 0
+        assert [m["student_code"] for m in matches] == ["ST0", "ST1", "ST2", "ST3"]
+        service.shutdown()
+    
+    def test_global_index_refreshes_after_add(self):
+        """Test that a student added after a match is visible to the next unscoped match"""
+        service = FaceService(tolerance=0.5)
+        service._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", np.random.rand(128))
+        service._match_face_sync(np.random.rand(128))
+        
+        encoding = np.random.rand(128)
+        student_id = uuid4()
+        service._add_student_encoding_sync(student_id, "10T1", "Student 2", "ST002", encoding)
+        result = service._match_face_sync(encoding)
+        
+        assert result is not None
+        assert result["student_id"] == str(student_id)
+        
+        service.shutdown()
+
+
+def jpeg_bytes(width, height):
+    """Encode a random RGB frame as JPEG"""
+    buffer = io.BytesIO()
+    pixels = (np.random.rand(height, width, 3) * 255).astype(np.uint8)
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestTopKMatching:
+    """Test top-k candidates and margin-based ambiguity rejection"""
+    
+    @staticmethod
+    def along(distance):
+        return np.eye(128)[0] * distance
+    
+    def test_topk_returns_distinct_students_in_order(self):
+        service = FaceService()
+        ids = [uuid4() for _ in range(4)]
+        # Student 0 has three templates closer than anyone else
+        service._add_student_templates_sync(ids[0], "12T1", "S0", "ST0", [self.along(d) for d in (0.1, 0.11, 0.12)])
+        for i, d in ((1, 0.3), (2, 0.2), (3, 0.9)):
+            service._add_student_encoding_sync(ids[i], "10T1" if i == 3 else "12T1", f"S{i}", f"ST{i}", self.along(d))
+        
+        candidates = service._match_face_topk_sync(np.zeros(128), k=3)
+        
+        assert [c["student_code"] for c in candidates] == ["ST0", "ST2", "ST1"]
+        assert [c["distance"] for c in candidates] == pytest.approx([0.1, 0.2, 0.3])
+        assert service._match_face_topk_sync(np.zeros(128), k=10, class_name="10T1")[0]["student_code"] == "ST3"
+        assert len(service._match_face_topk_sync(np.zeros(128), k=10)) == 4
+        assert service._match_face_topk_sync(np.zeros(128), class_name="11T1") == []
+        service.shutdown()
+    
+    def test_topk_matches_full_sort(self):
+        rng = np.random.default_rng(1)
+        entry = ClassEncodings()
+        ids = [f"s{i}" for i in rng.integers(0, 50, size=200)]
+        matrix = rng.random((200, 128)).astype(np.float32)
+        entry.extend(matrix, ids, ids, ids)
+        query = rng.random(128).astype(np.float32)
+        
+        for top_k in (1, 2):
+            rows, distances = entry.nearest_students(query, 5, top_k)
+            d = np.linalg.norm(matrix - query, axis=1)
+            scores = sorted(np.sort(d[np.array(ids) == sid])[:top_k].mean() for sid in set(ids))
+            assert distances == pytest.approx(scores[:5], abs=1e-5)
+            assert len({entry.student_ids[row] for row in rows}) == 5
+    
+    def test_topk_templates_match_brute_force_with_bound(self):
+        rng = np.random.default_rng(2)
+        entry = ClassEncodings()
+        ids = [f"s{i}" for i in rng.integers(0, 40, size=300)]
+        matrix = rng.random((300, 128)).astype(np.float32)
+        entry.extend(matrix, ids, ids, ids)
+        query = rng.random(128).astype(np.float32)
+        d = np.linalg.norm(matrix - query, axis=1)
+        owners = np.array(ids)
+        
+        for top_k, bound in ((2, np.inf), (3, np.inf), (3, np.median(d)), (2, d.min() - 1)):
+            scores = sorted(
+                np.sort(d[owners == sid])[:top_k].mean() for sid in set(ids) if d[owners == sid].min() <= bound
+            )
+            rows, distances = entry.nearest_students(query, 4, top_k, bound)
+            assert distances == pytest.approx(scores[:4], abs=1e-5)
+    
+    def test_topk_templates_widen_until_exact(self):
+        entry = ClassEncodings()
+        # The two closest rows belong to s0 and s1, but s2 (outside them) has the best mean
+        rows = [("s0", 0.1), ("s0", 5.0), ("s1", 0.2), ("s1", 0.3), ("s2", 0.21), ("s2", 0.22)]
+        entry.extend(np.array([self.along(dist) for _, dist in rows], dtype=np.float32),
+                     *([[sid for sid, _ in rows]] * 3))
+        
+        found, distances = entry.nearest_students(np.zeros(128, dtype=np.float32), 1, 2)
+        
+        assert entry.student_ids[found[0]] == "s2"
+        assert distances == pytest.approx([0.215])
+    
+    def test_margin_rejects_ambiguous_match(self):
+        service = FaceService(tolerance=0.5, match_margin=0.05)
+        service._add_student_encoding_sync(uuid4(), "12T1", "S1", "ST1", self.along(0.20))
+        service._add_student_encoding_sync(uuid4(), "12T1", "S2", "ST2", self.along(-0.22))
+        
+        assert service._match_face_sync(np.zeros(128)) is None
+        assert service._match_face_sync(np.zeros(128), "12T1") is None
+        assert service.ambiguous_rejections == 2
+        # A clear winner still matches
+        assert service._match_face_sync(self.along(0.1))["student_code"] == "ST1"
+        service.match_margin = 0
+        assert service._match_face_sync(np.zeros(128))["student_code"] == "ST1"
+        service.shutdown()
+    
+    @pytest.mark.asyncio
+    async def test_debug_match_not_counted_as_ambiguous(self):
+        service = FaceService(tolerance=0.5, match_margin=0.05)
+        service._add_student_encoding_sync(uuid4(), "12T1", "S1", "ST1", self.along(0.20))
+        service._add_student_encoding_sync(uuid4(), "12T1", "S2", "ST2", self.along(-0.22))
+        
+        assert not (await service.match_face(np.zeros(128), count=False)).matched
+        assert service.ambiguous_rejections == 0
+        assert not (await service.match_face(np.zeros(128))).matched
+        assert service.ambiguous_rejections == 1
+        service.shutdown()
+    
+    def test_margin_ignores_other_templates_of_same_student(self):
+        service = FaceService(tolerance=0.5, match_margin=0.05)
+        service._add_student_templates_sync(uuid4(), "12T1", "S1", "ST1", [self.along(0.20), self.along(0.21)])
+        service._add_student_encoding_sync(uuid4(), "12T1", "S2", "ST2", self.along(0.9))
+        
+        assert service._match_face_sync(np.zeros(128))["student_code"] == "ST1"
+        service.shutdown()
+
+
+class TestFaceDetectionScaling:
+    """Test detection on a downscaled frame with full-resolution encoding"""
+    
+    def test_scale_box_clamps_to_image(self):
+        """Test box upscaling and clamping"""
+        assert scale_box((10, 50, 40, 20), 2.0, 600, 800) == (20, 100, 80, 40)
+        assert scale_box((0, 420, 310, 0), 2.0, 600, 800) == (0, 800, 600, 0)
+    
+    def test_invalid_detection_scale(self):
+        """Test that out-of-range detection scales are rejected"""
+        with pytest.raises(ValueError):
+            FaceService(detection_scale=0)
+        with pytest.raises(ValueError):
+            FaceService(detection_scale=1.5)
+    
+    def test_invalid_encode_executor(self):
+        """Test that unknown encode executor modes are rejected"""
+        with pytest.raises(ValueError):
+            FaceService(encode_executor="fiber")
+    
+    def test_encode_detects_on_scaled_frame(self):
+        """Test that detection sees the reduced decode and encoding a full-res crop"""
+        service = FaceService(detection_scale=0.5, detection_model="hog", detection_upsample=0)
+        frame = jpeg_bytes(800, 600)
+        expected = np.random.rand(128)
+        
+        with patch('app.services.face_encoder.face_recognition') as fr:
+            # Two faces on the 400x300 frame; the larger one should be encoded
+            fr.face_locations.return_value = [(10, 60, 60, 10), (100, 250, 250, 100)]
+            fr.api._raw_face_landmarks.return_value = ["landmarks"]
+            fr.api.face_encoder.compute_face_descriptor.return_value = expected
+            
+            result = service._encode_face_sync(frame)
+            
+            small = fr.face_locations.call_args[0][0]
+            assert small.shape[:2] == (300, 400)
+            assert fr.face_locations.call_args[1] == {"number_of_times_to_upsample": 0, "model": "hog"}
+            
+            # Full-res box (200, 500, 500, 200) plus half-box margin, clamped to the frame
+            roi, boxes = fr.api._raw_face_landmarks.call_args[0]
+            assert roi.shape[:2] == (550, 600)
+            assert boxes == [(150, 450, 450, 150)]
+            assert fr.api.face_encoder.compute_face_descriptor.call_args[0][1:] == ("landmarks", 1)
+        
+        np.testing.assert_array_equal(result, expected)
+        service.shutdown()
+    
+    def test_encode_faces_skips_embedding_for_continued_face(self):
+        """Test that a face overlapping a track box is detected but not encoded"""
+        service = FaceService()
+        frame = jpeg_bytes(800, 600)
+        
+        with patch('app.services.face_encoder.face_recognition') as fr:
+            fr.face_locations.return_value = [(100, 250, 250, 100)]
+            fr.api._raw_face_landmarks.side_effect = lambda roi, boxes, model: ["landmarks"] * len(boxes)
+            fr.api.face_encoder.compute_face_descriptor.return_value = np.random.rand(128)
+            
+            continued, = service._encode_faces_sync(frame, 1, [(300, 450, 450, 300), (105, 255, 255, 105)], 0.5)
+            moved, = service._encode_faces_sync(frame, 1, [(300, 450, 450, 300)], 0.5)
+        
+        assert continued.track == 1 and continued.encoding is None
+        assert continued.box == (100, 250, 250, 100)
+        assert moved.track is None and moved.encoding is not None
+        assert fr.api.face_encoder.compute_face_descriptor.call_count == 1
+        service.shutdown()
+    
+    def test_encode_faces_batches_largest_faces(self):
+        """Test that the largest faces share one crop and one batched embedding call"""
+        service = FaceService()
+        frame = jpeg_bytes(800, 600)
+        
+        with patch('app.services.face_encoder.face_recognition') as fr, \
+             patch('app.services.face_encoder.batch_face_encodings') as batch:
+            fr.face_locations.return_value = [(10, 30, 30, 10), (100, 250, 250, 100), (300, 500, 400, 400)]
+            batch.side_effect = lambda roi, boxes, timings: [np.full(128, i, dtype=float) for i in range(len(boxes))]
+            
+            faces = service._encode_faces_sync(frame, 2, [], 0.5)
+        
+        assert [face.box for face in faces] == [(100, 250, 250, 100), (300, 500, 400, 400)]
+        roi, roi_boxes, _ = batch.call_args.args
+        # Union of both faces plus half-box margins: x 25..550, y 25..450
+        assert roi.shape[:2] == (425, 525)
+        assert roi_boxes == [(75, 225, 225, 75), (275, 475, 375, 375)]
+        assert [face.encoding[0] for face in faces] == [0, 1]
+        service.shutdown()
+    
+    def test_decode_for_detection_uses_reduced_size(self):
+        """Test that JPEG frames are decoded directly at the detection scale"""
+        service = FaceService(detection_scale=0.25)
+        small, full_size = service.encoder.decode_for_detection(jpeg_bytes(800, 600))
+        
+        assert full_size == (800, 600)
+        assert small.shape == (150, 200, 3)
+        service.shutdown()
+    
+    def test_encode_no_face(self):
+        """Test that no detection returns None without computing encodings"""
+        service = FaceService(detection_scale=0.25)
+        
+        with patch('app.services.face_encoder.face_recognition') as fr:
+            fr.face_locations.return_value = []
+            
+            assert service._encode_face_sync(jpeg_bytes(800, 600)) is None
+            fr.api.face_encoder.compute_face_descriptor.assert_not_called()
+        
         service.shutdown()
 
 
@@ -208,6 +992,34 @@ class TestFaceServiceSerializationRoundTrip:
         deserialized = pickle.loads(serialized)
         
         assert np.array_equal(original_encoding, deserialized)
+    
+    def test_compact_round_trip(self):
+        """Test the compact float32 storage format"""
+        original_encoding = np.random.rand(128)
+        
+        serialized = encode_encoding(original_encoding)
+        
+        assert len(serialized) == ENCODING_NBYTES == 512
+        assert np.array_equal(decode_encoding(serialized), original_encoding.astype(np.float32))
+    
+    def test_compact_is_little_endian(self):
+        serialized = encode_encoding(np.array([1.0] + [0.0] * 127))
+        assert serialized[:4] == b'\x00\x00\x80\x3f'
+    
+    def test_decode_accepts_legacy_pickle(self):
+        original_encoding = np.random.rand(128)
+        assert np.allclose(decode_encoding(pickle.dumps(original_encoding)), original_encoding, atol=1e-6)
+    
+    def test_decode_compact_batch(self):
+        encodings = np.random.rand(5, 128).astype(np.float32)
+        blobs = [encode_encoding(e) for e in encodings]
+        
+        assert np.array_equal(decode_compact_batch(blobs), encodings)
+        assert decode_compact_batch([]).shape == (0, 128)
+    
+    def test_split_by_format(self):
+        blobs = [encode_encoding(np.zeros(128)), pickle.dumps(np.zeros(128)), encode_encoding(np.ones(128))]
+        assert split_by_format(blobs) == ([0, 2], [1])
 
 
 class TestMatchResult:
@@ -261,6 +1073,20 @@ class TestThreadPoolExecutor:
         service = FaceService(max_workers=2)
         assert service.executor._max_workers == 2
         service.shutdown()
+    
+    def test_thread_mode_has_no_process_pool(self):
+        """Test that encoding shares the thread pool by default"""
+        service = FaceService()
+        assert service.encode_executor_mode == "thread"
+        assert service.encode_executor is None
+        service.shutdown()
+    
+    def test_process_mode_worker_count(self):
+        """Test that process mode creates a separate encode pool"""
+        service = FaceService(encode_executor="process", encode_workers=3)
+        assert service.encode_executor._max_workers == 3
+        assert service.executor._max_workers == 4
+        service.shutdown()
 
 
 if __name__ == "__main__":
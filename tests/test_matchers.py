@@ -0,0 +1,102 @@
+"""
+Unit tests for the nearest-neighbour matcher backends.
+"""
+
+import pytest
+import numpy as np
+from uuid import uuid4
+from unittest.mock import MagicMock
+import sys
+
+# Mock face_recognition module if not available
+if 'face_recognition' not in sys.modules:
+    sys.modules['face_recognition'] = MagicMock()
+
+from app.services.matchers import BruteForceMatcher, IVFMatcher, build_matcher, kmeans
+from app.services.face_service import FaceService
+
+
+def clustered_encodings(rows, groups=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0.0, 0.08, size=(groups, 128))
+    matrix = centres[rng.integers(0, groups, size=rows)] + rng.normal(0.0, 0.06, size=(rows, 128))
+    matrix = matrix.astype(np.float32)
+    return matrix, np.einsum("ij,ij->i", matrix, matrix)
+
+
+class TestBuildMatcher:
+    """Test matcher factory selection"""
+    
+    def test_brute_backend(self):
+        matrix, sq_norms = clustered_encodings(100)
+        assert isinstance(build_matcher("brute", matrix, sq_norms), BruteForceMatcher)
+    
+    def test_ivf_falls_back_below_min_rows(self):
+        matrix, sq_norms = clustered_encodings(100)
+        matcher = build_matcher("ivf", matrix, sq_norms, min_rows=1000)
+        assert isinstance(matcher, BruteForceMatcher)
+    
+    def test_unknown_backend_rejected(self):
+        matrix, sq_norms = clustered_encodings(10)
+        with pytest.raises(ValueError):
+            build_matcher("annoy", matrix, sq_norms)
+    
+    def test_ivf_reuses_previous_centroids(self):
+        matrix, sq_norms = clustered_encodings(2000)
+        first = build_matcher("ivf", matrix[:1500], sq_norms[:1500], n_probe=4)
+        second = build_matcher("ivf", matrix, sq_norms, previous=first, n_probe=4)
+        assert second.centroids is first.centroids
+        assert second.matrix.shape[0] == 2000
+
+
+class TestIVFMatcher:
+    """Test IVF search quality against exact search"""
+    
+    def test_kmeans_centroid_shape(self):
+        matrix, _ = clustered_encodings(500)
+        centroids = kmeans(matrix, 16, n_iter=3)
+        assert centroids.shape == (16, 128)
+        assert centroids.dtype == np.float32
+    
+    def test_recall_against_brute_force(self):
+        matrix, sq_norms = clustered_encodings(5000)
+        rng = np.random.default_rng(1)
+        picks = rng.integers(0, 5000, size=200)
+        queries = (matrix[picks] + rng.normal(0.0, 0.02, size=(200, 128))).astype(np.float32)
+        
+        brute = BruteForceMatcher(matrix, sq_norms)
+        ivf = IVFMatcher(matrix, sq_norms, n_probe=8)
+        
+        agree = 0
+        for query in queries:
+            expected = brute.nearest(query)
+            found = ivf.nearest(query)
+            if found[0] == expected[0]:
+                agree += 1
+                assert found[1] == pytest.approx(expected[1], abs=1e-5)
+        assert agree / len(queries) >= 0.95
+    
+    def test_empty_matrix(self):
+        matcher = IVFMatcher(np.empty((0, 128), np.float32), np.empty(0, np.float32), n_lists=4)
+        assert matcher.nearest(np.zeros(128, np.float32)) is None
+
+
+class TestFaceServiceIVF:
+    """Test FaceService with the IVF backend enabled"""
+    
+    def test_match_with_ivf_backend(self):
+        service = FaceService(matcher_backend="ivf", matcher_min_rows=0, matcher_params={"n_probe": 4})
+        matrix, _ = clustered_encodings(600)
+        ids = []
+        for i, encoding in enumerate(matrix):
+            student_id = uuid4()
+            ids.append(str(student_id))
+            service._add_student_encoding_sync(student_id, f"C{i % 6}", f"S{i}", f"ST{i}", encoding)
+        
+        result = service._match_face_sync(matrix[123])
+        
+        assert result is not None
+        assert result["student_id"] == ids[123]
+        assert result["class_name"] == "C3"
+        assert isinstance(service._matcher, IVFMatcher)
+        service.shutdown()
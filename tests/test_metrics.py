@@ -0,0 +1,123 @@
+"""
+Unit tests for recognition metrics and the /metrics endpoint
+"""
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+import sys
+
+# Mock face_recognition module if not available
+if 'face_recognition' not in sys.modules:
+    sys.modules['face_recognition'] = MagicMock()
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import metrics as metrics_router
+from app.routers import ws_camera
+from app.services.face_encoder import DetectedFace
+from app.services.face_service import MatchResult
+from app.services.metrics import FRAMES, FACES, STAGE_SECONDS, LabelLimiter, MetricsRegistry
+
+
+class TestMetricsRegistry:
+    """Test the text exposition format"""
+
+    def test_counter_per_label_set(self):
+        registry = MetricsRegistry()
+        frames = registry.counter("frames_total", "Frames", ["device", "status"])
+        frames.inc(device="cam1", status="recognized")
+        frames.inc(2, device="cam1", status="recognized")
+        frames.inc(device='cam"2', status="no_face")
+
+        lines = registry.render().splitlines()
+
+        assert lines[:2] == ["# HELP frames_total Frames", "# TYPE frames_total counter"]
+        assert 'frames_total{device="cam1",status="recognized"} 3' in lines
+        assert 'frames_total{device="cam\\"2",status="no_face"} 1' in lines
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        stages = registry.histogram("stage_seconds", "Stages", ["stage"], buckets=(0.01, 0.1))
+        for value in (0.005, 0.05, 0.05, 3.0):
+            stages.observe(value, stage="detect")
+
+        lines = registry.render().splitlines()
+
+        assert 'stage_seconds_bucket{stage="detect",le="0.01"} 1' in lines
+        assert 'stage_seconds_bucket{stage="detect",le="0.1"} 3' in lines
+        assert 'stage_seconds_bucket{stage="detect",le="+Inf"} 4' in lines
+        assert 'stage_seconds_count{stage="detect"} 4' in lines
+        assert any(line.startswith('stage_seconds_sum{stage="detect"} 3.10') for line in lines)
+
+    def test_wrong_labels_rejected(self):
+        registry = MetricsRegistry()
+        frames = registry.counter("frames_total", "Frames", ["device"])
+        with pytest.raises(ValueError):
+            frames.inc(camera="cam1")
+        with pytest.raises(ValueError):
+            registry.counter("frames_total", "Again")
+
+    def test_callback_read_at_scrape_and_errors_isolated(self):
+        registry = MetricsRegistry()
+        depth = {"thread": 0}
+        registry.callback("queue_depth", "Depth", lambda: {(k,): v for k, v in depth.items()}, ["executor"])
+        registry.callback("broken", "Fails", lambda: 1 / 0)
+        registry.callback("shed_total", "Shed", lambda: 7, kind="counter")
+
+        depth["thread"] = 5
+        text = registry.render()
+
+        assert 'queue_depth{executor="thread"} 5' in text
+        assert "# TYPE shed_total counter\nshed_total 7" in text
+        assert "broken" not in text
+
+    def test_label_limiter_caps_distinct_values(self):
+        devices = LabelLimiter(2)
+
+        assert [devices(d) for d in ("cam1", "cam2", "cam3", "cam1", "other")] == ["cam1", "cam2", "other", "cam1", "other"]
+        assert LabelLimiter(0)("cam1") == "other"
+
+
+class TestMetricsEndpoint:
+    """Test /metrics and what the camera path records"""
+
+    def test_metrics_endpoint(self):
+        app = FastAPI()
+        app.include_router(metrics_router.router)
+
+        response = TestClient(app).get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE recognition_stage_seconds histogram" in response.text
+        assert 'executor_queue_depth{executor="thread"}' in response.text
+        assert "# TYPE attendance_records_total counter" in response.text
+
+    def test_camera_frames_counted_per_device(self):
+        face_service = MagicMock()
+        face_service.encode_faces = AsyncMock(side_effect=[
+            [],
+            [DetectedFace((0, 300, 300, 0), [0.0] * 128)]
+        ])
+        face_service.match_faces = AsyncMock(return_value=[
+            MatchResult(True, "s1", "Student 1", "ST001", "12T1", 0.8, class_id="c-12t1")
+        ])
+        matches_before = STAGE_SECONDS.count(stage="match")
+        app = FastAPI()
+        app.include_router(ws_camera.router)
+
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera, 'get_api_key_class', return_value=None), \
+             patch.object(ws_camera, 'face_service', face_service), \
+             patch.object(ws_camera, 'attendance_writer', MagicMock()):
+            with TestClient(app).websocket_connect("/ws/camera?api_key=k&device_id=metrics-cam") as ws:
+                ws.send_bytes(b"jpeg")
+                assert ws.receive_json()["status"] == "no_face"
+                ws.send_bytes(b"jpeg")
+                assert ws.receive_json()["status"] == "recognized"
+
+        assert FRAMES.value(device="metrics-cam", status="no_face") == 1
+        assert FRAMES.value(device="metrics-cam", status="recognized") == 1
+        assert FACES.value(device="metrics-cam", status="recognized") == 1
+        assert STAGE_SECONDS.count(stage="match") == matches_before + 1
@@ -0,0 +1,79 @@
+"""
+Unit tests for motion gating of camera frames
+"""
+
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from unittest.mock import patch
+
+from app.services import motion_gate as motion_gate_module
+from app.services.motion_gate import MotionGate, frame_thumbnail
+
+
+def jpeg(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(array.astype(np.uint8)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def hallway():
+    rng = np.random.default_rng(0)
+    # Smooth background so JPEG noise stays small
+    background = np.linspace(40, 200, 640)[None, :, None].repeat(480, axis=0).repeat(3, axis=2)
+    return background + rng.normal(scale=1.0, size=background.shape)
+
+
+class TestFrameThumbnail:
+    """Test thumbnail decoding"""
+
+    def test_thumbnail_shape(self, hallway):
+        thumbnail = frame_thumbnail(jpeg(hallway), size=16)
+        assert thumbnail.shape == (16, 16)
+        assert thumbnail.dtype == np.float32
+
+    def test_undecodable_frame(self):
+        assert frame_thumbnail(b"not a jpeg") is None
+
+
+class TestMotionGate:
+    """Test change detection against the last recognized frame"""
+
+    def test_static_scene_skipped_until_change(self, hallway):
+        gate = MotionGate(threshold=4.0)
+        first = gate.thumbnail(jpeg(hallway))
+        assert gate.changed(first)
+        gate.accept(first)
+
+        assert not gate.changed(gate.thumbnail(jpeg(hallway + 1)))
+        person = hallway.copy()
+        person[100:400, 200:400] = 20
+        assert gate.changed(gate.thumbnail(jpeg(person)))
+        assert gate.skipped == 1
+
+    def test_slow_drift_accumulates(self, hallway):
+        gate = MotionGate(threshold=4.0)
+        gate.accept(gate.thumbnail(jpeg(hallway)))
+
+        # Each step is below threshold, but the reference is not advanced
+        decisions = [gate.changed(gate.thumbnail(jpeg(hallway + step))) for step in (2, 4, 6, 8)]
+        assert decisions[0] is False
+        assert decisions[-1] is True
+
+    def test_undecodable_and_disabled_always_changed(self, hallway):
+        gate = MotionGate(threshold=4.0)
+        gate.accept(gate.thumbnail(jpeg(hallway)))
+        assert gate.changed(None)
+        assert MotionGate(threshold=0).changed(frame_thumbnail(jpeg(hallway)))
+
+    def test_max_idle_forces_recognition(self, hallway):
+        gate = MotionGate(threshold=4.0, max_idle=10)
+        thumbnail = gate.thumbnail(jpeg(hallway))
+        with patch.object(motion_gate_module.time, 'monotonic', return_value=100.0):
+            gate.accept(thumbnail)
+        with patch.object(motion_gate_module.time, 'monotonic', return_value=105.0):
+            assert not gate.changed(thumbnail)
+        with patch.object(motion_gate_module.time, 'monotonic', return_value=111.0):
+            assert gate.changed(thumbnail)
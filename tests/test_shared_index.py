@@ -0,0 +1,149 @@
+"""
+Unit tests for sharing the encoding index between worker processes
+
+Two FaceService instances on one directory stand in for two workers; flock
+locks belong to open file descriptions, so they exclude each other in-process.
+"""
+
+import asyncio
+import sys
+import numpy as np
+import pytest
+from uuid import uuid4
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Mock face_recognition module if not available
+if 'face_recognition' not in sys.modules:
+    sys.modules['face_recognition'] = MagicMock()
+
+from app.services.face_service import FaceService
+from app.services.shared_index import SharedEncodingIndex, check_shared_config
+
+
+@pytest.fixture
+def workers(tmp_path):
+    leader = FaceService(shared_index_dir=str(tmp_path), shared_poll_interval=0.01)
+    follower = FaceService(shared_index_dir=str(tmp_path), shared_poll_interval=0.01)
+    yield leader, follower
+    leader.shutdown()
+    follower.shutdown()
+
+
+class TestSharedEncodingIndex:
+    """Test leader election and generations"""
+
+    def test_single_leader(self, tmp_path):
+        first, second = SharedEncodingIndex(str(tmp_path)), SharedEncodingIndex(str(tmp_path))
+
+        assert first.try_lead()
+        assert first.try_lead()
+        assert not second.try_lead()
+        first.release()
+        assert second.try_lead()
+        second.release()
+
+    def test_generation_increments(self, tmp_path):
+        index = SharedEncodingIndex(str(tmp_path))
+        assert index.read_generation() == 0
+        assert index.read() is None
+
+        index.try_lead()
+        assert index.publish({}, {"12T1": "id-12"}) == 1
+        assert index.publish({}, {"12T1": "id-12"}) == 2
+        assert index.read().generation == 2
+        assert index.read().class_ids == {"12T1": "id-12"}
+        index.release()
+
+    def test_follower_cannot_publish(self, tmp_path):
+        with pytest.raises(RuntimeError):
+            SharedEncodingIndex(str(tmp_path)).publish({}, {})
+
+
+class TestSharedFaceService:
+    """Test workers mapping one published matrix"""
+
+    @pytest.mark.asyncio
+    async def test_follower_maps_leader_generation(self, workers):
+        leader, follower = workers
+        assert leader.shared_index.try_lead()
+        encoding = np.random.rand(128)
+        class_id = uuid4()
+        leader._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", encoding, class_id)
+        await leader._publish_shared()
+
+        await follower.load_all_encodings()
+
+        assert not follower.manages_encodings
+        assert follower.generation == leader.generation == 1
+        assert follower.class_ids == {"12T1": str(class_id)}
+        result = follower._match_face_sync(encoding)
+        assert result["student_code"] == "ST001"
+        assert result["class_id"] == str(class_id)
+        # Both the class view and the unscoped matrix are read-only file mappings
+        for matrix in (follower.known_encodings["12T1"].matrix, follower._get_global_index().matrix):
+            assert isinstance(matrix, np.memmap)
+            assert not matrix.flags.writeable
+        # The leader maps the same generation instead of keeping a private copy
+        assert isinstance(leader._get_global_index().matrix, np.memmap)
+
+    @pytest.mark.asyncio
+    async def test_attach_defers_matcher_to_first_match(self, workers):
+        leader, follower = workers
+        leader.shared_index.try_lead()
+        encoding = np.random.rand(128)
+        leader._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", encoding, uuid4())
+        await leader._publish_shared()
+
+        with patch.object(follower, '_build_matcher', wraps=follower._build_matcher) as build:
+            await follower.load_all_encodings()
+            assert build.call_count == 0
+            assert follower._match_face_sync(encoding)["student_code"] == "ST001"
+            follower._match_face_sync(encoding)
+        assert build.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_changes_published_and_followed(self, workers):
+        leader, follower = workers
+        leader.shared_index.try_lead()
+        await leader._publish_shared()
+        await follower.load_all_encodings()
+        leader.start_shared_sync()
+        follower.start_shared_sync()
+
+        encoding = np.random.rand(128)
+        leader._add_student_encoding_sync(uuid4(), "12T1", "Student 1", "ST001", encoding, uuid4())
+        await asyncio.sleep(0.1)
+
+        assert leader.generation == follower.generation == 2
+        assert follower._match_face_sync(encoding)["student_code"] == "ST001"
+
+    @pytest.mark.asyncio
+    async def test_follower_takes_over(self, workers):
+        leader, follower = workers
+        leader.shared_index.try_lead()
+        await leader._publish_shared()
+        await follower.load_all_encodings()
+
+        leader.shutdown()
+        with patch.object(follower, 'load_all_encodings', AsyncMock()) as load:
+            follower.start_shared_sync()
+            await asyncio.sleep(0.05)
+
+        assert follower.manages_encodings
+        load.assert_awaited()
+
+
+class TestSharedConfig:
+    """Test rejection of unsafe shared index configurations"""
+
+    def test_requires_cache_sync(self, tmp_path):
+        with pytest.raises(ValueError, match="CACHE_SYNC_ENABLED"):
+            check_shared_config(str(tmp_path / "shared"), "", cache_sync_enabled=False)
+
+    def test_rejects_snapshot_dir_collision(self, tmp_path):
+        with pytest.raises(ValueError, match="different directories"):
+            check_shared_config(str(tmp_path), str(tmp_path) + "/", cache_sync_enabled=True)
+
+    def test_valid_configurations(self, tmp_path):
+        check_shared_config("", "", cache_sync_enabled=False)
+        check_shared_config(str(tmp_path / "shared"), str(tmp_path / "snapshot"), cache_sync_enabled=True)
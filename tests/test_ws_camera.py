@@ -0,0 +1,304 @@
+"""
+Unit tests for the /ws/camera WebSocket endpoint.
+
+Tests Requirements: 1.2, 1.3, 18.1
+"""
+
+import asyncio
+import io
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock, patch
+import sys
+
+# Mock face_recognition module if not available
+if 'face_recognition' not in sys.modules:
+    sys.modules['face_recognition'] = MagicMock()
+
+from PIL import Image
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import ws_camera
+from app.routers.ws_camera import FrameMailbox
+from app.services.face_encoder import DetectedFace, box_iou
+from app.services.face_tracker import FaceTracker
+from app.services.face_service import MatchResult
+from app.services.attendance_service import AttendanceCooldown
+
+
+class TestFrameMailbox:
+    """Test the latest-frame-wins mailbox"""
+    
+    @pytest.mark.asyncio
+    async def test_newest_frame_wins(self):
+        mailbox = FrameMailbox()
+        mailbox.put(b"1")
+        mailbox.put(b"2")
+        mailbox.put(b"3")
+        
+        assert await mailbox.get() == b"3"
+        assert mailbox.received == 3
+        assert mailbox.dropped == 2
+        assert mailbox.processed == 1
+    
+    @pytest.mark.asyncio
+    async def test_get_waits_for_frame(self):
+        mailbox = FrameMailbox()
+        getter = asyncio.create_task(mailbox.get())
+        await asyncio.sleep(0)
+        assert not getter.done()
+        
+        mailbox.put(b"frame")
+        assert await asyncio.wait_for(getter, 1) == b"frame"
+    
+    @pytest.mark.asyncio
+    async def test_close_drains_then_returns_none(self):
+        mailbox = FrameMailbox()
+        mailbox.put(b"last")
+        mailbox.close()
+        
+        assert await mailbox.get() == b"last"
+        assert await mailbox.get() is None
+
+
+BOX = (10, 60, 60, 10)
+
+
+def camera_client():
+    app = FastAPI()
+    app.include_router(ws_camera.router)
+    return TestClient(app)
+
+
+class TestCameraEndpoint:
+    """Test the camera WebSocket protocol"""
+    
+    def test_invalid_key_rejected(self):
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=False):
+            client = camera_client()
+            with pytest.raises(Exception):
+                with client.websocket_connect("/ws/camera?api_key=bad&device_id=cam1") as ws:
+                    ws.receive_json()
+    
+    def test_no_face_response(self):
+        face_service = MagicMock()
+        face_service.encode_faces = AsyncMock(return_value=[])
+        
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera, 'get_api_key_class', return_value=None), \
+             patch.object(ws_camera, 'face_service', face_service):
+            client = camera_client()
+            with client.websocket_connect("/ws/camera?api_key=k&device_id=cam1") as ws:
+                ws.send_bytes(b"jpeg")
+                response = ws.receive_json()
+        
+        assert response["status"] == "no_face"
+        assert response["device_id"] == "cam1"
+    
+    def test_slow_recognition_processes_latest_frame(self):
+        """Frames sent during a slow recognition collapse to the newest one"""
+        seen = []
+        
+        async def slow_encode(data, *args):
+            seen.append(data)
+            await asyncio.sleep(0.2)
+            return [DetectedFace(BOX, np.zeros(128))]
+        
+        face_service = MagicMock()
+        face_service.encode_faces = slow_encode
+        face_service.match_faces = AsyncMock(return_value=[MatchResult(False, None, None, None, None, None)])
+        
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera, 'get_api_key_class', return_value="12T1"), \
+             patch.object(ws_camera, 'face_service', face_service):
+            client = camera_client()
+            with client.websocket_connect("/ws/camera?api_key=k&device_id=cam1") as ws:
+                for i in range(5):
+                    ws.send_bytes(b"frame%d" % i)
+                first = ws.receive_json()
+                second = ws.receive_json()
+        
+        assert first["status"] == "unknown"
+        assert second["status"] == "unknown"
+        assert seen == [b"frame0", b"frame4"]
+        assert face_service.match_faces.await_args.kwargs == {"class_name": "12T1"}
+    
+    def test_repeat_recognition_recorded_once(self):
+        """Repeat recognitions still reply but only the first is saved"""
+        match = MatchResult(True, "s1", "Student 1", "ST001", "12T1", 0.8, class_id="c-12t1")
+        face_service = MagicMock()
+        face_service.encode_faces = AsyncMock(return_value=[DetectedFace(BOX, np.zeros(128))])
+        face_service.match_faces = AsyncMock(return_value=[match])
+        writer = MagicMock()
+        
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera.settings, 'FACE_TRACK_MAX_REUSE', 0), \
+             patch.object(ws_camera, 'get_api_key_class', return_value=None), \
+             patch.object(ws_camera, 'face_service', face_service), \
+             patch.object(ws_camera, 'attendance_cooldown', AttendanceCooldown(ttl=300)), \
+             patch.object(ws_camera, 'attendance_writer', writer):
+            client = camera_client()
+            with client.websocket_connect("/ws/camera?api_key=k&device_id=cam1") as ws:
+                responses = []
+                for _ in range(3):
+                    ws.send_bytes(b"jpeg")
+                    responses.append(ws.receive_json())
+        
+        assert [r["status"] for r in responses] == ["recognized"] * 3
+        assert writer.submit.call_count == 1
+        event = writer.submit.call_args[0][0]
+        assert (event.student_id, event.class_id, event.device_id) == ("s1", "c-12t1", "cam1")
+    
+    def test_rejected_submit_does_not_start_cooldown(self):
+        """A record the writer could not queue is attempted again on the next frame"""
+        match = MatchResult(True, "s1", "Student 1", "ST001", "12T1", 0.8, class_id="c-12t1")
+        face_service = MagicMock()
+        face_service.encode_faces = AsyncMock(return_value=[DetectedFace(BOX, np.zeros(128))])
+        face_service.match_faces = AsyncMock(return_value=[match])
+        writer = MagicMock()
+        writer.submit.side_effect = [False, True, True]
+        cooldown = AttendanceCooldown(ttl=300)
+        
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera.settings, 'FACE_TRACK_MAX_REUSE', 0), \
+             patch.object(ws_camera, 'get_api_key_class', return_value=None), \
+             patch.object(ws_camera, 'face_service', face_service), \
+             patch.object(ws_camera, 'attendance_cooldown', cooldown), \
+             patch.object(ws_camera, 'attendance_writer', writer):
+            client = camera_client()
+            with client.websocket_connect("/ws/camera?api_key=k&device_id=cam1") as ws:
+                for _ in range(3):
+                    ws.send_bytes(b"jpeg")
+                    ws.receive_json()
+        
+        # Queue full on the first frame, queued on the second, cooling down on the third
+        assert writer.submit.call_count == 2
+        assert cooldown.suppressed == 1
+    
+    def test_busy_response_when_shed(self):
+        scheduler = MagicMock()
+        scheduler.run = AsyncMock(side_effect=ws_camera.RecognitionBusy())
+        
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera, 'get_api_key_class', return_value=None), \
+             patch.object(ws_camera, 'recognition_scheduler', scheduler):
+            client = camera_client()
+            with client.websocket_connect("/ws/camera?api_key=k&device_id=cam1") as ws:
+                ws.send_bytes(b"jpeg")
+                response = ws.receive_json()
+        
+        assert response["status"] == "busy"
+        assert scheduler.run.await_args[0][0] == "cam1"
+
+    def test_unchanged_frames_skip_recognition(self):
+        """Identical frames after a recognition reply no_change without encoding"""
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 48), (90, 120, 150)).save(buffer, format="JPEG")
+        frame = buffer.getvalue()
+        face_service = MagicMock()
+        face_service.encode_faces = AsyncMock(return_value=[])
+        
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera, 'get_api_key_class', return_value=None), \
+             patch.object(ws_camera, 'face_service', face_service), \
+             patch.object(ws_camera.settings, 'MOTION_GATE_THRESHOLD', 4.0):
+            client = camera_client()
+            with client.websocket_connect("/ws/camera?api_key=k&device_id=cam1") as ws:
+                responses = []
+                for _ in range(3):
+                    ws.send_bytes(frame)
+                    responses.append(ws.receive_json())
+        
+        assert [r["status"] for r in responses] == ["no_face", "no_change", "no_change"]
+        assert face_service.encode_faces.await_count == 1
+
+
+class TestFaceTracking:
+    """Test identity reuse across frames of one connection"""
+    
+    MATCH = MatchResult(True, "s1", "Student 1", "ST001", "12T1", 0.8, class_id="c-12t1")
+    
+    def test_box_iou(self):
+        assert box_iou((0, 10, 10, 0), (0, 10, 10, 0)) == 1.0
+        assert box_iou((0, 10, 10, 0), (0, 20, 10, 10)) == 0.0
+        assert box_iou((0, 10, 10, 0), (0, 15, 10, 5)) == pytest.approx(1 / 3)
+    
+    def test_tracker_reuses_identity_for_bounded_frames(self):
+        tracker = FaceTracker(max_reuse=2)
+        unknown = MatchResult(False, None, None, None, None, None)
+        other = (100, 160, 160, 100)
+        assert tracker.reusable_boxes() == []
+        
+        assert tracker.update([DetectedFace(BOX, np.zeros(128)), DetectedFace(other, np.zeros(128))],
+                              [self.MATCH, unknown]) == [self.MATCH, unknown]
+        # Unknown faces are never reused
+        assert tracker.reusable_boxes() == [BOX]
+        moved = (12, 62, 62, 12)
+        assert tracker.update([DetectedFace(moved, None, 0)], [None]) == [self.MATCH]
+        assert tracker.reusable_boxes() == [moved]
+        tracker.update([DetectedFace(moved, None, 0)], [None])
+        assert tracker.reusable_boxes() == []
+        assert tracker.reused_total == 2
+    
+    @pytest.mark.asyncio
+    async def test_recognize_frame_skips_encoding_while_tracked(self):
+        frames = [
+            [DetectedFace(BOX, np.zeros(128))],
+            [DetectedFace(BOX, None, 0)],
+            [DetectedFace(BOX, None, 0)],
+            [DetectedFace(BOX, np.zeros(128))],
+            [],
+        ]
+        face_service = MagicMock()
+        face_service.encode_faces = AsyncMock(side_effect=frames)
+        face_service.match_faces = AsyncMock(return_value=[self.MATCH])
+        tracker = FaceTracker(max_reuse=2)
+        
+        with patch.object(ws_camera, 'face_service', face_service):
+            results = [await ws_camera.recognize_frame(b"jpeg", None, tracker) for _ in frames]
+        
+        assert results == [[self.MATCH]] * 4 + [[]]
+        assert face_service.match_faces.await_count == 2
+        track_boxes = [c.args[2] for c in face_service.encode_faces.await_args_list]
+        # Third reuse is not offered: the run of max_reuse frames is re-confirmed
+        assert track_boxes == [[], [BOX], [BOX], [], [BOX]]
+        assert tracker.tracks == []
+
+
+class TestMultiFace:
+    """Test frames with several faces"""
+    
+    def test_all_faces_recognized_and_recorded(self):
+        students = [MatchResult(True, f"s{i}", f"Student {i}", f"ST00{i}", "12T1", 0.8, class_id="c-12t1")
+                    for i in (1, 2)]
+        unknown = MatchResult(False, None, None, None, None, None)
+        face_service = MagicMock()
+        face_service.encode_faces = AsyncMock(return_value=[
+            DetectedFace((0, 300, 300, 0), np.zeros(128)),
+            DetectedFace((0, 500, 100, 400), np.ones(128)),
+            DetectedFace((200, 600, 260, 540), np.ones(128)),
+        ])
+        # Class-scoped pass finds one student, the global fallback the other
+        face_service.match_faces = AsyncMock(side_effect=[[unknown, students[0], unknown], [students[1], unknown]])
+        writer = MagicMock()
+        
+        with patch.object(ws_camera, 'is_valid_api_key', return_value=True), \
+             patch.object(ws_camera, 'get_api_key_class', return_value="12T1"), \
+             patch.object(ws_camera.settings, 'FACE_MATCH_GLOBAL_FALLBACK', True), \
+             patch.object(ws_camera, 'face_service', face_service), \
+             patch.object(ws_camera, 'attendance_cooldown', AttendanceCooldown(ttl=300)), \
+             patch.object(ws_camera, 'attendance_writer', writer):
+            client = camera_client()
+            with client.websocket_connect("/ws/camera?api_key=k&device_id=cam1") as ws:
+                ws.send_bytes(b"jpeg")
+                response = ws.receive_json()
+        
+        assert [face["student_id"] for face in response["faces"]] == ["s2", "s1", None]
+        assert [face["status"] for face in response["faces"]] == ["recognized", "recognized", "unknown"]
+        # Top level mirrors the first recognized face for single-face clients
+        assert (response["status"], response["student_id"]) == ("recognized", "s2")
+        assert {call.args[0].student_id for call in writer.submit.call_args_list} == {"s1", "s2"}
+        assert face_service.encode_faces.await_args.args[1] == ws_camera.settings.FACE_MAX_FACES
+        fallback = face_service.match_faces.await_args_list[1]
+        assert len(fallback.args[0]) == 2 and fallback.kwargs == {}